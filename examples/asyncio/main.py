@@ -0,0 +1,29 @@
+import asyncio
+
+import libsql.aio
+
+
+async def count_users(conn):
+    cur = await conn.execute("SELECT COUNT(*) FROM users")
+    return await cur.fetchone()
+
+
+async def main():
+    conn = await libsql.aio.connect("local.db")
+
+    await conn.execute("CREATE TABLE IF NOT EXISTS users (name TEXT);")
+    await conn.executemany(
+        "INSERT INTO users VALUES (?);",
+        [("first@example.com",), ("second@example.com",), ("third@example.com",)],
+    )
+    await conn.commit()
+
+    print(await asyncio.gather(*[count_users(conn) for _ in range(3)]))
+
+    cur = await conn.execute("SELECT * FROM users")
+    print(await cur.fetchall())
+
+    await conn.close()
+
+
+asyncio.run(main())
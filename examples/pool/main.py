@@ -0,0 +1,31 @@
+import threading
+
+import libsql
+
+pool = libsql.Pool("local.db", min_size=2, max_size=4, idle_timeout=60)
+
+conn = pool.acquire()
+conn.execute("CREATE TABLE IF NOT EXISTS users (name TEXT);")
+conn.commit()
+conn.close()
+
+
+def handle_request(i):
+    conn = pool.acquire(timeout=5)
+    conn.execute("INSERT INTO users VALUES (?);", (f"user{i}@example.com",))
+    conn.commit()
+    conn.close()
+
+
+threads = [threading.Thread(target=handle_request, args=(i,)) for i in range(16)]
+for thread in threads:
+    thread.start()
+for thread in threads:
+    thread.join()
+
+conn = pool.acquire()
+print(conn.execute("select count(*) from users").fetchall())
+conn.close()
+
+print(pool.stats())
+pool.close()
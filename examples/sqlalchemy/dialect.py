@@ -57,18 +57,23 @@ class SQLiteDialect_libsql(SQLiteDialect_pysqlite):
 
         return libsql
 
-    def on_connect(self):
-        import libsql
-
-        sqlite3_connect = super().on_connect()
-
-        def connect(conn):
-            # LibSQL: there is no support for create_function()
-            if isinstance(conn, Connection):
-                return
-            return sqlite3_connect(conn)
-
-        return connect
+    def on_connect_url(self, url):
+        # LibSQL: remote connections do not support create_function(),
+        # which is all the pysqlite on_connect hook does
+        if url.host:
+            return None
+        return super().on_connect_url(url)
+
+    def connect(self, *cargs, **cparams):
+        # A libsql.Pool passed as connect_args={"libsql_pool": pool} hands
+        # out connections to one shared database instead of opening the
+        # database again for every connection. Use it with
+        # poolclass=NullPool so that closing returns them to the libsql pool,
+        # and with the remote host in the URL for a pool of a remote database.
+        pool = cparams.pop("libsql_pool", None)
+        if pool is not None:
+            return pool.acquire()
+        return super().connect(*cargs, **cparams)
 
     def create_connect_args(self, url):
         pysqlite_args = (
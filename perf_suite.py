@@ -0,0 +1,259 @@
+#!/usr/bin/env python3
+"""Benchmarks of the binding's hot paths, with stdlib `sqlite3` as baseline.
+
+Every scenario runs against each target the driver supports. Benchmarks are
+named `<target>/<scenario>` regardless of the driver, so that the JSON files
+written by pyperf compare benchmark by benchmark:
+
+    python3 perf-sqlite3.py -o sqlite3.json
+    python3 perf-libsql.py -o libsql.json
+    python3 -m pyperf compare_to sqlite3.json libsql.json --table
+
+Targets (`--target`, repeatable, default `memory` and `file`):
+
+    memory     in-memory database
+    file       database file in a temporary directory
+    encrypted  encrypted database file (libsql only)
+    remote     remote database over HTTP (libsql only); uses `--url`, or a
+               local `tests/hrana_server.py` stand-in started for the run
+    replica    embedded replica of `--sync-url` (libsql only)
+"""
+
+import atexit
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+
+import pyperf
+
+try:
+    import libsql
+except ImportError:
+    libsql = None
+
+TARGETS = ("memory", "file", "encrypted", "remote", "replica")
+SQLITE3_TARGETS = ("memory", "file")
+
+ROWS = [(i, f"user{i}@example.com", i * 0.5) for i in range(1000)]
+BLOB = os.urandom(1 << 20)
+
+_tempdir = None
+_connections = {}
+
+
+def tempdir():
+    global _tempdir
+    if _tempdir is None:
+        _tempdir = tempfile.mkdtemp(prefix="libsql-bench-")
+        atexit.register(shutil.rmtree, _tempdir, ignore_errors=True)
+    return _tempdir
+
+
+def connect(args, target):
+    """Returns the connection of this process for `target`."""
+    if target in _connections:
+        return _connections[target]
+    path = os.path.join(tempdir(), f"{target}.db")
+    if args.driver == "sqlite3":
+        conn = sqlite3.connect(":memory:" if target == "memory" else path)
+    elif target == "memory":
+        conn = libsql.connect(":memory:")
+    elif target == "file":
+        conn = libsql.connect(path)
+    elif target == "encrypted":
+        conn = libsql.connect(path, encryption_key="libsql-bench")
+    elif target == "remote":
+        conn = libsql.connect(args.url, auth_token=args.auth_token)
+    elif target == "replica":
+        conn = libsql.connect(path, sync_url=args.sync_url, auth_token=args.auth_token)
+    _connections[target] = conn
+    return conn
+
+
+def create_table(conn, name, columns, rows=()):
+    conn.execute(f"DROP TABLE IF EXISTS {name}")
+    conn.execute(f"CREATE TABLE {name} ({columns})")
+    if rows:
+        placeholders = ", ".join("?" * len(rows[0]))
+        conn.executemany(f"INSERT INTO {name} VALUES ({placeholders})", rows)
+    conn.commit()
+
+
+def select_1(conn, loops):
+    cur = conn.cursor()
+    started = time.perf_counter()
+    for _ in range(loops):
+        cur.execute("SELECT 1").fetchone()
+    return time.perf_counter() - started
+
+
+def bind_params(conn, loops):
+    cur = conn.cursor()
+    params = (42, 1.5, "alice@example.com", b"\x00" * 16, None)
+    started = time.perf_counter()
+    for _ in range(loops):
+        cur.execute("SELECT ?, ?, ?, ?, ?", params).fetchone()
+    return time.perf_counter() - started
+
+
+def bind_named_params(conn, loops):
+    cur = conn.cursor()
+    params = {"id": 42, "email": "alice@example.com", "score": 1.5}
+    started = time.perf_counter()
+    for _ in range(loops):
+        cur.execute("SELECT :id, :email, :score", params).fetchone()
+    return time.perf_counter() - started
+
+
+def executemany_insert(conn, loops):
+    create_table(conn, "bench_insert", "id INTEGER, email TEXT, score REAL")
+    elapsed = 0.0
+    for _ in range(loops):
+        started = time.perf_counter()
+        conn.executemany("INSERT INTO bench_insert VALUES (?, ?, ?)", ROWS)
+        conn.commit()
+        elapsed += time.perf_counter() - started
+        conn.execute("DELETE FROM bench_insert")
+        conn.commit()
+    return elapsed
+
+
+def insert_commit(conn, loops):
+    create_table(conn, "bench_commit", "id INTEGER, email TEXT, score REAL")
+    started = time.perf_counter()
+    for row in range(loops):
+        conn.execute("INSERT INTO bench_commit VALUES (?, ?, ?)", ROWS[row % len(ROWS)])
+        conn.commit()
+    return time.perf_counter() - started
+
+
+def fetchall_wide(conn, loops):
+    columns = ", ".join(f"c{i}" for i in range(20))
+    create_table(conn, "bench_wide", columns, [tuple(range(i, i + 20)) for i in range(1000)])
+    cur = conn.cursor()
+    started = time.perf_counter()
+    for _ in range(loops):
+        cur.execute("SELECT * FROM bench_wide").fetchall()
+    return time.perf_counter() - started
+
+
+def fetchall_large(conn, loops):
+    rows = [(i, f"user{i}@example.com", i * 0.5) for i in range(10000)]
+    create_table(conn, "bench_large", "id INTEGER, email TEXT, score REAL", rows)
+    cur = conn.cursor()
+    started = time.perf_counter()
+    for _ in range(loops):
+        cur.execute("SELECT * FROM bench_large").fetchall()
+    return time.perf_counter() - started
+
+
+def iterate_rows(conn, loops):
+    create_table(conn, "bench_iter", "id INTEGER, email TEXT, score REAL", ROWS)
+    cur = conn.cursor()
+    started = time.perf_counter()
+    for _ in range(loops):
+        for _row in cur.execute("SELECT * FROM bench_iter"):
+            pass
+    return time.perf_counter() - started
+
+
+def blob_insert(conn, loops):
+    create_table(conn, "bench_blob_insert", "data BLOB")
+    elapsed = 0.0
+    for _ in range(loops):
+        started = time.perf_counter()
+        conn.execute("INSERT INTO bench_blob_insert VALUES (?)", (BLOB,))
+        conn.commit()
+        elapsed += time.perf_counter() - started
+        conn.execute("DELETE FROM bench_blob_insert")
+        conn.commit()
+    return elapsed
+
+
+def blob_select(conn, loops):
+    create_table(conn, "bench_blob_select", "data BLOB", [(BLOB,)])
+    cur = conn.cursor()
+    started = time.perf_counter()
+    for _ in range(loops):
+        cur.execute("SELECT data FROM bench_blob_select").fetchone()
+    return time.perf_counter() - started
+
+
+def sync(conn, loops):
+    started = time.perf_counter()
+    for _ in range(loops):
+        conn.sync()
+    return time.perf_counter() - started
+
+
+SCENARIOS = [
+    select_1,
+    bind_params,
+    bind_named_params,
+    executemany_insert,
+    insert_commit,
+    fetchall_wide,
+    fetchall_large,
+    iterate_rows,
+    blob_insert,
+    blob_select,
+]
+
+
+def scenarios(target):
+    if target == "replica":
+        # Writes go to the primary; measure reads and syncing.
+        return [select_1, bind_params, fetchall_wide, iterate_rows, sync]
+    return SCENARIOS
+
+
+def add_cmdline_args(cmd, args):
+    cmd.extend(("--driver", args.driver))
+    for target in args.target:
+        cmd.extend(("--target", target))
+    for option in ("url", "sync_url", "auth_token"):
+        if getattr(args, option):
+            cmd.extend((f"--{option.replace('_', '-')}", getattr(args, option)))
+
+
+def main(driver="libsql"):
+    runner = pyperf.Runner(add_cmdline_args=add_cmdline_args)
+    parser = runner.argparser
+    parser.add_argument("--driver", choices=("libsql", "sqlite3"), default=driver)
+    parser.add_argument("--target", action="append", choices=TARGETS)
+    parser.add_argument("--url", help="remote database URL for the remote target")
+    parser.add_argument("--sync-url", help="primary URL for the replica target")
+    parser.add_argument("--auth-token", default="")
+    args = runner.parse_args()
+    if not args.target:
+        args.target = ["memory", "file"]
+    if args.driver == "libsql" and libsql is None:
+        parser.error("libsql is not installed; run `maturin develop` first")
+    if args.driver == "sqlite3":
+        args.target = [target for target in args.target if target in SQLITE3_TARGETS]
+    if "replica" in args.target and not args.sync_url:
+        parser.error("the replica target needs --sync-url")
+    if "remote" in args.target and not args.url:
+        # Only the manager process gets here; workers receive --url.
+        sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "tests"))
+        import hrana_server
+
+        server = hrana_server.serve(os.path.join(tempdir(), "remote.db"))
+        args.url = server.url
+    runner.metadata["libsql_driver"] = args.driver
+
+    for target in args.target:
+        for scenario in scenarios(target):
+            runner.bench_time_func(
+                f"{target}/{scenario.__name__}",
+                lambda loops, scenario=scenario, target=target: scenario(
+                    connect(args, target), loops
+                ),
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,545 @@
+//! asyncio flavour of the DB-API objects, exposed as `libsql.aio`.
+//!
+//! Every blocking method returns an awaitable that is backed by a tokio
+//! future running on the shared runtime, so an event loop can keep many
+//! queries in flight without a thread pool.
+//!
+//! Statements of one connection run one at a time: each holds the
+//! connection's async lock from the implicit `BEGIN` to its end, so that
+//! concurrent statements do not both begin a transaction.
+
+use crate::{
+    connect_guard, convert_row, convert_rows, converters::Converters, execute_bulk,
+    execute_statement, open_database, read_rows, replica::Database, runtime, to_params, to_py_err,
+    trace::Fetched, transaction, CachedStatement, ConnectionGuard, ConnectionRuntime,
+    DEFAULT_CACHED_STATEMENTS,
+};
+use ::libsql as libsql_core;
+use pyo3::exceptions::PyValueError;
+use pyo3::prelude::*;
+use pyo3::types::PyTuple;
+use std::sync::{Arc, Mutex, Once};
+use std::time::Instant;
+use tokio::sync::Mutex as AsyncMutex;
+
+/// Hands the shared runtime to pyo3-asyncio before the first future is
+/// bridged into the event loop.
+fn init_runtime() {
+    static INIT: Once = Once::new();
+    INIT.call_once(|| {
+        let _ = pyo3_asyncio::tokio::init_with_runtime(runtime());
+    });
+}
+
+fn future_into_py<'py, F, T>(py: Python<'py>, fut: F) -> PyResult<&'py PyAny>
+where
+    F: std::future::Future<Output = PyResult<T>> + Send + 'static,
+    T: IntoPy<PyObject>,
+{
+    init_runtime();
+    pyo3_asyncio::tokio::future_into_py(py, fut)
+}
+
+/// The error for attributes of the synchronous API that `libsql.aio` does
+/// not support.
+fn unsupported(name: &str) -> PyErr {
+    PyValueError::new_err(format!("{name} is not supported by libsql.aio"))
+}
+
+#[pyfunction]
+#[pyo3(signature = (database, timeout=5.0, isolation_level="DEFERRED".to_string(), sync_url=None, sync_interval=None, auth_token="", encryption_key=None, cached_statements=DEFAULT_CACHED_STATEMENTS, detect_types=0))]
+fn connect<'py>(
+    py: Python<'py>,
+    database: String,
+    timeout: f64,
+    isolation_level: Option<String>,
+    sync_url: Option<String>,
+    sync_interval: Option<f64>,
+    auth_token: &str,
+    encryption_key: Option<String>,
+    cached_statements: usize,
+    detect_types: i32,
+) -> PyResult<&'py PyAny> {
+    let auth_token = auth_token.to_string();
+    future_into_py(py, async move {
+        let db = open_database(
+            database,
+            sync_url,
+            sync_interval,
+            auth_token,
+            encryption_key,
+        )
+        .await?;
+        let behavior = transaction::parse_behavior(isolation_level.as_deref(), "isolation_level")?;
+        let conn = connect_guard(
+            &db,
+            timeout,
+            cached_statements,
+            detect_types,
+            behavior,
+            ConnectionRuntime::Shared,
+        )?;
+        Ok(AsyncConnection {
+            db: Arc::new(db),
+            conn: Mutex::new(Some(conn)),
+            lock: Arc::new(AsyncMutex::new(())),
+            isolation_level,
+        })
+    })
+}
+
+#[pyclass(name = "Connection", module = "libsql.aio")]
+pub struct AsyncConnection {
+    db: Arc<Database>,
+    conn: Mutex<Option<Arc<ConnectionGuard>>>,
+    /// Held by each statement while it runs.
+    lock: Arc<AsyncMutex<()>>,
+    isolation_level: Option<String>,
+}
+
+impl AsyncConnection {
+    fn guard(&self) -> PyResult<Arc<ConnectionGuard>> {
+        match self.conn.lock().unwrap().as_ref() {
+            Some(conn) => Ok(conn.clone()),
+            None => Err(PyValueError::new_err("Connection already closed")),
+        }
+    }
+
+    /// Returns an awaitable that commits or rolls back the transaction.
+    fn finish<'py>(&self, py: Python<'py>, commit: bool) -> PyResult<&'py PyAny> {
+        let conn = self.guard()?;
+        if !conn.is_autocommit() {
+            conn.tracer
+                .trace(py, if commit { "COMMIT" } else { "ROLLBACK" });
+        }
+        let lock = self.lock.clone();
+        future_into_py(py, async move {
+            let _running = lock.lock().await;
+            transaction::finish(&conn, commit).await
+        })
+    }
+
+    fn new_cursor(&self) -> PyResult<AsyncCursor> {
+        Ok(AsyncCursor {
+            arraysize: 1,
+            conn: self.guard()?,
+            lock: self.lock.clone(),
+            cursor_lock: Arc::new(AsyncMutex::new(())),
+            state: Arc::new(Mutex::new(CursorState::default())),
+            autocommit: self.isolation_level.is_none(),
+        })
+    }
+}
+
+#[pymethods]
+impl AsyncConnection {
+    fn cursor(&self) -> PyResult<AsyncCursor> {
+        self.new_cursor()
+    }
+
+    fn close<'py>(&self, py: Python<'py>) -> PyResult<&'py PyAny> {
+        let conn = self.conn.lock().unwrap().take();
+        future_into_py(py, async move {
+            drop(conn);
+            Ok(())
+        })
+    }
+
+    fn sync<'py>(&self, py: Python<'py>) -> PyResult<&'py PyAny> {
+        let db = self.db.clone();
+        future_into_py(py, async move {
+            let result = db.sync().await?;
+            Python::with_gil(|py| Ok(result.to_dict(py)?.into_py(py)))
+        })
+    }
+
+    fn commit<'py>(&self, py: Python<'py>) -> PyResult<&'py PyAny> {
+        self.finish(py, true)
+    }
+
+    fn rollback<'py>(&self, py: Python<'py>) -> PyResult<&'py PyAny> {
+        self.finish(py, false)
+    }
+
+    #[pyo3(signature = (sql, parameters=None))]
+    fn execute<'py>(
+        &self,
+        py: Python<'py>,
+        sql: String,
+        parameters: Option<&PyAny>,
+    ) -> PyResult<&'py PyAny> {
+        let cursor = self.new_cursor()?;
+        let fut = cursor.execute_one(py, sql, to_params(parameters)?);
+        future_into_py(py, async move {
+            fut.await?;
+            Ok(cursor)
+        })
+    }
+
+    fn executemany<'py>(
+        &self,
+        py: Python<'py>,
+        sql: String,
+        parameters: &PyAny,
+    ) -> PyResult<&'py PyAny> {
+        let cursor = self.new_cursor()?;
+        let fut = cursor.execute_many(py, sql, to_params_list(parameters)?);
+        future_into_py(py, async move {
+            fut.await?;
+            Ok(cursor)
+        })
+    }
+
+    fn executescript<'py>(&self, py: Python<'py>, script: String) -> PyResult<&'py PyAny> {
+        let conn = self.guard()?;
+        conn.tracer.trace(py, &script);
+        // Scripts usually change the schema.
+        conn.stmt_cache.lock().unwrap().schema_changed();
+        let lock = self.lock.clone();
+        future_into_py(py, async move {
+            let _running = lock.lock().await;
+            conn.execute_batch(&script).await.map_err(to_py_err)?;
+            Ok(())
+        })
+    }
+
+    /// Registers `callback` to be called with the SQL text of every
+    /// statement the connection runs, or removes it if `None`.
+    fn set_trace_callback(&self, py: Python<'_>, callback: Option<PyObject>) -> PyResult<()> {
+        self.guard()?
+            .tracer
+            .set_callback(callback.filter(|callback| !callback.is_none(py)));
+        Ok(())
+    }
+
+    #[getter]
+    fn isolation_level(&self) -> Option<String> {
+        self.isolation_level.clone()
+    }
+
+    #[getter]
+    fn row_factory(&self) -> Option<PyObject> {
+        None
+    }
+
+    #[setter]
+    fn set_row_factory(&self, factory: &PyAny) -> PyResult<()> {
+        if factory.is_none() {
+            return Ok(());
+        }
+        Err(unsupported("row_factory"))
+    }
+
+    #[getter]
+    fn statement_timeout(&self) -> Option<f64> {
+        None
+    }
+
+    #[setter]
+    fn set_statement_timeout(&self, timeout: &PyAny) -> PyResult<()> {
+        if timeout.is_none() {
+            return Ok(());
+        }
+        Err(unsupported("statement_timeout"))
+    }
+
+    #[getter]
+    fn in_transaction(&self) -> PyResult<bool> {
+        Ok(!self.guard()?.is_autocommit())
+    }
+}
+
+/// Result set state shared between an `AsyncCursor` and its in-flight
+/// futures. The lock is only ever held for short, non-async sections:
+/// futures take the rows out, iterate them and put them back, holding the
+/// cursor's async lock meanwhile.
+#[derive(Default)]
+struct CursorState {
+    stmt: Option<CachedStatement>,
+    rows: Option<libsql_core::Rows>,
+    done: bool,
+    /// Set while a fetch has the rows out, and left set if the fetch is
+    /// cancelled, which loses the rest of the result set.
+    aborted: bool,
+    rowcount: i64,
+    lastrowid: Option<i64>,
+}
+
+#[pyclass(name = "Cursor", module = "libsql.aio")]
+pub struct AsyncCursor {
+    #[pyo3(get, set)]
+    arraysize: usize,
+    conn: Arc<ConnectionGuard>,
+    /// The lock of the connection, see `AsyncConnection`.
+    lock: Arc<AsyncMutex<()>>,
+    /// Held by statements and fetches of this cursor while they run.
+    cursor_lock: Arc<AsyncMutex<()>>,
+    state: Arc<Mutex<CursorState>>,
+    autocommit: bool,
+}
+
+impl Drop for AsyncCursor {
+    fn drop(&mut self) {
+        let _enter = runtime().enter();
+        release_statement(&self.conn, &mut self.state.lock().unwrap());
+    }
+}
+
+/// Returns the converters of the cursor's current statement.
+fn converters(py: Python<'_>, state: &Mutex<CursorState>) -> Option<Arc<Converters>> {
+    let state = state.lock().unwrap();
+    state.stmt.as_ref().and_then(|entry| entry.converters(py))
+}
+
+fn release_statement(conn: &ConnectionGuard, state: &mut CursorState) {
+    state.rows = None;
+    state.done = false;
+    state.aborted = false;
+    if let Some(entry) = state.stmt.take() {
+        conn.release_statement(entry);
+    }
+}
+
+impl AsyncCursor {
+    /// Returns a future that runs `sql` once and keeps its result set.
+    fn execute_one(
+        &self,
+        py: Python<'_>,
+        sql: String,
+        params: libsql_core::params::Params,
+    ) -> impl std::future::Future<Output = PyResult<()>> + Send + 'static {
+        self.conn.tracer.trace(py, &sql);
+        let conn = self.conn.clone();
+        let cursor_lock = self.cursor_lock.clone();
+        let lock = self.lock.clone();
+        let state = self.state.clone();
+        let autocommit = self.autocommit;
+        async move {
+            let _using_cursor = cursor_lock.lock().await;
+            let _running = lock.lock().await;
+            release_statement(&conn, &mut state.lock().unwrap());
+            let (entry, rows, changes) = execute_statement(&conn, sql, params, autocommit).await?;
+            let mut state = state.lock().unwrap();
+            state.rowcount += changes;
+            state.lastrowid = Some(conn.last_insert_rowid());
+            state.rows = rows;
+            state.stmt = Some(entry);
+            Ok(())
+        }
+    }
+
+    /// Returns a future that runs `sql` once per parameter set. The
+    /// statement is prepared (or taken from the cache) once and reused.
+    fn execute_many(
+        &self,
+        py: Python<'_>,
+        sql: String,
+        params: Vec<libsql_core::params::Params>,
+    ) -> impl std::future::Future<Output = PyResult<()>> + Send + 'static {
+        for _ in &params {
+            self.conn.tracer.trace(py, &sql);
+        }
+        let conn = self.conn.clone();
+        let cursor_lock = self.cursor_lock.clone();
+        let lock = self.lock.clone();
+        let state = self.state.clone();
+        let autocommit = self.autocommit;
+        async move {
+            let _using_cursor = cursor_lock.lock().await;
+            let _running = lock.lock().await;
+            release_statement(&conn, &mut state.lock().unwrap());
+            if params.is_empty() {
+                return Ok(());
+            }
+            let (entry, changes) = execute_bulk(&conn, sql, None, params, autocommit).await?;
+            let mut state = state.lock().unwrap();
+            state.rowcount += changes;
+            state.lastrowid = Some(conn.last_insert_rowid());
+            state.stmt = Some(entry);
+            Ok(())
+        }
+    }
+
+    /// Returns a future that reads up to `limit` rows from the result set.
+    fn fetch(
+        &self,
+        limit: Option<usize>,
+    ) -> impl std::future::Future<Output = PyResult<Option<Vec<Vec<libsql_core::Value>>>>> + Send + 'static
+    {
+        let cursor_lock = self.cursor_lock.clone();
+        let state = self.state.clone();
+        async move {
+            let _using_cursor = cursor_lock.lock().await;
+            let (rows, done) = {
+                let mut state = state.lock().unwrap();
+                if state.aborted {
+                    return Err(PyValueError::new_err(
+                        "Cannot fetch from a cursor whose previous fetch was aborted",
+                    ));
+                }
+                let rows = state.rows.take();
+                state.aborted = rows.is_some();
+                (rows, state.done)
+            };
+            let mut rows = match rows {
+                Some(rows) => rows,
+                None => return Ok(None),
+            };
+            let mut values: Vec<Vec<libsql_core::Value>> = vec![];
+            let started = Instant::now();
+            // The libSQL Rows.next() method restarts the iteration if it
+            // has reached the end, which is why we need to check if we're
+            // done before iterating.
+            let result = if done {
+                Ok(Fetched {
+                    done: true,
+                    ..Fetched::default()
+                })
+            } else {
+                read_rows(&mut rows, limit.unwrap_or(usize::MAX), &mut values).await
+            };
+            let mut state = state.lock().unwrap();
+            state.rows = Some(rows);
+            state.aborted = false;
+            let fetched = result?;
+            if let Some(entry) = state.stmt.as_mut() {
+                entry.execution.add_fetch(started.elapsed(), &fetched);
+            }
+            state.done = fetched.done;
+            Ok(Some(values))
+        }
+    }
+}
+
+#[pymethods]
+impl AsyncCursor {
+    fn close(&self) {
+        let _enter = runtime().enter();
+        release_statement(&self.conn, &mut self.state.lock().unwrap());
+    }
+
+    #[pyo3(signature = (sql, parameters=None))]
+    fn execute<'py>(
+        slf: PyRef<'py, Self>,
+        sql: String,
+        parameters: Option<&PyAny>,
+    ) -> PyResult<&'py PyAny> {
+        let py = slf.py();
+        let fut = slf.execute_one(py, sql, to_params(parameters)?);
+        let cursor: Py<Self> = slf.into();
+        future_into_py(py, async move {
+            fut.await?;
+            Ok(cursor)
+        })
+    }
+
+    fn executemany<'py>(
+        slf: PyRef<'py, Self>,
+        sql: String,
+        parameters: &PyAny,
+    ) -> PyResult<&'py PyAny> {
+        let py = slf.py();
+        let fut = slf.execute_many(py, sql, to_params_list(parameters)?);
+        let cursor: Py<Self> = slf.into();
+        future_into_py(py, async move {
+            fut.await?;
+            Ok(cursor)
+        })
+    }
+
+    fn fetchone<'py>(&self, py: Python<'py>) -> PyResult<&'py PyAny> {
+        let fut = self.fetch(Some(1));
+        let state = self.state.clone();
+        future_into_py(py, async move {
+            let row = fut.await?.and_then(|mut rows| rows.pop());
+            Python::with_gil(|py| match row {
+                Some(row) => {
+                    let converters = converters(py, &state);
+                    Ok(convert_row(py, row, converters.as_deref())?.into_py(py))
+                }
+                None => Ok(py.None()),
+            })
+        })
+    }
+
+    #[pyo3(signature = (size=None))]
+    fn fetchmany<'py>(&self, py: Python<'py>, size: Option<i64>) -> PyResult<&'py PyAny> {
+        let size = size.unwrap_or(self.arraysize as i64).max(0) as usize;
+        let fut = self.fetch(Some(size));
+        let state = self.state.clone();
+        future_into_py(py, async move {
+            let rows = fut.await?;
+            Python::with_gil(|py| match rows {
+                Some(rows) => {
+                    let converters = converters(py, &state);
+                    Ok(convert_rows(py, rows, converters.as_deref())?.into_py(py))
+                }
+                None => Ok(py.None()),
+            })
+        })
+    }
+
+    fn fetchall<'py>(&self, py: Python<'py>) -> PyResult<&'py PyAny> {
+        let fut = self.fetch(None);
+        let state = self.state.clone();
+        future_into_py(py, async move {
+            let rows = fut.await?;
+            Python::with_gil(|py| match rows {
+                Some(rows) => {
+                    let converters = converters(py, &state);
+                    Ok(convert_rows(py, rows, converters.as_deref())?.into_py(py))
+                }
+                None => Ok(py.None()),
+            })
+        })
+    }
+
+    #[getter]
+    fn description<'py>(&self, py: Python<'py>) -> Option<&'py PyTuple> {
+        let state = self.state.lock().unwrap();
+        state
+            .stmt
+            .as_ref()
+            .map(|entry| entry.description(py).into_ref(py))
+    }
+
+    #[getter]
+    fn row_factory(&self) -> Option<PyObject> {
+        None
+    }
+
+    #[setter]
+    fn set_row_factory(&self, factory: &PyAny) -> PyResult<()> {
+        if factory.is_none() {
+            return Ok(());
+        }
+        Err(unsupported("row_factory"))
+    }
+
+    #[getter]
+    fn lastrowid(&self) -> Option<i64> {
+        self.state.lock().unwrap().lastrowid
+    }
+
+    #[getter]
+    fn rowcount(&self) -> i64 {
+        self.state.lock().unwrap().rowcount
+    }
+}
+
+fn to_params_list(parameters: &PyAny) -> PyResult<Vec<libsql_core::params::Params>> {
+    parameters
+        .iter()?
+        .map(|parameters| to_params(Some(parameters?)))
+        .collect()
+}
+
+pub(crate) fn register(py: Python<'_>, m: &PyModule) -> PyResult<()> {
+    m.add_function(wrap_pyfunction!(connect, m)?)?;
+    m.add_class::<AsyncConnection>()?;
+    m.add_class::<AsyncCursor>()?;
+    py.import("sys")?
+        .getattr("modules")?
+        .set_item("libsql.aio", m)?;
+    Ok(())
+}
@@ -0,0 +1,305 @@
+//! `Connection.batch()`: several statements run as one transaction.
+//!
+//! Local databases and embedded replicas run the statements back to back
+//! in a single trip into the runtime. Remote databases receive the whole
+//! batch as one transactional Hrana request, so it costs one round trip.
+//! libSQL only sends batches of plain SQL text, so parameters are inlined
+//! as SQL literals there, and every statement is followed by a
+//! `SELECT changes(), last_insert_rowid()` that carries its row count and
+//! last row id back in the same response.
+
+use crate::{
+    checkout_statement, convert_rows, read_rows, sql, to_params, to_py_err, trace::Fetched,
+    ConnectionGuard,
+};
+use ::libsql as libsql_core;
+use pyo3::exceptions::PyValueError;
+use pyo3::prelude::*;
+use pyo3::types::{PyList, PyString, PyTuple};
+use std::time::Instant;
+
+const SAVEPOINT: &str = "SAVEPOINT libsql_batch";
+const RELEASE: &str = "RELEASE libsql_batch";
+const ROLLBACK_TO: &str = "ROLLBACK TO libsql_batch";
+
+#[derive(Clone, Copy, PartialEq, Eq)]
+pub(crate) enum BatchMode {
+    /// Takes the write lock up front (`BEGIN IMMEDIATE`).
+    Write,
+    /// Fails statements that write (`PRAGMA query_only`).
+    Read,
+    /// Takes locks as statements need them (`BEGIN DEFERRED`).
+    Deferred,
+}
+
+impl BatchMode {
+    pub(crate) fn parse(mode: &str) -> PyResult<Self> {
+        match mode {
+            "write" => Ok(BatchMode::Write),
+            "read" => Ok(BatchMode::Read),
+            "deferred" => Ok(BatchMode::Deferred),
+            _ => Err(PyValueError::new_err(
+                "mode must be \"write\", \"read\" or \"deferred\"",
+            )),
+        }
+    }
+
+    fn begin(self) -> &'static str {
+        match self {
+            BatchMode::Write => "BEGIN IMMEDIATE",
+            BatchMode::Read | BatchMode::Deferred => "BEGIN DEFERRED",
+        }
+    }
+}
+
+/// A statement of a batch and its parameters.
+pub(crate) struct BatchStatement {
+    sql: String,
+    params: libsql_core::params::Params,
+}
+
+impl BatchStatement {
+    pub(crate) fn sql(&self) -> &str {
+        &self.sql
+    }
+}
+
+/// Converts the `(sql, parameters)` pairs or plain SQL strings passed to
+/// `batch()`.
+pub(crate) fn to_statements(statements: &PyAny) -> PyResult<Vec<BatchStatement>> {
+    let mut batch = vec![];
+    for item in statements.iter()? {
+        let item = item?;
+        let (sql, params) = match item.downcast::<PyString>() {
+            Ok(sql) => (sql.to_str()?, None),
+            Err(_) => item.extract::<(&str, Option<&PyAny>)>()?,
+        };
+        batch.push(BatchStatement {
+            sql: sql::single_statement(sql)?.to_string(),
+            params: to_params(params)?,
+        });
+    }
+    Ok(batch)
+}
+
+/// What one statement of a batch returned.
+pub(crate) struct StatementResult {
+    columns: Vec<String>,
+    rows: Vec<Vec<libsql_core::Value>>,
+    rowcount: i64,
+    lastrowid: i64,
+}
+
+impl StatementResult {
+    fn new() -> Self {
+        StatementResult {
+            columns: vec![],
+            rows: vec![],
+            rowcount: -1,
+            lastrowid: 0,
+        }
+    }
+
+    async fn read(&mut self, rows: &mut libsql_core::Rows) -> PyResult<Fetched> {
+        self.columns = (0..rows.column_count())
+            .map(|idx| rows.column_name(idx).unwrap_or("").to_string())
+            .collect();
+        read_rows(rows, usize::MAX, &mut self.rows).await
+    }
+}
+
+/// The result of one statement of a `Connection.batch()`.
+#[pyclass(module = "libsql")]
+pub struct ResultSet {
+    #[pyo3(get)]
+    columns: Py<PyTuple>,
+    #[pyo3(get)]
+    rows: Py<PyList>,
+    #[pyo3(get)]
+    rowcount: i64,
+    #[pyo3(get)]
+    lastrowid: i64,
+}
+
+#[pymethods]
+impl ResultSet {
+    fn __len__(&self, py: Python<'_>) -> usize {
+        self.rows.as_ref(py).len()
+    }
+
+    fn __repr__(&self, py: Python<'_>) -> String {
+        format!(
+            "<libsql.ResultSet rows={} rowcount={} lastrowid={}>",
+            self.rows.as_ref(py).len(),
+            self.rowcount,
+            self.lastrowid
+        )
+    }
+}
+
+pub(crate) fn into_py(py: Python<'_>, results: Vec<StatementResult>) -> PyResult<&PyList> {
+    let mut elements: Vec<Py<ResultSet>> = Vec::with_capacity(results.len());
+    for result in results {
+        let result = ResultSet {
+            columns: PyTuple::new(py, result.columns).into(),
+            rows: convert_rows(py, result.rows, None)?.into(),
+            rowcount: result.rowcount,
+            lastrowid: result.lastrowid,
+        };
+        elements.push(Py::new(py, result)?);
+    }
+    Ok(PyList::new(py, elements))
+}
+
+/// Runs `batch` in a transaction of its own, or in a savepoint if `conn` is
+/// already in a transaction, and rolls it back if any statement fails.
+pub(crate) async fn execute_batch(
+    conn: &ConnectionGuard,
+    batch: Vec<BatchStatement>,
+    mode: BatchMode,
+) -> PyResult<Vec<StatementResult>> {
+    if conn.remote && conn.is_autocommit() {
+        return execute_remote(conn, batch, mode).await;
+    }
+    let savepoint = !conn.is_autocommit();
+    let begin = if savepoint { SAVEPOINT } else { mode.begin() };
+    conn.execute(begin, ()).await.map_err(to_py_err)?;
+    let mut result = Ok(vec![]);
+    if mode == BatchMode::Read {
+        result = conn
+            .execute("PRAGMA query_only = ON", ())
+            .await
+            .map(|_| vec![])
+            .map_err(to_py_err);
+    }
+    if result.is_ok() {
+        result = execute_statements(conn, batch).await;
+    }
+    let mut reset = Ok(0);
+    if mode == BatchMode::Read {
+        reset = conn.execute("PRAGMA query_only = OFF", ()).await;
+    }
+    if result.is_ok() {
+        let end = if savepoint { RELEASE } else { "COMMIT" };
+        if let Err(err) = conn.execute(end, ()).await {
+            result = Err(to_py_err(err));
+        }
+    }
+    if result.is_err() {
+        if savepoint {
+            conn.execute(ROLLBACK_TO, ()).await.map_err(to_py_err)?;
+            conn.execute(RELEASE, ()).await.map_err(to_py_err)?;
+        } else if !conn.is_autocommit() {
+            conn.execute("ROLLBACK", ()).await.map_err(to_py_err)?;
+        }
+    }
+    reset.map_err(to_py_err)?;
+    result
+}
+
+async fn execute_statements(
+    conn: &ConnectionGuard,
+    batch: Vec<BatchStatement>,
+) -> PyResult<Vec<StatementResult>> {
+    let mut results = Vec::with_capacity(batch.len());
+    for statement in batch {
+        let mut entry = checkout_statement(conn, statement.sql).await?;
+        let is_dml = entry.is_dml;
+        let mut result = StatementResult::new();
+        let executed = async {
+            let params = entry.bind(statement.params)?;
+            entry.stmt.reset();
+            let started = Instant::now();
+            entry.execution.runs += 1;
+            if entry.stmt.columns().is_empty() {
+                entry.stmt.execute(params).await.map_err(to_py_err)?;
+                entry.execution.execute += started.elapsed();
+            } else {
+                let mut rows = entry.stmt.query(params).await.map_err(to_py_err)?;
+                entry.execution.execute += started.elapsed();
+                let started = Instant::now();
+                let fetched = result.read(&mut rows).await?;
+                entry.execution.add_fetch(started.elapsed(), &fetched);
+            }
+            Ok::<_, PyErr>(())
+        }
+        .await;
+        conn.release_statement(entry);
+        executed?;
+        if is_dml {
+            result.rowcount = conn.changes() as i64;
+        }
+        result.lastrowid = conn.last_insert_rowid();
+        results.push(result);
+    }
+    Ok(results)
+}
+
+/// Sends `batch` to a remote database as a single transactional request.
+///
+/// The server begins the transaction itself, so the write lock cannot be
+/// taken up front, and `mode="read"` is enforced by only sending queries.
+async fn execute_remote(
+    conn: &ConnectionGuard,
+    batch: Vec<BatchStatement>,
+    mode: BatchMode,
+) -> PyResult<Vec<StatementResult>> {
+    match mode {
+        BatchMode::Write => {
+            return Err(PyValueError::new_err(
+                "mode=\"write\" is not supported for remote databases",
+            ))
+        }
+        BatchMode::Read => {
+            if let Some(idx) = batch
+                .iter()
+                .position(|statement| !sql::is_query(&statement.sql))
+            {
+                return Err(PyValueError::new_err(format!(
+                    "Statement {} of a read batch is not a query",
+                    idx + 1
+                )));
+            }
+        }
+        BatchMode::Deferred => {}
+    }
+    if batch.iter().any(|statement| sql::is_ddl(&statement.sql)) {
+        conn.stmt_cache.lock().unwrap().schema_changed();
+    }
+    let mut script = String::new();
+    for statement in &batch {
+        script.push_str(&sql::inline_params(&statement.sql, &statement.params)?);
+        script.push_str("\n;\nSELECT changes(), last_insert_rowid();\n");
+    }
+    let mut steps = conn
+        .execute_transactional_batch(&script)
+        .await
+        .map_err(to_py_err)?;
+    let mut results = Vec::with_capacity(batch.len());
+    for (idx, statement) in batch.iter().enumerate() {
+        // Steps after a failed one are skipped and the transaction is rolled
+        // back, so a step without a result means the batch did not apply.
+        let failed = || {
+            PyValueError::new_err(format!(
+                "Statement {} of the batch failed, and the batch was rolled back",
+                idx + 1
+            ))
+        };
+        let mut result = StatementResult::new();
+        let mut rows = steps.next_stmt_row().flatten().ok_or_else(failed)?;
+        result.read(&mut rows).await?;
+        let mut rows = steps.next_stmt_row().flatten().ok_or_else(failed)?;
+        let row = rows.next().await.map_err(to_py_err)?.ok_or_else(failed)?;
+        match (row.get_value(0), row.get_value(1)) {
+            (Ok(libsql_core::Value::Integer(changes)), Ok(libsql_core::Value::Integer(rowid))) => {
+                if sql::is_dml(&statement.sql) {
+                    result.rowcount = changes;
+                }
+                result.lastrowid = rowid;
+            }
+            _ => return Err(failed()),
+        }
+        results.push(result);
+    }
+    Ok(results)
+}
@@ -0,0 +1,210 @@
+//! `Connection.blobopen()`: incremental I/O on a single BLOB value.
+//!
+//! A `Blob` wraps SQLite's `sqlite3_blob` API through the handle captured
+//! for user-defined functions, so it is only available on local databases.
+//! Reads and writes go straight between SQLite's pages and the Python
+//! object, with the GIL released, so a large value never has to be held
+//! in memory as a whole.
+
+use crate::functions::check_status;
+use crate::ConnectionGuard;
+use libsql_ffi as ffi;
+use pyo3::buffer::PyBuffer;
+use pyo3::exceptions::PyValueError;
+use pyo3::prelude::*;
+use pyo3::types::PyBytes;
+use std::ffi::CString;
+use std::os::raw::{c_int, c_void};
+use std::sync::Arc;
+
+#[derive(Clone, Copy)]
+struct BlobHandle(*mut ffi::sqlite3_blob);
+
+// SAFETY: libSQL opens connections in serialized threading mode, and the
+// blob is only used while its `Blob` is borrowed.
+unsafe impl Send for BlobHandle {}
+
+fn c_string(value: &str, what: &str) -> PyResult<CString> {
+    CString::new(value)
+        .map_err(|_| PyValueError::new_err(format!("{what} must not contain NUL characters")))
+}
+
+/// Opens the BLOB in `column` of the row `row` of `table`.
+pub(crate) fn open(
+    conn: Arc<ConnectionGuard>,
+    table: &str,
+    column: &str,
+    row: i64,
+    readonly: bool,
+    name: &str,
+) -> PyResult<Blob> {
+    let handle = conn
+        .handle
+        .as_ref()
+        .ok_or_else(|| PyValueError::new_err("blobopen() is not supported for remote databases"))?;
+    let (name, table, column) = (
+        c_string(name, "name")?,
+        c_string(table, "table")?,
+        c_string(column, "column")?,
+    );
+    let mut blob = std::ptr::null_mut();
+    let status = unsafe {
+        ffi::sqlite3_blob_open(
+            handle.0,
+            name.as_ptr(),
+            table.as_ptr(),
+            column.as_ptr(),
+            row,
+            !readonly as c_int,
+            &mut blob,
+        )
+    };
+    if let Err(err) = check_status(handle, status) {
+        // SQLite may hand out a blob even when opening fails.
+        unsafe { ffi::sqlite3_blob_close(blob) };
+        return Err(err);
+    }
+    let len = unsafe { ffi::sqlite3_blob_bytes(blob) } as usize;
+    Ok(Blob {
+        blob: Some(BlobHandle(blob)),
+        conn,
+        offset: 0,
+        len,
+    })
+}
+
+/// An open BLOB, read and written like a file of fixed size.
+#[pyclass(module = "libsql")]
+pub struct Blob {
+    blob: Option<BlobHandle>,
+    conn: Arc<ConnectionGuard>,
+    offset: usize,
+    len: usize,
+}
+
+impl Blob {
+    fn handle(&self) -> PyResult<BlobHandle> {
+        self.blob
+            .ok_or_else(|| PyValueError::new_err("Cannot operate on a closed blob"))
+    }
+
+    fn check(&self, status: c_int) -> PyResult<()> {
+        check_status(self.conn.handle.as_ref().unwrap(), status)
+    }
+}
+
+impl Drop for Blob {
+    fn drop(&mut self) {
+        if let Some(blob) = self.blob.take() {
+            unsafe { ffi::sqlite3_blob_close(blob.0) };
+        }
+    }
+}
+
+#[pymethods]
+impl Blob {
+    /// Reads `length` bytes (all remaining bytes if negative) from the
+    /// current offset and advances it.
+    #[pyo3(signature = (length=-1))]
+    fn read<'py>(&mut self, py: Python<'py>, length: i64) -> PyResult<&'py PyBytes> {
+        let blob = self.handle()?;
+        let remaining = self.len - self.offset;
+        let count = match usize::try_from(length) {
+            Ok(length) => length.min(remaining),
+            Err(_) => remaining,
+        };
+        let offset = self.offset;
+        let mut status = ffi::SQLITE_OK;
+        let bytes = PyBytes::new_with(py, count, |buf| {
+            let buf = buf.as_mut_ptr() as usize;
+            status = py.allow_threads(move || unsafe {
+                ffi::sqlite3_blob_read(blob.0, buf as *mut c_void, count as c_int, offset as c_int)
+            });
+            Ok(())
+        })?;
+        self.check(status)?;
+        self.offset += count;
+        Ok(bytes)
+    }
+
+    /// Writes the bytes of the buffer `data` at the current offset and
+    /// advances it. The size of a BLOB cannot change.
+    fn write(&mut self, py: Python<'_>, data: &PyAny) -> PyResult<()> {
+        let blob = self.handle()?;
+        let buffer = PyBuffer::<u8>::get(data)?;
+        let count = buffer.len_bytes();
+        if count > self.len - self.offset {
+            return Err(PyValueError::new_err("data longer than blob length"));
+        }
+        let copy;
+        let data = if buffer.is_c_contiguous() {
+            buffer.buf_ptr() as usize
+        } else {
+            copy = buffer.to_vec(py)?;
+            copy.as_ptr() as usize
+        };
+        let offset = self.offset;
+        let status = py.allow_threads(move || unsafe {
+            ffi::sqlite3_blob_write(
+                blob.0,
+                data as *const c_void,
+                count as c_int,
+                offset as c_int,
+            )
+        });
+        self.check(status)?;
+        self.offset += count;
+        Ok(())
+    }
+
+    /// Moves the current offset to `offset` bytes from the start
+    /// (`origin=0`), the current offset (`1`) or the end (`2`).
+    #[pyo3(signature = (offset, origin=0))]
+    fn seek(&mut self, offset: i64, origin: i32) -> PyResult<()> {
+        self.handle()?;
+        let base = match origin {
+            0 => 0,
+            1 => self.offset as i64,
+            2 => self.len as i64,
+            _ => return Err(PyValueError::new_err("origin must be 0, 1 or 2")),
+        };
+        match base.checked_add(offset) {
+            Some(target) if (0..=self.len as i64).contains(&target) => {
+                self.offset = target as usize;
+                Ok(())
+            }
+            _ => Err(PyValueError::new_err("offset out of blob range")),
+        }
+    }
+
+    fn tell(&self) -> PyResult<usize> {
+        self.handle()?;
+        Ok(self.offset)
+    }
+
+    fn close(&mut self) {
+        if let Some(blob) = self.blob.take() {
+            unsafe { ffi::sqlite3_blob_close(blob.0) };
+        }
+    }
+
+    fn __len__(&self) -> PyResult<usize> {
+        self.handle()?;
+        Ok(self.len)
+    }
+
+    fn __enter__(slf: PyRef<'_, Self>) -> PyResult<PyRef<'_, Self>> {
+        slf.handle()?;
+        Ok(slf)
+    }
+
+    fn __exit__(
+        &mut self,
+        _exc_type: Option<&PyAny>,
+        _exc_value: Option<&PyAny>,
+        _traceback: Option<&PyAny>,
+    ) -> bool {
+        self.close();
+        false
+    }
+}
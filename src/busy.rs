@@ -0,0 +1,211 @@
+//! Busy handling of local connections.
+//!
+//! Instead of `sqlite3_busy_timeout()`, local connections register a busy
+//! handler that sleeps with exponential backoff and jitter between retries,
+//! so that writers that collide do not wake up in lockstep, and gives up
+//! once a wait has lasted `timeout`. It counts the waits, the retries and
+//! the time spent sleeping, for `Connection.busy_stats()`.
+
+use crate::functions::{check_status, SqliteHandle};
+use libsql_ffi as ffi;
+use pyo3::exceptions::PyValueError;
+use pyo3::prelude::*;
+use pyo3::types::PyDict;
+use std::collections::hash_map::RandomState;
+use std::hash::{BuildHasher, Hasher};
+use std::os::raw::{c_int, c_void};
+use std::panic::{catch_unwind, AssertUnwindSafe};
+use std::sync::Mutex;
+use std::time::{Duration, Instant};
+
+const DEFAULT_INITIAL_DELAY: Duration = Duration::from_millis(1);
+const DEFAULT_MAX_DELAY: Duration = Duration::from_millis(100);
+
+/// How a connection waits for a lock held by another connection.
+#[derive(Clone, Copy)]
+pub(crate) struct BusyPolicy {
+    /// How long one wait may last in total.
+    timeout: Duration,
+    initial_delay: Duration,
+    max_delay: Duration,
+    jitter: bool,
+}
+
+impl BusyPolicy {
+    pub(crate) fn new(timeout: Duration) -> Self {
+        BusyPolicy {
+            timeout,
+            initial_delay: DEFAULT_INITIAL_DELAY,
+            max_delay: DEFAULT_MAX_DELAY,
+            jitter: true,
+        }
+    }
+
+    pub(crate) fn with_backoff(
+        timeout: f64,
+        initial_delay: f64,
+        max_delay: f64,
+        jitter: bool,
+    ) -> PyResult<Self> {
+        if !(timeout >= 0.0 && initial_delay > 0.0 && max_delay >= initial_delay) {
+            return Err(PyValueError::new_err(
+                "timeout must not be negative and 0 < initial_delay <= max_delay",
+            ));
+        }
+        Ok(BusyPolicy {
+            timeout: Duration::from_secs_f64(timeout),
+            initial_delay: Duration::from_secs_f64(initial_delay),
+            max_delay: Duration::from_secs_f64(max_delay),
+            jitter,
+        })
+    }
+
+    pub(crate) fn timeout(&self) -> Duration {
+        self.timeout
+    }
+
+    /// Returns how long to sleep before retry number `retry` of a wait that
+    /// has lasted `waited`, or `None` to give up.
+    fn delay(&self, retry: u32, waited: Duration) -> Option<Duration> {
+        let remaining = self
+            .timeout
+            .checked_sub(waited)
+            .filter(|remaining| !remaining.is_zero())?;
+        let backoff = self
+            .initial_delay
+            .saturating_mul(1 << retry.min(31))
+            .min(self.max_delay);
+        // Equal jitter: at least half the backoff, so waits still grow.
+        let delay = if self.jitter {
+            backoff.mul_f64(0.5 + 0.5 * random_fraction())
+        } else {
+            backoff
+        };
+        Some(delay.min(remaining))
+    }
+}
+
+/// Returns a random number in `[0, 1)`.
+fn random_fraction() -> f64 {
+    let bits = RandomState::new().build_hasher().finish();
+    (bits >> 11) as f64 / (1u64 << 53) as f64
+}
+
+#[derive(Default)]
+struct BusyStats {
+    /// Statements that found the database locked.
+    waits: u64,
+    retries: u64,
+    /// Waits that gave up with `database is locked`.
+    timeouts: u64,
+    blocked: Duration,
+    longest: Duration,
+}
+
+struct BusyState {
+    policy: BusyPolicy,
+    stats: BusyStats,
+    /// When the current wait started.
+    started: Instant,
+}
+
+/// The busy policy and counters of a connection.
+pub(crate) struct BusyHandler {
+    default: BusyPolicy,
+    state: Mutex<BusyState>,
+}
+
+impl BusyHandler {
+    pub(crate) fn new(policy: BusyPolicy) -> Self {
+        BusyHandler {
+            default: policy,
+            state: Mutex::new(BusyState {
+                policy,
+                stats: BusyStats::default(),
+                started: Instant::now(),
+            }),
+        }
+    }
+
+    pub(crate) fn policy(&self) -> BusyPolicy {
+        self.state.lock().unwrap().policy
+    }
+
+    pub(crate) fn set_policy(&self, policy: BusyPolicy) {
+        self.state.lock().unwrap().policy = policy;
+    }
+
+    /// Restores the policy the connection was opened with and clears the
+    /// counters, for connections returned to a pool.
+    pub(crate) fn reset(&self) {
+        let mut state = self.state.lock().unwrap();
+        state.policy = self.default;
+        state.stats = BusyStats::default();
+    }
+
+    /// Registers this handler with `handle`. The handler must outlive the
+    /// registration.
+    pub(crate) fn install(&self, handle: &SqliteHandle) -> PyResult<()> {
+        let status = unsafe {
+            ffi::sqlite3_busy_handler(
+                handle.0,
+                Some(on_busy),
+                self as *const BusyHandler as *mut c_void,
+            )
+        };
+        check_status(handle, status)
+    }
+
+    pub(crate) fn uninstall(handle: &SqliteHandle) {
+        unsafe {
+            ffi::sqlite3_busy_handler(handle.0, None, std::ptr::null_mut());
+        }
+    }
+
+    /// Called by SQLite with the number of times it has already been
+    /// called for the current wait. Returns whether to retry.
+    fn wait(&self, count: u32) -> bool {
+        let now = Instant::now();
+        let mut state = self.state.lock().unwrap();
+        if count == 0 {
+            state.started = now;
+            state.stats.waits += 1;
+        }
+        let waited = now - state.started;
+        let delay = match state.policy.delay(count, waited) {
+            Some(delay) => delay,
+            None => {
+                state.stats.timeouts += 1;
+                state.stats.longest = state.stats.longest.max(waited);
+                return false;
+            }
+        };
+        state.stats.retries += 1;
+        drop(state);
+        std::thread::sleep(delay);
+        let mut state = self.state.lock().unwrap();
+        state.stats.blocked += delay;
+        state.stats.longest = state.stats.longest.max(state.started.elapsed());
+        true
+    }
+
+    /// Returns the counters, and clears them if `reset` is true.
+    pub(crate) fn stats<'py>(&self, py: Python<'py>, reset: bool) -> PyResult<&'py PyDict> {
+        let mut state = self.state.lock().unwrap();
+        let stats = PyDict::new(py);
+        stats.set_item("waits", state.stats.waits)?;
+        stats.set_item("retries", state.stats.retries)?;
+        stats.set_item("timeouts", state.stats.timeouts)?;
+        stats.set_item("blocked_seconds", state.stats.blocked.as_secs_f64())?;
+        stats.set_item("max_wait_seconds", state.stats.longest.as_secs_f64())?;
+        if reset {
+            state.stats = BusyStats::default();
+        }
+        Ok(stats)
+    }
+}
+
+unsafe extern "C" fn on_busy(handler: *mut c_void, count: c_int) -> c_int {
+    let handler = &*(handler as *const BusyHandler);
+    catch_unwind(AssertUnwindSafe(|| handler.wait(count.max(0) as u32))).unwrap_or(false) as c_int
+}
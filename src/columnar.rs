@@ -0,0 +1,454 @@
+//! Columnar result sets for `Cursor.fetch_columns()`.
+//!
+//! Rows are decoded straight into typed, contiguous buffers while the GIL is
+//! released. The buffers are handed to Python through the buffer protocol,
+//! so `numpy.frombuffer()`, `memoryview` or `pyarrow.py_buffer()` can wrap
+//! them without creating a Python object per value.
+
+use crate::trace::value_size;
+use crate::RowSink;
+use ::libsql as libsql_core;
+use pyo3::exceptions::{PyBufferError, PyValueError};
+use pyo3::ffi;
+use pyo3::prelude::*;
+use pyo3::types::{PyBytes, PyList, PyTuple};
+use std::os::raw::{c_char, c_int, c_void};
+use std::ptr;
+
+#[derive(Clone, Copy, PartialEq, Eq)]
+enum Kind {
+    Null,
+    Int64,
+    Float64,
+    Text,
+    Blob,
+}
+
+impl Kind {
+    fn name(self) -> &'static str {
+        match self {
+            Kind::Null => "null",
+            Kind::Int64 => "int64",
+            Kind::Float64 => "float64",
+            Kind::Text => "text",
+            Kind::Blob => "blob",
+        }
+    }
+}
+
+/// Accumulates the values of one result column.
+struct ColumnBuilder {
+    name: String,
+    kind: Kind,
+    len: usize,
+    validity: Vec<bool>,
+    ints: Vec<i64>,
+    floats: Vec<f64>,
+    offsets: Vec<i64>,
+    data: Vec<u8>,
+}
+
+impl ColumnBuilder {
+    fn new(name: String) -> Self {
+        ColumnBuilder {
+            name,
+            kind: Kind::Null,
+            len: 0,
+            validity: vec![],
+            ints: vec![],
+            floats: vec![],
+            offsets: vec![0],
+            data: vec![],
+        }
+    }
+
+    /// Switches an all-null column to `kind`, back-filling the placeholders
+    /// for the nulls seen so far.
+    fn set_kind(&mut self, kind: Kind) {
+        self.kind = kind;
+        match kind {
+            Kind::Int64 => self.ints.resize(self.len, 0),
+            Kind::Float64 => self.floats.resize(self.len, 0.0),
+            Kind::Text | Kind::Blob => self.offsets.resize(self.len + 1, 0),
+            Kind::Null => {}
+        }
+    }
+
+    fn mixed(&self, kind: Kind) -> PyErr {
+        PyValueError::new_err(format!(
+            "Column '{}' mixes {} and {} values",
+            self.name,
+            self.kind.name(),
+            kind.name()
+        ))
+    }
+
+    fn push(&mut self, value: libsql_core::Value) -> PyResult<()> {
+        match value {
+            libsql_core::Value::Null => {
+                self.validity.push(false);
+                match self.kind {
+                    Kind::Int64 => self.ints.push(0),
+                    Kind::Float64 => self.floats.push(0.0),
+                    Kind::Text | Kind::Blob => self.offsets.push(self.data.len() as i64),
+                    Kind::Null => {}
+                }
+            }
+            libsql_core::Value::Integer(v) => {
+                match self.kind {
+                    Kind::Null => {
+                        self.set_kind(Kind::Int64);
+                        self.ints.push(v);
+                    }
+                    Kind::Int64 => self.ints.push(v),
+                    Kind::Float64 => self.floats.push(v as f64),
+                    _ => return Err(self.mixed(Kind::Int64)),
+                }
+                self.validity.push(true);
+            }
+            libsql_core::Value::Real(v) => {
+                match self.kind {
+                    Kind::Null => self.set_kind(Kind::Float64),
+                    Kind::Int64 => {
+                        self.floats = self.ints.drain(..).map(|i| i as f64).collect();
+                        self.kind = Kind::Float64;
+                    }
+                    Kind::Float64 => {}
+                    _ => return Err(self.mixed(Kind::Float64)),
+                }
+                self.floats.push(v);
+                self.validity.push(true);
+            }
+            libsql_core::Value::Text(v) => {
+                self.push_bytes(Kind::Text, v.as_bytes())?;
+            }
+            libsql_core::Value::Blob(v) => {
+                self.push_bytes(Kind::Blob, &v)?;
+            }
+        }
+        self.len += 1;
+        Ok(())
+    }
+
+    fn push_bytes(&mut self, kind: Kind, bytes: &[u8]) -> PyResult<()> {
+        if self.kind == Kind::Null {
+            self.set_kind(kind);
+        } else if self.kind != kind {
+            return Err(self.mixed(kind));
+        }
+        self.data.extend_from_slice(bytes);
+        self.offsets.push(self.data.len() as i64);
+        self.validity.push(true);
+        Ok(())
+    }
+}
+
+/// Collects rows into one `ColumnBuilder` per result column.
+pub(crate) struct ColumnsBuilder {
+    columns: Vec<ColumnBuilder>,
+}
+
+impl ColumnsBuilder {
+    pub(crate) fn new(rows: &libsql_core::Rows) -> Self {
+        let columns = (0..rows.column_count())
+            .map(|idx| ColumnBuilder::new(rows.column_name(idx).unwrap_or("").to_string()))
+            .collect();
+        ColumnsBuilder { columns }
+    }
+
+    pub(crate) fn into_py(self, py: Python<'_>) -> PyResult<&PyList> {
+        let mut columns: Vec<Py<ColumnArray>> = Vec::with_capacity(self.columns.len());
+        for column in self.columns {
+            columns.push(Py::new(py, ColumnArray::new(py, column)?)?);
+        }
+        Ok(PyList::new(py, columns))
+    }
+}
+
+impl RowSink for ColumnsBuilder {
+    fn push_row(&mut self, row: &libsql_core::Row, column_count: i32) -> PyResult<usize> {
+        let mut size = 0;
+        for col_idx in 0..column_count {
+            let value = row.get_value(col_idx).map_err(crate::to_py_err)?;
+            size += value_size(&value);
+            self.columns[col_idx as usize].push(value)?;
+        }
+        Ok(size)
+    }
+
+    fn push_values(&mut self, row: Vec<libsql_core::Value>) -> PyResult<()> {
+        for (column, value) in self.columns.iter_mut().zip(row) {
+            column.push(value)?;
+        }
+        Ok(())
+    }
+}
+
+pub(crate) enum Storage {
+    Int64(Vec<i64>),
+    Float32(Vec<f32>),
+    Float64(Vec<f64>),
+    Bool(Vec<bool>),
+    Bytes(Vec<u8>),
+}
+
+impl Storage {
+    fn format(&self) -> &'static [u8] {
+        match self {
+            Storage::Int64(_) => b"q\0",
+            Storage::Float32(_) => b"f\0",
+            Storage::Float64(_) => b"d\0",
+            Storage::Bool(_) => b"?\0",
+            Storage::Bytes(_) => b"B\0",
+        }
+    }
+
+    fn itemsize(&self) -> usize {
+        match self {
+            Storage::Int64(_) => std::mem::size_of::<i64>(),
+            Storage::Float32(_) => std::mem::size_of::<f32>(),
+            Storage::Float64(_) => std::mem::size_of::<f64>(),
+            Storage::Bool(_) | Storage::Bytes(_) => 1,
+        }
+    }
+
+    fn len(&self) -> usize {
+        match self {
+            Storage::Int64(v) => v.len(),
+            Storage::Float32(v) => v.len(),
+            Storage::Float64(v) => v.len(),
+            Storage::Bool(v) => v.len(),
+            Storage::Bytes(v) => v.len(),
+        }
+    }
+
+    fn as_ptr(&self) -> *const c_void {
+        match self {
+            Storage::Int64(v) => v.as_ptr() as *const c_void,
+            Storage::Float32(v) => v.as_ptr() as *const c_void,
+            Storage::Float64(v) => v.as_ptr() as *const c_void,
+            Storage::Bool(v) => v.as_ptr() as *const c_void,
+            Storage::Bytes(v) => v.as_ptr() as *const c_void,
+        }
+    }
+}
+
+/// A read-only, C-contiguous typed buffer exposed through the buffer
+/// protocol. Column buffers are one-dimensional; `Cursor.fetch_vectors()`
+/// returns a two-dimensional one.
+#[pyclass(module = "libsql")]
+pub struct ColumnBuffer {
+    storage: Storage,
+    shape: Vec<ffi::Py_ssize_t>,
+    strides: Vec<ffi::Py_ssize_t>,
+}
+
+impl ColumnBuffer {
+    fn new(storage: Storage) -> Self {
+        let len = storage.len();
+        ColumnBuffer::with_shape(storage, vec![len])
+    }
+
+    /// Wraps `storage` as an array of the given shape, which must cover
+    /// exactly `storage.len()` items.
+    pub(crate) fn with_shape(storage: Storage, shape: Vec<usize>) -> Self {
+        debug_assert_eq!(shape.iter().product::<usize>(), storage.len());
+        let mut strides = vec![0; shape.len()];
+        let mut stride = storage.itemsize();
+        for (idx, dim) in shape.iter().enumerate().rev() {
+            strides[idx] = stride as ffi::Py_ssize_t;
+            stride *= dim;
+        }
+        ColumnBuffer {
+            storage,
+            shape: shape
+                .into_iter()
+                .map(|dim| dim as ffi::Py_ssize_t)
+                .collect(),
+            strides,
+        }
+    }
+}
+
+#[pymethods]
+impl ColumnBuffer {
+    unsafe fn __getbuffer__(
+        slf: &PyCell<Self>,
+        view: *mut ffi::Py_buffer,
+        flags: c_int,
+    ) -> PyResult<()> {
+        if view.is_null() {
+            return Err(PyBufferError::new_err("View is null"));
+        }
+        if (flags & ffi::PyBUF_WRITABLE) == ffi::PyBUF_WRITABLE {
+            return Err(PyBufferError::new_err("Object is not writable"));
+        }
+        // The storage is never mutated after construction, so the pointers
+        // stay valid for as long as the view holds a reference to `slf`.
+        let this = slf.borrow();
+        ffi::Py_INCREF(slf.as_ptr());
+        (*view).obj = slf.as_ptr();
+        (*view).buf = this.storage.as_ptr() as *mut c_void;
+        (*view).len = (this.storage.len() * this.storage.itemsize()) as ffi::Py_ssize_t;
+        (*view).readonly = 1;
+        (*view).itemsize = this.storage.itemsize() as ffi::Py_ssize_t;
+        (*view).format = if (flags & ffi::PyBUF_FORMAT) == ffi::PyBUF_FORMAT {
+            this.storage.format().as_ptr() as *mut c_char
+        } else {
+            ptr::null_mut()
+        };
+        // Without PyBUF_ND the consumer sees the items as a flat sequence.
+        (*view).ndim = 1;
+        (*view).shape = if (flags & ffi::PyBUF_ND) == ffi::PyBUF_ND {
+            (*view).ndim = this.shape.len() as c_int;
+            this.shape.as_ptr() as *mut ffi::Py_ssize_t
+        } else {
+            ptr::null_mut()
+        };
+        (*view).strides = if (flags & ffi::PyBUF_STRIDES) == ffi::PyBUF_STRIDES {
+            this.strides.as_ptr() as *mut ffi::Py_ssize_t
+        } else {
+            ptr::null_mut()
+        };
+        (*view).suboffsets = ptr::null_mut();
+        (*view).internal = ptr::null_mut();
+        Ok(())
+    }
+
+    unsafe fn __releasebuffer__(&self, _view: *mut ffi::Py_buffer) {}
+
+    fn __len__(&self) -> usize {
+        self.shape[0] as usize
+    }
+
+    #[getter]
+    fn shape<'py>(&self, py: Python<'py>) -> &'py PyTuple {
+        PyTuple::new(py, &self.shape)
+    }
+
+    #[getter]
+    fn format(&self) -> &'static str {
+        let format = self.storage.format();
+        std::str::from_utf8(&format[..format.len() - 1]).unwrap()
+    }
+}
+
+/// One column of a result set in columnar form.
+///
+/// `values` holds the int64 or float64 payload, `offsets` and `data` the
+/// UTF-8 or binary payload of text and blob columns (value `i` spans
+/// `data[offsets[i]:offsets[i + 1]]`). `validity` has one bool per row that
+/// is false where the value is NULL.
+#[pyclass(module = "libsql")]
+pub struct ColumnArray {
+    #[pyo3(get)]
+    name: String,
+    kind: Kind,
+    len: usize,
+    null_count: usize,
+    #[pyo3(get)]
+    validity: Py<ColumnBuffer>,
+    #[pyo3(get)]
+    values: Option<Py<ColumnBuffer>>,
+    #[pyo3(get)]
+    offsets: Option<Py<ColumnBuffer>>,
+    #[pyo3(get)]
+    data: Option<Py<ColumnBuffer>>,
+}
+
+impl ColumnArray {
+    fn new(py: Python<'_>, column: ColumnBuilder) -> PyResult<Self> {
+        let buffer = |storage| Py::new(py, ColumnBuffer::new(storage));
+        let null_count = column.validity.iter().filter(|valid| !**valid).count();
+        let (values, offsets, data) = match column.kind {
+            Kind::Null => (None, None, None),
+            Kind::Int64 => (Some(buffer(Storage::Int64(column.ints))?), None, None),
+            Kind::Float64 => (Some(buffer(Storage::Float64(column.floats))?), None, None),
+            Kind::Text | Kind::Blob => (
+                None,
+                Some(buffer(Storage::Int64(column.offsets))?),
+                Some(buffer(Storage::Bytes(column.data))?),
+            ),
+        };
+        Ok(ColumnArray {
+            name: column.name,
+            kind: column.kind,
+            len: column.len,
+            null_count,
+            validity: buffer(Storage::Bool(column.validity))?,
+            values,
+            offsets,
+            data,
+        })
+    }
+}
+
+#[pymethods]
+impl ColumnArray {
+    fn __len__(&self) -> usize {
+        self.len
+    }
+
+    fn __repr__(&self) -> String {
+        format!(
+            "<ColumnArray name={:?} dtype={} len={}>",
+            self.name,
+            self.kind.name(),
+            self.len
+        )
+    }
+
+    /// The column type: "int64", "float64", "text", "blob" or "null".
+    #[getter]
+    fn dtype(&self) -> &'static str {
+        self.kind.name()
+    }
+
+    #[getter]
+    fn null_count(&self) -> usize {
+        self.null_count
+    }
+
+    /// Converts the column back into a list of Python values.
+    fn to_pylist<'py>(&self, py: Python<'py>) -> PyResult<&'py PyList> {
+        let validity = self.validity.borrow(py);
+        let validity = match &validity.storage {
+            Storage::Bool(v) => v,
+            _ => unreachable!(),
+        };
+        let values = self.values.as_ref().map(|values| values.borrow(py));
+        let offsets = self.offsets.as_ref().map(|offsets| offsets.borrow(py));
+        let data = self.data.as_ref().map(|data| data.borrow(py));
+        let mut elements: Vec<PyObject> = Vec::with_capacity(self.len);
+        for idx in 0..self.len {
+            if !validity[idx] {
+                elements.push(py.None());
+                continue;
+            }
+            let element = match (&values, &offsets, &data) {
+                (Some(values), _, _) => match &values.storage {
+                    Storage::Int64(v) => v[idx].into_py(py),
+                    Storage::Float64(v) => v[idx].into_py(py),
+                    _ => unreachable!(),
+                },
+                (None, Some(offsets), Some(data)) => {
+                    let (offsets, data) = match (&offsets.storage, &data.storage) {
+                        (Storage::Int64(offsets), Storage::Bytes(data)) => (offsets, data),
+                        _ => unreachable!(),
+                    };
+                    let bytes = &data[offsets[idx] as usize..offsets[idx + 1] as usize];
+                    if self.kind == Kind::Text {
+                        std::str::from_utf8(bytes)
+                            .map_err(|err| PyValueError::new_err(err.to_string()))?
+                            .into_py(py)
+                    } else {
+                        PyBytes::new(py, bytes).into_py(py)
+                    }
+                }
+                _ => py.None(),
+            };
+            elements.push(element);
+        }
+        Ok(PyList::new(py, elements))
+    }
+}
@@ -0,0 +1,528 @@
+//! Conversion of fetched values by declared type or column name, like
+//! `sqlite3.register_converter()` with `detect_types`.
+//!
+//! Converters are looked up once per statement, by the first word of a
+//! column's declared type (`PARSE_DECLTYPES`) or the `[type]` suffix of its
+//! name (`PARSE_COLNAMES`), and applied while rows are converted. The
+//! built-in converters for timestamps, JSON and `F32_BLOB` vectors are
+//! implemented natively, so they never call into Python per value.
+
+use ::libsql as libsql_core;
+use pyo3::exceptions::{PyRecursionError, PyValueError};
+use pyo3::prelude::*;
+use pyo3::sync::GILOnceCell;
+use pyo3::types::{
+    PyBytes, PyDate, PyDateTime, PyDelta, PyDict, PyList, PyLong, PyTuple, PyTzInfo,
+};
+use std::sync::atomic::{AtomicU64, Ordering};
+use std::sync::Arc;
+
+static CONVERTERS: GILOnceCell<Py<PyDict>> = GILOnceCell::new();
+
+/// Bumped on every `register_converter()` call, so that statements can
+/// tell whether the converters they resolved are still current.
+static GENERATION: AtomicU64 = AtomicU64::new(0);
+
+fn converters(py: Python<'_>) -> &PyDict {
+    CONVERTERS
+        .get_or_init(py, || PyDict::new(py).into())
+        .as_ref(py)
+}
+
+pub(crate) fn generation() -> u64 {
+    GENERATION.load(Ordering::Acquire)
+}
+
+/// Registers `converter` to be called with the bytes of every non-NULL
+/// value of columns of type `typename`, like `sqlite3.register_converter()`.
+/// Type names are matched case-insensitively and take precedence over the
+/// built-in converters.
+#[pyfunction]
+pub(crate) fn register_converter(
+    py: Python<'_>,
+    typename: &str,
+    converter: PyObject,
+) -> PyResult<()> {
+    converters(py).set_item(typename.to_uppercase(), converter)?;
+    GENERATION.fetch_add(1, Ordering::AcqRel);
+    Ok(())
+}
+
+/// Returns the name of the converter for a column, from a `[type]` suffix
+/// of its name or the first word of its declared type.
+pub(crate) fn converter_name(
+    column_name: &str,
+    decltype: Option<&str>,
+    colnames: bool,
+    decltypes: bool,
+) -> Option<String> {
+    if colnames {
+        if let Some(start) = column_name.find('[') {
+            if let Some(len) = column_name[start + 1..].find(']') {
+                return Some(column_name[start + 1..start + 1 + len].to_uppercase());
+            }
+        }
+    }
+    if decltypes {
+        if let Some(decltype) = decltype {
+            let end = decltype
+                .find(|c: char| c == ' ' || c == '(')
+                .unwrap_or(decltype.len());
+            if end > 0 {
+                return Some(decltype[..end].to_uppercase());
+            }
+        }
+    }
+    None
+}
+
+enum Converter {
+    /// ISO 8601 `YYYY-MM-DD HH:MM:SS[.ffffff][Z|+HH:MM]` text.
+    Timestamp,
+    /// ISO 8601 `YYYY-MM-DD` text.
+    Date,
+    Json,
+    /// Little-endian `float32` vectors, as stored by libSQL vector columns.
+    F32Vector,
+    Python(PyObject),
+}
+
+impl Converter {
+    fn builtin(name: &str) -> Option<Self> {
+        match name {
+            "TIMESTAMP" | "DATETIME" => Some(Converter::Timestamp),
+            "DATE" => Some(Converter::Date),
+            "JSON" => Some(Converter::Json),
+            "F32_BLOB" | "FLOAT32" => Some(Converter::F32Vector),
+            _ => None,
+        }
+    }
+
+    fn convert(&self, py: Python<'_>, value: libsql_core::Value) -> PyResult<PyObject> {
+        use libsql_core::Value;
+        match (self, value) {
+            (_, Value::Null) => Ok(py.None()),
+            (Converter::Timestamp, Value::Text(text)) => parse_timestamp(py, &text),
+            (Converter::Date, Value::Text(text)) => parse_date(py, &text),
+            (Converter::Json, Value::Text(text)) => JsonParser::new(py, &text).parse(),
+            (Converter::F32Vector, Value::Blob(blob)) if blob.len() % 4 == 0 => {
+                let values = blob
+                    .chunks_exact(4)
+                    .map(|chunk| f32::from_le_bytes(chunk.try_into().unwrap()) as f64);
+                Ok(PyList::new(py, values).into())
+            }
+            (Converter::Python(converter), value) => {
+                let bytes = match value {
+                    Value::Integer(value) => value.to_string().into_bytes(),
+                    Value::Real(value) => format!("{value:?}").into_bytes(),
+                    Value::Text(value) => value.into_bytes(),
+                    Value::Blob(value) => value,
+                    Value::Null => unreachable!(),
+                };
+                converter.call1(py, (PyBytes::new(py, &bytes),))
+            }
+            (_, value) => Ok(crate::convert_value(py, value)),
+        }
+    }
+}
+
+/// The converters of a statement's result columns.
+pub(crate) struct Converters(Vec<Option<Converter>>);
+
+impl Converters {
+    /// Looks up the converters for columns with the given converter names.
+    /// Returns `None` if no column has one.
+    pub(crate) fn resolve(py: Python<'_>, names: &[Option<String>]) -> Option<Arc<Self>> {
+        let registry = converters(py);
+        let converters: Vec<Option<Converter>> = names
+            .iter()
+            .map(|name| {
+                let name = name.as_deref()?;
+                match registry.get_item(name) {
+                    Some(converter) => Some(Converter::Python(converter.into())),
+                    None => Converter::builtin(name),
+                }
+            })
+            .collect();
+        if converters.iter().all(Option::is_none) {
+            return None;
+        }
+        Some(Arc::new(Converters(converters)))
+    }
+
+    /// Converts `row`, returning blobs of columns without a converter as
+    /// buffers if `blob_buffers` is set.
+    pub(crate) fn convert_row<'py>(
+        &self,
+        py: Python<'py>,
+        row: Vec<libsql_core::Value>,
+        blob_buffers: bool,
+    ) -> PyResult<&'py PyTuple> {
+        let mut elements: Vec<PyObject> = Vec::with_capacity(row.len());
+        for (idx, value) in row.into_iter().enumerate() {
+            elements.push(match self.0.get(idx) {
+                Some(Some(converter)) => converter.convert(py, value)?,
+                _ => crate::convert_fetched(py, value, blob_buffers)?,
+            });
+        }
+        Ok(PyTuple::new(py, elements))
+    }
+}
+
+/// Reads a fixed number of ASCII digits.
+fn digits(text: &[u8], pos: &mut usize, count: usize) -> Option<u32> {
+    let digits = text.get(*pos..*pos + count)?;
+    let mut value = 0;
+    for digit in digits {
+        if !digit.is_ascii_digit() {
+            return None;
+        }
+        value = value * 10 + (digit - b'0') as u32;
+    }
+    *pos += count;
+    Some(value)
+}
+
+fn expect(text: &[u8], pos: &mut usize, byte: u8) -> Option<()> {
+    if text.get(*pos) == Some(&byte) {
+        *pos += 1;
+        return Some(());
+    }
+    None
+}
+
+fn parse_ymd(text: &[u8], pos: &mut usize) -> Option<(i32, u8, u8)> {
+    let year = digits(text, pos, 4)?;
+    expect(text, pos, b'-')?;
+    let month = digits(text, pos, 2)?;
+    expect(text, pos, b'-')?;
+    let day = digits(text, pos, 2)?;
+    Some((year as i32, month as u8, day as u8))
+}
+
+fn invalid(kind: &str, text: &str) -> PyErr {
+    PyValueError::new_err(format!("Invalid {kind}: {text:?}"))
+}
+
+fn parse_date(py: Python<'_>, text: &str) -> PyResult<PyObject> {
+    let mut pos = 0;
+    match parse_ymd(text.as_bytes(), &mut pos) {
+        Some((year, month, day)) if pos == text.len() => {
+            Ok(PyDate::new(py, year, month, day)?.into())
+        }
+        _ => Err(invalid("date", text)),
+    }
+}
+
+fn parse_timestamp(py: Python<'_>, text: &str) -> PyResult<PyObject> {
+    let bytes = text.as_bytes();
+    let mut pos = 0;
+    let (year, month, day) =
+        parse_ymd(bytes, &mut pos).ok_or_else(|| invalid("timestamp", text))?;
+    let (mut hour, mut minute, mut second, mut micro) = (0, 0, 0, 0);
+    let mut offset = None;
+    if pos < bytes.len() {
+        let time = (|| {
+            if !matches!(bytes[pos], b' ' | b'T') {
+                return None;
+            }
+            pos += 1;
+            hour = digits(bytes, &mut pos, 2)?;
+            expect(bytes, &mut pos, b':')?;
+            minute = digits(bytes, &mut pos, 2)?;
+            if expect(bytes, &mut pos, b':').is_some() {
+                second = digits(bytes, &mut pos, 2)?;
+                if expect(bytes, &mut pos, b'.').is_some() {
+                    let start = pos;
+                    while pos < bytes.len() && bytes[pos].is_ascii_digit() {
+                        if pos - start < 6 {
+                            micro = micro * 10 + (bytes[pos] - b'0') as u32;
+                        }
+                        pos += 1;
+                    }
+                    if pos == start {
+                        return None;
+                    }
+                    for _ in (pos - start)..6 {
+                        micro *= 10;
+                    }
+                }
+            }
+            match bytes.get(pos) {
+                None => {}
+                Some(b'Z') => {
+                    pos += 1;
+                    offset = Some(0);
+                }
+                Some(sign @ (b'+' | b'-')) => {
+                    let sign = if *sign == b'-' { -1 } else { 1 };
+                    pos += 1;
+                    let hours = digits(bytes, &mut pos, 2)? as i32;
+                    expect(bytes, &mut pos, b':');
+                    let minutes = digits(bytes, &mut pos, 2)? as i32;
+                    offset = Some(sign * (hours * 3600 + minutes * 60));
+                }
+                Some(_) => return None,
+            }
+            (pos == bytes.len()).then_some(())
+        })();
+        time.ok_or_else(|| invalid("timestamp", text))?;
+    }
+    let tzinfo = offset.map(|offset| timezone(py, offset)).transpose()?;
+    let datetime = PyDateTime::new(
+        py,
+        year,
+        month,
+        day,
+        hour as u8,
+        minute as u8,
+        second as u8,
+        micro,
+        tzinfo,
+    )?;
+    Ok(datetime.into())
+}
+
+/// Returns a `datetime.timezone` with the given UTC offset in seconds.
+fn timezone(py: Python<'_>, offset: i32) -> PyResult<&PyTzInfo> {
+    static TIMEZONE: GILOnceCell<PyObject> = GILOnceCell::new();
+    let timezone = TIMEZONE.get_or_try_init(py, || {
+        Ok::<_, PyErr>(py.import("datetime")?.getattr("timezone")?.into())
+    })?;
+    let delta = PyDelta::new(py, 0, offset, 0, true)?;
+    Ok(timezone.as_ref(py).call1((delta,))?.downcast()?)
+}
+
+/// Arrays and objects nested deeper than this raise `RecursionError`, like
+/// they would in `json.loads()` under the default recursion limit. The
+/// parser recurses on the native stack, which must not overflow.
+const MAX_JSON_DEPTH: usize = 1000;
+
+/// Parses JSON text straight into Python objects.
+struct JsonParser<'a, 'py> {
+    py: Python<'py>,
+    text: &'a str,
+    pos: usize,
+    /// How many arrays and objects enclose the current position.
+    depth: usize,
+}
+
+impl<'a, 'py> JsonParser<'a, 'py> {
+    fn new(py: Python<'py>, text: &'a str) -> Self {
+        JsonParser {
+            py,
+            text,
+            pos: 0,
+            depth: 0,
+        }
+    }
+
+    /// Enters an array or object.
+    fn nest(&mut self, kind: &str) -> PyResult<()> {
+        self.depth += 1;
+        if self.depth > MAX_JSON_DEPTH {
+            return Err(PyRecursionError::new_err(format!(
+                "maximum recursion depth exceeded while decoding a JSON {kind}"
+            )));
+        }
+        Ok(())
+    }
+
+    fn parse(mut self) -> PyResult<PyObject> {
+        let value = self.value()?;
+        self.skip_space();
+        if self.pos != self.text.len() {
+            return Err(self.error());
+        }
+        Ok(value)
+    }
+
+    fn error(&self) -> PyErr {
+        PyValueError::new_err(format!("Invalid JSON at position {}", self.pos))
+    }
+
+    fn peek(&self) -> Option<u8> {
+        self.text.as_bytes().get(self.pos).copied()
+    }
+
+    fn skip_space(&mut self) {
+        while matches!(self.peek(), Some(b' ' | b'\t' | b'\n' | b'\r')) {
+            self.pos += 1;
+        }
+    }
+
+    fn literal(&mut self, literal: &str, value: PyObject) -> PyResult<PyObject> {
+        if !self.text[self.pos..].starts_with(literal) {
+            return Err(self.error());
+        }
+        self.pos += literal.len();
+        Ok(value)
+    }
+
+    fn value(&mut self) -> PyResult<PyObject> {
+        let py = self.py;
+        self.skip_space();
+        match self.peek() {
+            Some(b'{') => {
+                self.nest("object")?;
+                let object = self.object()?;
+                self.depth -= 1;
+                Ok(object)
+            }
+            Some(b'[') => {
+                self.nest("array")?;
+                let array = self.array()?;
+                self.depth -= 1;
+                Ok(array)
+            }
+            Some(b'"') => Ok(self.string()?.into_py(py)),
+            Some(b't') => self.literal("true", true.into_py(py)),
+            Some(b'f') => self.literal("false", false.into_py(py)),
+            Some(b'n') => self.literal("null", py.None()),
+            Some(b'-' | b'0'..=b'9') => self.number(),
+            _ => Err(self.error()),
+        }
+    }
+
+    fn object(&mut self) -> PyResult<PyObject> {
+        let dict = PyDict::new(self.py);
+        self.pos += 1;
+        self.skip_space();
+        if self.peek() == Some(b'}') {
+            self.pos += 1;
+            return Ok(dict.into());
+        }
+        loop {
+            self.skip_space();
+            if self.peek() != Some(b'"') {
+                return Err(self.error());
+            }
+            let key = self.string()?;
+            self.skip_space();
+            if self.peek() != Some(b':') {
+                return Err(self.error());
+            }
+            self.pos += 1;
+            dict.set_item(key, self.value()?)?;
+            self.skip_space();
+            match self.peek() {
+                Some(b',') => self.pos += 1,
+                Some(b'}') => {
+                    self.pos += 1;
+                    return Ok(dict.into());
+                }
+                _ => return Err(self.error()),
+            }
+        }
+    }
+
+    fn array(&mut self) -> PyResult<PyObject> {
+        let list = PyList::empty(self.py);
+        self.pos += 1;
+        self.skip_space();
+        if self.peek() == Some(b']') {
+            self.pos += 1;
+            return Ok(list.into());
+        }
+        loop {
+            list.append(self.value()?)?;
+            self.skip_space();
+            match self.peek() {
+                Some(b',') => self.pos += 1,
+                Some(b']') => {
+                    self.pos += 1;
+                    return Ok(list.into());
+                }
+                _ => return Err(self.error()),
+            }
+        }
+    }
+
+    fn hex4(&mut self) -> PyResult<u32> {
+        let hex = self
+            .text
+            .get(self.pos..self.pos + 4)
+            .ok_or_else(|| self.error())?;
+        let value = u32::from_str_radix(hex, 16).map_err(|_| self.error())?;
+        self.pos += 4;
+        Ok(value)
+    }
+
+    fn string(&mut self) -> PyResult<String> {
+        self.pos += 1;
+        let mut out = String::new();
+        loop {
+            let start = self.pos;
+            while !matches!(self.peek(), Some(b'"' | b'\\') | None) {
+                self.pos += 1;
+            }
+            out.push_str(&self.text[start..self.pos]);
+            match self.peek() {
+                Some(b'"') => {
+                    self.pos += 1;
+                    return Ok(out);
+                }
+                Some(b'\\') => {
+                    self.pos += 1;
+                    let escape = self.peek().ok_or_else(|| self.error())?;
+                    self.pos += 1;
+                    match escape {
+                        b'"' => out.push('"'),
+                        b'\\' => out.push('\\'),
+                        b'/' => out.push('/'),
+                        b'b' => out.push('\u{8}'),
+                        b'f' => out.push('\u{c}'),
+                        b'n' => out.push('\n'),
+                        b'r' => out.push('\r'),
+                        b't' => out.push('\t'),
+                        b'u' => {
+                            let mut code = self.hex4()?;
+                            if (0xD800..0xDC00).contains(&code)
+                                && self.text[self.pos..].starts_with("\\u")
+                            {
+                                self.pos += 2;
+                                let low = self.hex4()?;
+                                if !(0xDC00..0xE000).contains(&low) {
+                                    return Err(self.error());
+                                }
+                                code = 0x10000 + ((code - 0xD800) << 10) + (low - 0xDC00);
+                            }
+                            out.push(char::from_u32(code).unwrap_or('\u{fffd}'));
+                        }
+                        _ => return Err(self.error()),
+                    }
+                }
+                _ => return Err(self.error()),
+            }
+        }
+    }
+
+    fn number(&mut self) -> PyResult<PyObject> {
+        let py = self.py;
+        let start = self.pos;
+        let mut integer = true;
+        if self.peek() == Some(b'-') {
+            self.pos += 1;
+        }
+        while let Some(byte) = self.peek() {
+            match byte {
+                b'0'..=b'9' => {}
+                b'.' | b'e' | b'E' | b'+' | b'-' => integer = false,
+                _ => break,
+            }
+            self.pos += 1;
+        }
+        let number = &self.text[start..self.pos];
+        if integer {
+            if let Ok(value) = number.parse::<i64>() {
+                return Ok(value.into_py(py));
+            }
+            // Integers beyond 64 bits become Python ints of arbitrary size.
+            return Ok(py.get_type::<PyLong>().call1((number,))?.into());
+        }
+        match number.parse::<f64>() {
+            Ok(value) => Ok(value.into_py(py)),
+            Err(_) => Err(self.error()),
+        }
+    }
+}
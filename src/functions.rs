@@ -0,0 +1,427 @@
+//! User-defined SQL functions: `Connection.create_function()` and
+//! `Connection.create_aggregate()`.
+//!
+//! libSQL does not expose the SQLite connection behind a `Connection`, so
+//! its handle is captured while the connection is opened: an auto
+//! extension, which SQLite runs for every new connection on the thread
+//! that opens it, stores the handle in a thread-local that
+//! `connect_guard()` takes right after `Database::connect()` returns.
+//! Remote connections have no SQLite connection and no handle.
+//!
+//! Functions read their arguments into `libsql::Value`s and only take the
+//! GIL to call into Python. Aggregates registered with `batched=True`
+//! collect their arguments without the GIL and pass them to `step()` as
+//! one list per argument every `AGGREGATE_BATCH_SIZE` rows.
+
+use crate::convert_value;
+use ::libsql as libsql_core;
+use libsql_ffi as ffi;
+use pyo3::buffer::PyBuffer;
+use pyo3::exceptions::PyValueError;
+use pyo3::prelude::*;
+use pyo3::types::{PyBool, PyBytes, PyFloat, PyList, PyLong, PyString, PyTuple};
+use std::cell::Cell;
+use std::ffi::CString;
+use std::os::raw::{c_char, c_int, c_void};
+use std::panic::{catch_unwind, AssertUnwindSafe};
+use std::sync::Once;
+
+/// Rows an aggregate registered with `batched=True` collects before each
+/// call to its `step()` method.
+const AGGREGATE_BATCH_SIZE: usize = 1024;
+
+/// The handle of a local connection's SQLite connection.
+pub(crate) struct SqliteHandle(pub(crate) *mut ffi::sqlite3);
+
+// SAFETY: libSQL opens connections in serialized threading mode, so the
+// handle may be used from any thread while the connection is open.
+unsafe impl Send for SqliteHandle {}
+unsafe impl Sync for SqliteHandle {}
+
+thread_local! {
+    static OPENED: Cell<*mut ffi::sqlite3> = Cell::new(std::ptr::null_mut());
+}
+
+static INSTALL: Once = Once::new();
+
+unsafe extern "C" fn remember_connection(
+    db: *mut ffi::sqlite3,
+    _err: *mut *mut c_char,
+    _api: *const ffi::sqlite3_api_routines,
+) -> c_int {
+    OPENED.with(|opened| opened.set(db));
+    ffi::SQLITE_OK
+}
+
+/// Runs `open`, returning its result and the handle of the SQLite
+/// connection it opened on this thread, if any.
+pub(crate) fn capture_handle<T>(open: impl FnOnce() -> T) -> (T, Option<SqliteHandle>) {
+    INSTALL.call_once(|| unsafe {
+        let entry: unsafe extern "C" fn(
+            *mut ffi::sqlite3,
+            *mut *mut c_char,
+            *const ffi::sqlite3_api_routines,
+        ) -> c_int = remember_connection;
+        ffi::sqlite3_auto_extension(Some(std::mem::transmute::<_, unsafe extern "C" fn()>(
+            entry,
+        )));
+    });
+    OPENED.with(|opened| opened.set(std::ptr::null_mut()));
+    let result = open();
+    let db = OPENED.with(|opened| opened.replace(std::ptr::null_mut()));
+    (result, (!db.is_null()).then_some(SqliteHandle(db)))
+}
+
+/// A Python aggregate class and the way its `step()` method is called.
+struct Aggregate {
+    class: PyObject,
+    batched: bool,
+}
+
+/// The state of one aggregate invocation, kept in SQLite's aggregate
+/// context.
+struct AggregateState {
+    instance: Option<PyObject>,
+    /// Arguments not yet passed to `step()`, one vector per argument.
+    pending: Vec<Vec<libsql_core::Value>>,
+    rows: usize,
+}
+
+fn check_name(name: &str, narg: i32) -> PyResult<CString> {
+    if !(-1..=127).contains(&narg) {
+        return Err(PyValueError::new_err("narg must be between -1 and 127"));
+    }
+    CString::new(name).map_err(|_| PyValueError::new_err("name must not contain NUL characters"))
+}
+
+pub(crate) fn check_status(handle: &SqliteHandle, status: c_int) -> PyResult<()> {
+    if status == ffi::SQLITE_OK {
+        return Ok(());
+    }
+    let message = unsafe { std::ffi::CStr::from_ptr(ffi::sqlite3_errmsg(handle.0)) };
+    Err(PyValueError::new_err(
+        message.to_string_lossy().into_owned(),
+    ))
+}
+
+/// Registers `func` as the scalar function `name` of `narg` arguments, or
+/// removes the function if `func` is `None`.
+pub(crate) fn create_function(
+    handle: &SqliteHandle,
+    name: &str,
+    narg: i32,
+    func: Option<PyObject>,
+    deterministic: bool,
+) -> PyResult<()> {
+    let name = check_name(name, narg)?;
+    let mut flags = ffi::SQLITE_UTF8;
+    if deterministic {
+        flags |= ffi::SQLITE_DETERMINISTIC;
+    }
+    let status = unsafe {
+        match func {
+            Some(func) => ffi::sqlite3_create_function_v2(
+                handle.0,
+                name.as_ptr(),
+                narg,
+                flags,
+                Box::into_raw(Box::new(func)) as *mut c_void,
+                Some(call_function),
+                None,
+                None,
+                Some(destroy::<PyObject>),
+            ),
+            None => ffi::sqlite3_create_function_v2(
+                handle.0,
+                name.as_ptr(),
+                narg,
+                flags,
+                std::ptr::null_mut(),
+                None,
+                None,
+                None,
+                None,
+            ),
+        }
+    };
+    check_status(handle, status)
+}
+
+/// Registers `class` as the aggregate function `name` of `narg` arguments,
+/// or removes the function if `class` is `None`.
+pub(crate) fn create_aggregate(
+    handle: &SqliteHandle,
+    name: &str,
+    narg: i32,
+    class: Option<PyObject>,
+    batched: bool,
+) -> PyResult<()> {
+    let name = check_name(name, narg)?;
+    let status = unsafe {
+        match class {
+            Some(class) => ffi::sqlite3_create_function_v2(
+                handle.0,
+                name.as_ptr(),
+                narg,
+                ffi::SQLITE_UTF8,
+                Box::into_raw(Box::new(Aggregate { class, batched })) as *mut c_void,
+                None,
+                Some(aggregate_step),
+                Some(aggregate_final),
+                Some(destroy::<Aggregate>),
+            ),
+            None => ffi::sqlite3_create_function_v2(
+                handle.0,
+                name.as_ptr(),
+                narg,
+                ffi::SQLITE_UTF8,
+                std::ptr::null_mut(),
+                None,
+                None,
+                None,
+                None,
+            ),
+        }
+    };
+    check_status(handle, status)
+}
+
+unsafe extern "C" fn destroy<T>(data: *mut c_void) {
+    drop(Box::from_raw(data as *mut T));
+}
+
+/// Reads the arguments of a function call.
+unsafe fn read_args(argc: c_int, argv: *mut *mut ffi::sqlite3_value) -> Vec<libsql_core::Value> {
+    (0..argc as usize)
+        .map(|idx| read_value(*argv.add(idx)))
+        .collect()
+}
+
+unsafe fn read_value(value: *mut ffi::sqlite3_value) -> libsql_core::Value {
+    match ffi::sqlite3_value_type(value) {
+        ffi::SQLITE_INTEGER => libsql_core::Value::Integer(ffi::sqlite3_value_int64(value)),
+        ffi::SQLITE_FLOAT => libsql_core::Value::Real(ffi::sqlite3_value_double(value)),
+        ffi::SQLITE_TEXT => {
+            let text = ffi::sqlite3_value_text(value);
+            let len = ffi::sqlite3_value_bytes(value) as usize;
+            let bytes = if text.is_null() {
+                &[][..]
+            } else {
+                std::slice::from_raw_parts(text, len)
+            };
+            libsql_core::Value::Text(String::from_utf8_lossy(bytes).into_owned())
+        }
+        ffi::SQLITE_BLOB => {
+            let blob = ffi::sqlite3_value_blob(value) as *const u8;
+            let len = ffi::sqlite3_value_bytes(value) as usize;
+            if blob.is_null() {
+                libsql_core::Value::Blob(vec![])
+            } else {
+                libsql_core::Value::Blob(std::slice::from_raw_parts(blob, len).to_vec())
+            }
+        }
+        _ => libsql_core::Value::Null,
+    }
+}
+
+/// Tells SQLite to copy a text or blob result before the call returns.
+fn transient() -> ffi::sqlite3_destructor_type {
+    Some(unsafe { std::mem::transmute::<isize, unsafe extern "C" fn(*mut c_void)>(-1) })
+}
+
+/// Sets the result of a function call from the Python value `value`.
+unsafe fn set_result(ctx: *mut ffi::sqlite3_context, value: &PyAny) -> PyResult<()> {
+    if value.is_none() {
+        ffi::sqlite3_result_null(ctx);
+    } else if value.is_instance_of::<PyBool>() || value.is_instance_of::<PyLong>() {
+        ffi::sqlite3_result_int64(ctx, value.extract::<i64>()?);
+    } else if value.is_instance_of::<PyFloat>() {
+        ffi::sqlite3_result_double(ctx, value.extract::<f64>()?);
+    } else if let Ok(text) = value.downcast::<PyString>() {
+        let text = text.to_str()?;
+        ffi::sqlite3_result_text64(
+            ctx,
+            text.as_ptr() as *const c_char,
+            text.len() as u64,
+            transient(),
+            ffi::SQLITE_UTF8 as u8,
+        );
+    } else if let Ok(bytes) = value.downcast::<PyBytes>() {
+        let bytes = bytes.as_bytes();
+        ffi::sqlite3_result_blob64(
+            ctx,
+            bytes.as_ptr() as *const c_void,
+            bytes.len() as u64,
+            transient(),
+        );
+    } else if let Ok(buffer) = PyBuffer::<u8>::get(value) {
+        // Any other object exporting bytes, like a bytearray or a
+        // memoryview. SQLite copies the blob before the buffer is released.
+        let copy;
+        let bytes = if buffer.is_c_contiguous() {
+            std::slice::from_raw_parts(buffer.buf_ptr() as *const u8, buffer.len_bytes())
+        } else {
+            copy = buffer.to_vec(value.py())?;
+            &copy[..]
+        };
+        ffi::sqlite3_result_blob64(
+            ctx,
+            bytes.as_ptr() as *const c_void,
+            bytes.len() as u64,
+            transient(),
+        );
+    } else {
+        return Err(PyValueError::new_err(format!(
+            "User-defined function returned unsupported type {}",
+            value.get_type().name()?
+        )));
+    }
+    Ok(())
+}
+
+fn set_error(ctx: *mut ffi::sqlite3_context, message: &str) {
+    unsafe {
+        ffi::sqlite3_result_error(
+            ctx,
+            message.as_ptr() as *const c_char,
+            message.len() as c_int,
+        )
+    };
+}
+
+/// Runs `call`, turning Python exceptions and panics into SQL errors.
+fn guarded(ctx: *mut ffi::sqlite3_context, what: &str, call: impl FnOnce() -> PyResult<()>) {
+    match catch_unwind(AssertUnwindSafe(call)) {
+        Ok(Ok(())) => {}
+        Ok(Err(err)) => set_error(ctx, &format!("user-defined {what} raised exception: {err}")),
+        Err(_) => set_error(ctx, &format!("user-defined {what} panicked")),
+    }
+}
+
+unsafe extern "C" fn call_function(
+    ctx: *mut ffi::sqlite3_context,
+    argc: c_int,
+    argv: *mut *mut ffi::sqlite3_value,
+) {
+    let func = &*(ffi::sqlite3_user_data(ctx) as *const PyObject);
+    let args = read_args(argc, argv);
+    guarded(ctx, "function", || {
+        Python::with_gil(|py| {
+            let args = PyTuple::new(py, args.into_iter().map(|value| convert_value(py, value)));
+            let result = func.call1(py, args)?;
+            set_result(ctx, result.as_ref(py))
+        })
+    });
+}
+
+/// Returns the state of the aggregate invocation `ctx` belongs to, or
+/// null if `create` is false and `step()` never ran.
+unsafe fn aggregate_state(
+    ctx: *mut ffi::sqlite3_context,
+    create: bool,
+) -> *mut *mut AggregateState {
+    let size = if create {
+        std::mem::size_of::<*mut AggregateState>() as c_int
+    } else {
+        0
+    };
+    let slot = ffi::sqlite3_aggregate_context(ctx, size) as *mut *mut AggregateState;
+    if !slot.is_null() && (*slot).is_null() && create {
+        *slot = Box::into_raw(Box::new(AggregateState {
+            instance: None,
+            pending: vec![],
+            rows: 0,
+        }));
+    }
+    slot
+}
+
+impl AggregateState {
+    fn instance(&mut self, py: Python<'_>, aggregate: &Aggregate) -> PyResult<PyObject> {
+        if self.instance.is_none() {
+            self.instance = Some(aggregate.class.call0(py)?);
+        }
+        Ok(self.instance.as_ref().unwrap().clone_ref(py))
+    }
+
+    /// Passes the collected arguments to `step()` as one list per argument.
+    fn flush(&mut self, py: Python<'_>, aggregate: &Aggregate) -> PyResult<()> {
+        if self.rows == 0 {
+            return Ok(());
+        }
+        let instance = self.instance(py, aggregate)?;
+        let columns = self
+            .pending
+            .iter_mut()
+            .map(|column| PyList::new(py, column.drain(..).map(|value| convert_value(py, value))));
+        let columns = PyTuple::new(py, columns);
+        self.rows = 0;
+        instance.call_method1(py, "step", columns)?;
+        Ok(())
+    }
+}
+
+unsafe extern "C" fn aggregate_step(
+    ctx: *mut ffi::sqlite3_context,
+    argc: c_int,
+    argv: *mut *mut ffi::sqlite3_value,
+) {
+    let aggregate = &*(ffi::sqlite3_user_data(ctx) as *const Aggregate);
+    let slot = aggregate_state(ctx, true);
+    if slot.is_null() {
+        ffi::sqlite3_result_error_nomem(ctx);
+        return;
+    }
+    let state = &mut **slot;
+    let args = read_args(argc, argv);
+    if aggregate.batched {
+        if state.pending.len() != args.len() {
+            state.pending = args
+                .iter()
+                .map(|_| Vec::with_capacity(AGGREGATE_BATCH_SIZE))
+                .collect();
+        }
+        for (column, value) in state.pending.iter_mut().zip(args) {
+            column.push(value);
+        }
+        state.rows += 1;
+        if state.rows < AGGREGATE_BATCH_SIZE {
+            return;
+        }
+        guarded(ctx, "aggregate's 'step' method", || {
+            Python::with_gil(|py| state.flush(py, aggregate))
+        });
+        return;
+    }
+    guarded(ctx, "aggregate's 'step' method", || {
+        Python::with_gil(|py| {
+            let instance = state.instance(py, aggregate)?;
+            let args = PyTuple::new(py, args.into_iter().map(|value| convert_value(py, value)));
+            instance.call_method1(py, "step", args)?;
+            Ok(())
+        })
+    });
+}
+
+unsafe extern "C" fn aggregate_final(ctx: *mut ffi::sqlite3_context) {
+    let aggregate = &*(ffi::sqlite3_user_data(ctx) as *const Aggregate);
+    let slot = aggregate_state(ctx, false);
+    let mut state = if slot.is_null() || (*slot).is_null() {
+        // No rows were aggregated.
+        Box::new(AggregateState {
+            instance: None,
+            pending: vec![],
+            rows: 0,
+        })
+    } else {
+        Box::from_raw(std::mem::replace(&mut *slot, std::ptr::null_mut()))
+    };
+    guarded(ctx, "aggregate's 'finalize' method", || {
+        Python::with_gil(|py| {
+            state.flush(py, aggregate)?;
+            let instance = state.instance(py, aggregate)?;
+            let result = instance.call_method0(py, "finalize")?;
+            set_result(ctx, result.as_ref(py))
+        })
+    });
+}
@@ -1,28 +1,56 @@
 use ::libsql as libsql_core;
 use pyo3::create_exception;
-use pyo3::exceptions::PyValueError;
+use pyo3::exceptions::{PyTimeoutError, PyValueError};
 use pyo3::prelude::*;
-use pyo3::types::{PyList, PyTuple};
+use pyo3::types::{PyDict, PyList, PyTuple};
 use std::cell::{OnceCell, RefCell};
-use std::sync::{Arc, OnceLock};
-use std::time::Duration;
-use tokio::runtime::{Handle, Runtime};
+use std::collections::VecDeque;
+use std::sync::atomic::{AtomicBool, AtomicUsize, Ordering};
+use std::sync::{Arc, Mutex};
+use std::time::{Duration, Instant};
 
-const LEGACY_TRANSACTION_CONTROL: i32 = -1;
+mod aio;
+mod batch;
+mod blob;
+mod busy;
+mod columnar;
+mod converters;
+mod functions;
+mod params;
+mod pool;
+mod replica;
+mod row;
+mod runtime;
+mod snapshot;
+mod sql;
+mod statement_cache;
+mod trace;
+mod transaction;
+mod vector;
 
-fn rt() -> Handle {
-    static RT: OnceLock<Runtime> = OnceLock::new();
+use busy::{BusyHandler, BusyPolicy};
+use columnar::{ColumnBuffer, ColumnsBuilder, Storage};
+use converters::Converters;
+use params::to_params;
+use pool::PoolShared;
+use replica::{Database, SyncHandle};
+use row::{Row, RowIndex};
+use runtime::{runtime, ConnectionRuntime};
+use statement_cache::{CachedStatement, StatementCache};
+use trace::{Fetched, Tracer};
+use transaction::Transaction;
+use vector::VectorsBuilder;
 
-    RT.get_or_init(|| {
-        tokio::runtime::Builder::new_multi_thread()
-            .worker_threads(1)
-            .enable_all()
-            .build()
-            .unwrap()
-    })
-    .handle()
-    .clone()
-}
+/// `detect_types` flag that reports declared column types.
+const PARSE_DECLTYPES: i32 = 1;
+/// `detect_types` flag that strips `[type]` suffixes from column names.
+const PARSE_COLNAMES: i32 = 2;
+
+const LEGACY_TRANSACTION_CONTROL: i32 = -1;
+const DEFAULT_CACHED_STATEMENTS: usize = 128;
+const EXECUTEMANY_CHUNK_SIZE: usize = 1024;
+/// How often a call blocked on the runtime checks for Python signals.
+const SIGNAL_CHECK_INTERVAL: Duration = Duration::from_millis(50);
 
 fn to_py_err(error: libsql_core::errors::Error) -> PyErr {
     let msg = match error {
@@ -38,7 +66,7 @@ fn is_remote_path(path: &str) -> bool {
 
 #[pyfunction]
 #[cfg(not(Py_3_12))]
-#[pyo3(signature = (database, timeout=5.0, isolation_level="DEFERRED".to_string(), check_same_thread=true, uri=false, sync_url=None, sync_interval=None, auth_token="", encryption_key=None))]
+#[pyo3(signature = (database, timeout=5.0, isolation_level="DEFERRED".to_string(), check_same_thread=true, uri=false, sync_url=None, sync_interval=None, auth_token="", encryption_key=None, cached_statements=DEFAULT_CACHED_STATEMENTS, dedicated_runtime=false, detect_types=0))]
 fn connect(
     py: Python<'_>,
     database: String,
@@ -50,6 +78,9 @@ fn connect(
     sync_interval: Option<f64>,
     auth_token: &str,
     encryption_key: Option<String>,
+    cached_statements: usize,
+    dedicated_runtime: bool,
+    detect_types: i32,
 ) -> PyResult<Connection> {
     let conn = _connect_core(
         py,
@@ -62,13 +93,16 @@ fn connect(
         sync_interval,
         auth_token,
         encryption_key,
+        cached_statements,
+        dedicated_runtime,
+        detect_types,
     )?;
     Ok(conn)
 }
 
 #[pyfunction]
 #[cfg(Py_3_12)]
-#[pyo3(signature = (database, timeout=5.0, isolation_level="DEFERRED".to_string(), check_same_thread=true, uri=false, sync_url=None, sync_interval=None, auth_token="", encryption_key=None, autocommit = LEGACY_TRANSACTION_CONTROL))]
+#[pyo3(signature = (database, timeout=5.0, isolation_level="DEFERRED".to_string(), check_same_thread=true, uri=false, sync_url=None, sync_interval=None, auth_token="", encryption_key=None, cached_statements=DEFAULT_CACHED_STATEMENTS, dedicated_runtime=false, detect_types=0, autocommit = LEGACY_TRANSACTION_CONTROL))]
 fn connect(
     py: Python<'_>,
     database: String,
@@ -80,6 +114,9 @@ fn connect(
     sync_interval: Option<f64>,
     auth_token: &str,
     encryption_key: Option<String>,
+    cached_statements: usize,
+    dedicated_runtime: bool,
+    detect_types: i32,
     autocommit: i32,
 ) -> PyResult<Connection> {
     let mut conn = _connect_core(
@@ -93,6 +130,9 @@ fn connect(
         sync_interval,
         auth_token,
         encryption_key,
+        cached_statements,
+        dedicated_runtime,
+        detect_types,
     )?;
 
     conn.autocommit =
@@ -117,10 +157,57 @@ fn _connect_core(
     sync_interval: Option<f64>,
     auth_token: &str,
     encryption_key: Option<String>,
+    cached_statements: usize,
+    dedicated_runtime: bool,
+    detect_types: i32,
 ) -> PyResult<Connection> {
+    let auth_token = auth_token.to_string();
+    let runtime = ConnectionRuntime::new(dedicated_runtime)?;
+    let db = block_on(
+        py,
+        &runtime,
+        open_database(
+            database,
+            sync_url,
+            sync_interval,
+            auth_token,
+            encryption_key,
+        ),
+    )??;
+
+    let autocommit = isolation_level.is_none() as i32;
+    let behavior = transaction::parse_behavior(isolation_level.as_deref(), "isolation_level")?;
+    let conn = connect_guard(
+        &db,
+        timeout,
+        cached_statements,
+        detect_types,
+        behavior,
+        runtime.clone(),
+    )?;
+    Ok(Connection {
+        db: Arc::new(db),
+        conn: RefCell::new(Some(conn)),
+        runtime,
+        isolation_level,
+        autocommit,
+        pool: None,
+        cursors: RefCell::new(Vec::new()),
+        row_factory: None,
+        blob_buffers: false,
+    })
+}
+
+async fn open_database(
+    database: String,
+    sync_url: Option<String>,
+    sync_interval: Option<f64>,
+    auth_token: String,
+    encryption_key: Option<String>,
+) -> PyResult<Database> {
     let ver = env!("CARGO_PKG_VERSION");
     let ver = format!("libsql-python-rpc-{ver}");
-    let rt = rt();
+    let encrypted = encryption_key.is_some();
     let encryption_config = match encryption_key {
         Some(key) => {
             let cipher = libsql_core::Cipher::default();
@@ -129,55 +216,73 @@ fn _connect_core(
         }
         None => None,
     };
-    let db = if is_remote_path(&database) {
+    let remote = is_remote_path(&database);
+    let db = if remote {
         let result = libsql_core::Database::open_remote_internal(database.clone(), auth_token, ver);
         result.map_err(to_py_err)?
     } else {
         match sync_url {
             Some(sync_url) => {
                 let sync_interval = sync_interval.map(|i| std::time::Duration::from_secs_f64(i));
-                let mut builder = libsql_core::Builder::new_remote_replica(
-                    database,
-                    sync_url,
-                    auth_token.to_string(),
-                );
+                let mut builder =
+                    libsql_core::Builder::new_remote_replica(database, sync_url, auth_token);
                 if let Some(encryption_config) = encryption_config {
                     builder = builder.encryption_config(encryption_config);
                 }
                 if let Some(sync_interval) = sync_interval {
                     builder = builder.sync_interval(sync_interval);
                 }
-                let fut = builder.build();
-                tokio::pin!(fut);
-                let result = rt.block_on(check_signals(py, fut));
-                result.map_err(to_py_err)?
+                builder.build().await.map_err(to_py_err)?
             }
             None => {
                 let mut builder = libsql_core::Builder::new_local(database);
                 if let Some(config) = encryption_config {
                     builder = builder.encryption_config(config);
                 }
-                let fut = builder.build();
-                tokio::pin!(fut);
-                let result = rt.block_on(check_signals(py, fut));
-                result.map_err(to_py_err)?
+                builder.build().await.map_err(to_py_err)?
             }
         }
     };
+    Ok(Database::new(db, remote, encrypted && !remote))
+}
 
-    let autocommit = isolation_level.is_none() as i32;
-    let conn = db.connect().map_err(to_py_err)?;
+/// Opens a new connection to `db` wrapped in a `ConnectionGuard`.
+fn connect_guard(
+    db: &Database,
+    timeout: f64,
+    cached_statements: usize,
+    detect_types: i32,
+    behavior: libsql_core::TransactionBehavior,
+    runtime: ConnectionRuntime,
+) -> PyResult<Arc<ConnectionGuard>> {
+    let (conn, handle) = functions::capture_handle(|| db.connect());
+    let conn = conn.map_err(to_py_err)?;
     let timeout = Duration::from_secs_f64(timeout);
-    conn.busy_timeout(timeout).map_err(to_py_err)?;
-    Ok(Connection {
-        db,
-        conn: RefCell::new(Some(Arc::new(ConnectionGuard {
-            conn: Some(conn),
-            handle: rt.clone(),
-        }))),
-        isolation_level,
-        autocommit,
-    })
+    if handle.is_none() {
+        conn.busy_timeout(timeout).map_err(to_py_err)?;
+    }
+    let guard = Arc::new(ConnectionGuard {
+        conn: Some(conn),
+        handle,
+        remote: db.is_remote(),
+        encrypted: db.is_encrypted(),
+        detect_types,
+        behavior,
+        runtime,
+        transaction: Mutex::new(None),
+        savepoints: AtomicUsize::new(0),
+        stmt_cache: Mutex::new(StatementCache::new(cached_statements)),
+        tracer: Tracer::default(),
+        statement_timeout: Mutex::new(None),
+        interrupted: tokio::sync::Notify::new(),
+        timed_out: AtomicBool::new(false),
+        busy: BusyHandler::new(BusyPolicy::new(timeout)),
+        registered_functions: Mutex::new(Vec::new()),
+    });
+    if let Some(handle) = guard.handle.as_ref() {
+        guard.busy.install(handle)?;
+    }
+    Ok(guard)
 }
 
 // We need to add a drop guard that runs when we finally drop our
@@ -187,7 +292,80 @@ fn _connect_core(
 // on ConnectionGuard it will drop the connection with a tokio context entered.
 struct ConnectionGuard {
     conn: Option<libsql_core::Connection>,
-    handle: tokio::runtime::Handle,
+    /// The SQLite connection behind `conn`, unless it is remote.
+    handle: Option<functions::SqliteHandle>,
+    /// Whether this is a connection to a remote database over Hrana.
+    remote: bool,
+    /// Whether the database was opened with an encryption key.
+    encrypted: bool,
+    detect_types: i32,
+    /// How implicit transactions lock the database, from `isolation_level`.
+    behavior: libsql_core::TransactionBehavior,
+    runtime: ConnectionRuntime,
+    /// The transaction this connection began, until it is committed or
+    /// rolled back.
+    transaction: Mutex<Option<libsql_core::Transaction>>,
+    /// How many `transaction()` savepoints are open.
+    savepoints: AtomicUsize,
+    stmt_cache: Mutex<StatementCache>,
+    tracer: Tracer,
+    /// How long a statement may run before it is interrupted.
+    statement_timeout: Mutex<Option<Duration>>,
+    /// Wakes statements waiting on a remote database when the connection
+    /// is interrupted.
+    interrupted: tokio::sync::Notify,
+    /// Whether the last statement was interrupted by its timeout.
+    timed_out: AtomicBool,
+    /// Waits for locks held by other connections. SQLite keeps a pointer
+    /// to it while the connection is open.
+    busy: BusyHandler,
+    /// The names and argument counts of the functions and aggregates
+    /// registered on this connection.
+    registered_functions: Mutex<Vec<(String, i32)>>,
+}
+
+impl ConnectionGuard {
+    fn statement_timeout(&self) -> Option<Duration> {
+        *self.statement_timeout.lock().unwrap()
+    }
+
+    /// Removes the functions and aggregates registered on this connection,
+    /// for connections returned to a pool.
+    fn remove_functions(&self) -> PyResult<()> {
+        let registered = std::mem::take(&mut *self.registered_functions.lock().unwrap());
+        if let Some(handle) = self.handle.as_ref() {
+            for (name, narg) in registered {
+                functions::create_function(handle, &name, narg, None, false)?;
+            }
+        }
+        Ok(())
+    }
+
+    /// Aborts the statements the connection is running. Local statements
+    /// stop at their next step; remote requests are abandoned.
+    fn interrupt(&self) -> PyResult<()> {
+        self.interrupted.notify_waiters();
+        if self.remote {
+            return Ok(());
+        }
+        libsql_core::Connection::interrupt(self).map_err(to_py_err)
+    }
+
+    /// Drops the libSQL transaction of a connection whose transaction was
+    /// ended with plain SQL.
+    fn discard_transaction(&self) {
+        let _enter = self.runtime.handle().enter();
+        if self.is_autocommit() {
+            drop(self.transaction.lock().unwrap().take());
+        }
+    }
+
+    /// Hands a statement that a cursor is done with back to the cache,
+    /// adding what it did to the profile.
+    fn release_statement(&self, mut entry: CachedStatement) {
+        self.tracer.finish(&mut entry);
+        self.stmt_cache.lock().unwrap().put(entry);
+    }
 }
 
 impl std::ops::Deref for ConnectionGuard {
@@ -200,7 +378,13 @@ impl std::ops::Deref for ConnectionGuard {
 
 impl Drop for ConnectionGuard {
     fn drop(&mut self) {
-        let _enter = self.handle.enter();
+        let handle = self.runtime.handle();
+        let _enter = handle.enter();
+        self.stmt_cache.lock().unwrap().clear();
+        drop(self.transaction.lock().unwrap().take());
+        if let Some(handle) = self.handle.as_ref() {
+            BusyHandler::uninstall(handle);
+        }
         if let Some(conn) = self.conn.take() {
             drop(conn);
         }
@@ -209,118 +393,491 @@ impl Drop for ConnectionGuard {
 
 #[pyclass]
 pub struct Connection {
-    db: libsql_core::Database,
+    db: Arc<Database>,
     conn: RefCell<Option<Arc<ConnectionGuard>>>,
+    runtime: ConnectionRuntime,
     isolation_level: Option<String>,
     autocommit: i32,
+    /// The pool this connection was checked out from, if any.
+    pool: Option<Arc<PoolShared>>,
+    /// Weak references to the cursors of a pooled connection, which are
+    /// closed when the connection goes back to the pool.
+    cursors: RefCell<Vec<PyObject>>,
+    #[pyo3(get, set)]
+    row_factory: Option<PyObject>,
+    #[pyo3(get, set)]
+    blob_buffers: bool,
 }
 
 // SAFETY: The libsql crate guarantees that `Connection` is thread-safe.
 unsafe impl Send for Connection {}
 
+impl Connection {
+    fn new_cursor(&self, py: Python<'_>) -> PyResult<Py<Cursor>> {
+        let cursor = Py::new(
+            py,
+            Cursor {
+                arraysize: 1,
+                conn: RefCell::new(Some(self.conn.borrow().as_ref().unwrap().clone())),
+                stmt: RefCell::new(None),
+                rows: RefCell::new(None),
+                prefetched: RefCell::new(VecDeque::new()),
+                rowcount: RefCell::new(0),
+                autocommit: self.autocommit,
+                isolation_level: self.isolation_level.clone(),
+                done: RefCell::new(false),
+                aborted: RefCell::new(false),
+                row_factory: self.row_factory.clone(),
+                blob_buffers: self.blob_buffers,
+            },
+        )?;
+        if self.pool.is_some() {
+            let mut cursors = self.cursors.borrow_mut();
+            // Dead references are dropped whenever the list would grow.
+            if cursors.len() == cursors.capacity() {
+                cursors
+                    .retain(|cursor| matches!(cursor.call0(py), Ok(cursor) if !cursor.is_none(py)));
+            }
+            let weakref = py.import("weakref")?.getattr("ref")?.call1((&cursor,))?;
+            cursors.push(weakref.into());
+        }
+        Ok(cursor)
+    }
+
+    /// Drops this handle's libSQL connection, or hands it back to the pool
+    /// it came from.
+    fn release(&self) {
+        if self.pool.is_some() {
+            // Cursors must not reach the connection once another holder has
+            // it. Those that are in use keep it, and it is not reused.
+            Python::with_gil(|py| {
+                for cursor in self.cursors.take() {
+                    if let Ok(cursor) = cursor.call0(py) {
+                        if let Ok(cursor) = cursor.extract::<PyRef<'_, Cursor>>(py) {
+                            cursor.detach();
+                        }
+                    }
+                }
+            });
+        }
+        if let Some(conn) = self.conn.replace(None) {
+            match self.pool.as_ref() {
+                Some(pool) => pool.release(conn),
+                None => drop(conn),
+            }
+        }
+    }
+}
+
+impl Drop for Connection {
+    fn drop(&mut self) {
+        self.release();
+    }
+}
+
 #[pymethods]
 impl Connection {
     fn close(self_: PyRef<'_, Self>, py: Python<'_>) -> PyResult<()> {
-        self_.conn.replace(None);
+        self_.release();
         Ok(())
     }
 
-    fn cursor(&self) -> PyResult<Cursor> {
-        Ok(Cursor {
-            arraysize: 1,
-            conn: RefCell::new(Some(self.conn.borrow().as_ref().unwrap().clone())),
-            stmt: RefCell::new(None),
-            rows: RefCell::new(None),
-            rowcount: RefCell::new(0),
-            autocommit: self.autocommit,
-            isolation_level: self.isolation_level.clone(),
-            done: RefCell::new(false),
-        })
+    fn cursor(&self, py: Python<'_>) -> PyResult<Py<Cursor>> {
+        self.new_cursor(py)
     }
 
-    fn sync(self_: PyRef<'_, Self>, py: Python<'_>) -> PyResult<()> {
-        let fut = {
-            let _enter = rt().enter();
-            self_.db.sync()
+    /// Syncs the embedded replica and returns what was synced.
+    fn sync<'py>(self_: PyRef<'_, Self>, py: Python<'py>) -> PyResult<&'py PyDict> {
+        let db = &self_.db;
+        block_on(py, &self_.runtime, async move { db.sync().await })??.to_dict(py)
+    }
+
+    /// Starts syncing the embedded replica in the background.
+    fn sync_async(&self) -> SyncHandle {
+        SyncHandle::spawn(self.db.clone())
+    }
+
+    /// Syncs until the embedded replica has applied `replication_index`,
+    /// so that reads see writes up to that index.
+    #[pyo3(signature = (replication_index, timeout=None))]
+    fn sync_until<'py>(
+        self_: PyRef<'_, Self>,
+        py: Python<'py>,
+        replication_index: u64,
+        timeout: Option<f64>,
+    ) -> PyResult<&'py PyDict> {
+        let db = &self_.db;
+        let result = match timeout {
+            Some(timeout) => {
+                let timeout = std::time::Duration::from_secs_f64(timeout);
+                block_on(py, &self_.runtime, async move {
+                    tokio::time::timeout(timeout, db.sync_until(replication_index)).await
+                })?
+                .map_err(|_| {
+                    PyTimeoutError::new_err("Timed out waiting for the replication index")
+                })??
+            }
+            None => block_on(py, &self_.runtime, async move {
+                db.sync_until(replication_index).await
+            })??,
         };
-        tokio::pin!(fut);
+        result.to_dict(py)
+    }
 
-        rt().block_on(check_signals(py, fut)).map_err(to_py_err)?;
-        Ok(())
+    /// Returns the replication index the embedded replica has applied.
+    fn replication_index(self_: PyRef<'_, Self>, py: Python<'_>) -> PyResult<Option<u64>> {
+        let db = &self_.db;
+        block_on(
+            py,
+            &self_.runtime,
+            async move { db.replication_index().await },
+        )?
     }
 
-    fn commit(self_: PyRef<'_, Self>) -> PyResult<()> {
-        // TODO: Switch to libSQL transaction API
-        if !self_.conn.borrow().as_ref().unwrap().is_autocommit() {
-            rt().block_on(async {
-                self_
-                    .conn
-                    .borrow()
-                    .as_ref()
-                    .unwrap()
-                    .execute("COMMIT", ())
-                    .await
-            })
-            .map_err(to_py_err)?;
+    fn sync_stats<'py>(&self, py: Python<'py>) -> PyResult<&'py PyDict> {
+        self.db.stats(py)
+    }
+
+    fn commit(self_: PyRef<'_, Self>, py: Python<'_>) -> PyResult<()> {
+        let conn = self_.conn.borrow().as_ref().unwrap().clone();
+        if conn.is_autocommit() {
+            conn.discard_transaction();
+            return Ok(());
         }
-        Ok(())
+        conn.tracer.trace(py, "COMMIT");
+        block_on(py, &self_.runtime, async move {
+            transaction::finish(&conn, true).await
+        })?
     }
 
-    fn rollback(self_: PyRef<'_, Self>) -> PyResult<()> {
-        // TODO: Switch to libSQL transaction API
-        if !self_.conn.borrow().as_ref().unwrap().is_autocommit() {
-            rt().block_on(async {
-                self_
-                    .conn
-                    .borrow()
-                    .as_ref()
-                    .unwrap()
-                    .execute("ROLLBACK", ())
-                    .await
-            })
-            .map_err(to_py_err)?;
+    fn rollback(self_: PyRef<'_, Self>, py: Python<'_>) -> PyResult<()> {
+        let conn = self_.conn.borrow().as_ref().unwrap().clone();
+        if conn.is_autocommit() {
+            conn.discard_transaction();
+            return Ok(());
         }
-        Ok(())
+        conn.tracer.trace(py, "ROLLBACK");
+        block_on(py, &self_.runtime, async move {
+            transaction::finish(&conn, false).await
+        })?
+    }
+
+    /// Returns a context manager that runs its block in a transaction, or
+    /// in a savepoint if the connection is already in one.
+    ///
+    /// `mode` is `"DEFERRED"`, `"IMMEDIATE"` or `"EXCLUSIVE"` and defaults
+    /// to the connection's `isolation_level`.
+    #[pyo3(signature = (mode=None))]
+    fn transaction(self_: PyRef<'_, Self>, mode: Option<&str>) -> PyResult<Transaction> {
+        let conn = match self_.conn.borrow().as_ref() {
+            Some(conn) => conn.clone(),
+            None => return Err(PyValueError::new_err("Connection already closed")),
+        };
+        let behavior = match mode {
+            Some(mode) => transaction::parse_behavior(Some(mode), "mode")?,
+            None => conn.behavior,
+        };
+        Ok(Transaction::new(conn, behavior))
     }
 
     fn execute(
         self_: PyRef<'_, Self>,
         sql: String,
-        parameters: Option<&PyTuple>,
-    ) -> PyResult<Cursor> {
-        let cursor = Connection::cursor(&self_)?;
-        rt().block_on(async { execute(&cursor, sql, parameters).await })?;
+        parameters: Option<&PyAny>,
+    ) -> PyResult<Py<Cursor>> {
+        let py = self_.py();
+        let cursor = self_.new_cursor(py)?;
+        execute(py, &cursor.borrow(py), sql, parameters)?;
         Ok(cursor)
     }
 
     fn executemany(
         self_: PyRef<'_, Self>,
         sql: String,
-        parameters: Option<&PyList>,
-    ) -> PyResult<Cursor> {
-        let cursor = Connection::cursor(&self_)?;
-        for parameters in parameters.unwrap().iter() {
-            let parameters = parameters.extract::<&PyTuple>()?;
-            rt().block_on(async { execute(&cursor, sql.clone(), Some(parameters)).await })?;
-        }
+        parameters: &PyAny,
+    ) -> PyResult<Py<Cursor>> {
+        let py = self_.py();
+        let cursor = self_.new_cursor(py)?;
+        executemany(py, &cursor.borrow(py), sql, parameters)?;
+        Ok(cursor)
+    }
+
+    #[pyo3(signature = (sql, vectors, parameters=None))]
+    fn executemany_vectors(
+        self_: PyRef<'_, Self>,
+        sql: String,
+        vectors: &PyAny,
+        parameters: Option<&PyAny>,
+    ) -> PyResult<Py<Cursor>> {
+        let py = self_.py();
+        let cursor = self_.new_cursor(py)?;
+        executemany_vectors(py, &cursor.borrow(py), sql, vectors, parameters)?;
         Ok(cursor)
     }
 
     fn executescript(self_: PyRef<'_, Self>, script: String) -> PyResult<()> {
-        let _ = rt()
-            .block_on(async {
-                self_
-                    .conn
-                    .borrow()
-                    .as_ref()
-                    .unwrap()
-                    .execute_batch(&script)
-                    .await
-            })
-            .map_err(to_py_err);
+        let conn = self_.conn.borrow().as_ref().unwrap().clone();
+        conn.tracer.trace(self_.py(), &script);
+        // Scripts usually change the schema.
+        conn.stmt_cache.lock().unwrap().schema_changed();
+        let guard = conn.clone();
+        run_statement(self_.py(), &guard, async move {
+            conn.execute_batch(&script).await.map(|_| ())
+        })?
+        .map_err(to_py_err)?;
+        Ok(())
+    }
+
+    /// Runs `statements` as one transaction and returns a `ResultSet` per
+    /// statement.
+    #[pyo3(signature = (statements, mode="deferred"))]
+    fn batch<'py>(
+        self_: PyRef<'_, Self>,
+        py: Python<'py>,
+        statements: &PyAny,
+        mode: &str,
+    ) -> PyResult<&'py PyList> {
+        let mode = batch::BatchMode::parse(mode)?;
+        let statements = batch::to_statements(statements)?;
+        let conn = match self_.conn.borrow().as_ref() {
+            Some(conn) => conn.clone(),
+            None => return Err(PyValueError::new_err("Connection already closed")),
+        };
+        for statement in &statements {
+            conn.tracer.trace(py, statement.sql());
+        }
+        let guard = conn.clone();
+        let results = run_statement(py, &guard, async move {
+            batch::execute_batch(&conn, statements, mode).await
+        })??;
+        batch::into_py(py, results)
+    }
+
+    /// Registers `func` as the SQL function `name` taking `narg` arguments,
+    /// or removes the function if `func` is `None`.
+    #[pyo3(signature = (name, narg, func, *, deterministic=false))]
+    fn create_function(
+        self_: PyRef<'_, Self>,
+        name: &str,
+        narg: i32,
+        func: Option<PyObject>,
+        deterministic: bool,
+    ) -> PyResult<()> {
+        let conn = self_.conn.borrow();
+        let handle = local_handle(conn.as_ref(), "create_function()")?;
+        let func = func.filter(|func| !func.is_none(self_.py()));
+        functions::create_function(handle, name, narg, func, deterministic)?;
+        register_function(conn.as_ref().unwrap(), name, narg);
+        Ok(())
+    }
+
+    /// Registers the class `aggregate_class` as the SQL aggregate function
+    /// `name` taking `n_arg` arguments, or removes the function if it is
+    /// `None`.
+    #[pyo3(signature = (name, n_arg, aggregate_class, *, batched=false))]
+    fn create_aggregate(
+        self_: PyRef<'_, Self>,
+        name: &str,
+        n_arg: i32,
+        aggregate_class: Option<PyObject>,
+        batched: bool,
+    ) -> PyResult<()> {
+        let conn = self_.conn.borrow();
+        let handle = local_handle(conn.as_ref(), "create_aggregate()")?;
+        let class = aggregate_class.filter(|class| !class.is_none(self_.py()));
+        functions::create_aggregate(handle, name, n_arg, class, batched)?;
+        register_function(conn.as_ref().unwrap(), name, n_arg);
         Ok(())
     }
 
+    /// Opens the BLOB in `column` of the row with rowid `row` of `table`
+    /// for incremental reading and, unless `readonly`, writing.
+    #[pyo3(signature = (table, column, row, *, readonly=false, name="main"))]
+    fn blobopen(
+        self_: PyRef<'_, Self>,
+        table: &str,
+        column: &str,
+        row: i64,
+        readonly: bool,
+        name: &str,
+    ) -> PyResult<blob::Blob> {
+        let conn = match self_.conn.borrow().as_ref() {
+            Some(conn) => conn.clone(),
+            None => return Err(PyValueError::new_err("Connection already closed")),
+        };
+        blob::open(conn, table, column, row, readonly, name)
+    }
+
+    /// Copies the database `name` of this connection into the main database
+    /// of `target`, replacing its contents.
+    #[pyo3(signature = (target, *, pages=-1, progress=None, name="main"))]
+    fn backup(
+        self_: PyRef<'_, Self>,
+        target: &PyAny,
+        pages: i32,
+        progress: Option<&PyAny>,
+        name: &str,
+    ) -> PyResult<()> {
+        let py = self_.py();
+        if target.is(&self_) {
+            return Err(PyValueError::new_err(
+                "target cannot be the same connection",
+            ));
+        }
+        let target: PyRef<'_, Connection> = target.extract()?;
+        let (source, target) = match (self_.conn.borrow().as_ref(), target.conn.borrow().as_ref()) {
+            (Some(source), Some(target)) => (source.clone(), target.clone()),
+            _ => return Err(PyValueError::new_err("Connection already closed")),
+        };
+        let progress = progress.filter(|progress| !progress.is_none());
+        let file = snapshot::SnapshotFile::new()?;
+        snapshot::save(py, &source, name, &file)?;
+        snapshot::restore(py, &target, &file, pages, progress)
+    }
+
+    /// Returns the database `name` as a buffer holding its file image.
+    #[pyo3(signature = (*, name="main"))]
+    fn serialize(self_: PyRef<'_, Self>, name: &str) -> PyResult<Py<ColumnBuffer>> {
+        let py = self_.py();
+        let conn = match self_.conn.borrow().as_ref() {
+            Some(conn) => conn.clone(),
+            None => return Err(PyValueError::new_err("Connection already closed")),
+        };
+        let file = snapshot::SnapshotFile::new()?;
+        snapshot::save(py, &conn, name, &file)?;
+        file.read(py)
+    }
+
+    /// Replaces the main database with the file image in the buffer `data`.
+    fn deserialize(self_: PyRef<'_, Self>, data: &PyAny) -> PyResult<()> {
+        let py = self_.py();
+        let conn = match self_.conn.borrow().as_ref() {
+            Some(conn) => conn.clone(),
+            None => return Err(PyValueError::new_err("Connection already closed")),
+        };
+        let file = snapshot::SnapshotFile::new()?;
+        file.write(data)?;
+        snapshot::restore(py, &conn, &file, -1, None)
+    }
+
+    /// Returns hit/miss counters and occupancy of the prepared statement cache.
+    fn statement_cache_stats<'py>(self_: PyRef<'py, Self>) -> PyResult<&'py PyDict> {
+        let py = self_.py();
+        let stats = PyDict::new(py);
+        let conn = self_.conn.borrow();
+        if let Some(conn) = conn.as_ref() {
+            let cache = conn.stmt_cache.lock().unwrap();
+            stats.set_item("hits", cache.hits())?;
+            stats.set_item("misses", cache.misses())?;
+            stats.set_item("size", cache.len())?;
+            stats.set_item("capacity", cache.capacity())?;
+        }
+        Ok(stats)
+    }
+
+    /// Aborts the statements the connection is running. Safe to call from
+    /// another thread.
+    fn interrupt(self_: PyRef<'_, Self>) -> PyResult<()> {
+        match self_.conn.borrow().as_ref() {
+            Some(conn) => conn.interrupt(),
+            None => Err(PyValueError::new_err("Connection already closed")),
+        }
+    }
+
+    #[getter]
+    fn statement_timeout(self_: PyRef<'_, Self>) -> Option<f64> {
+        let conn = self_.conn.borrow();
+        conn.as_ref()
+            .and_then(|conn| conn.statement_timeout())
+            .map(|timeout| timeout.as_secs_f64())
+    }
+
+    #[setter]
+    fn set_statement_timeout(self_: PyRef<'_, Self>, timeout: Option<f64>) -> PyResult<()> {
+        let timeout = match timeout {
+            Some(timeout) if !(timeout > 0.0) || !timeout.is_finite() => {
+                return Err(PyValueError::new_err(
+                    "statement_timeout must be a positive number of seconds or None",
+                ))
+            }
+            timeout => timeout.map(Duration::from_secs_f64),
+        };
+        match self_.conn.borrow().as_ref() {
+            Some(conn) => *conn.statement_timeout.lock().unwrap() = timeout,
+            None => return Err(PyValueError::new_err("Connection already closed")),
+        }
+        Ok(())
+    }
+
+    /// Registers `callback` to be called with the SQL text of every
+    /// statement the connection runs, or removes it if `None`.
+    fn set_trace_callback(self_: PyRef<'_, Self>, callback: Option<PyObject>) -> PyResult<()> {
+        let conn = self_.conn.borrow();
+        let conn = match conn.as_ref() {
+            Some(conn) => conn,
+            None => return Err(PyValueError::new_err("Connection already closed")),
+        };
+        conn.tracer
+            .set_callback(callback.filter(|callback| !callback.is_none(self_.py())));
+        Ok(())
+    }
+
+    /// Switches the statement profiler on or off. Switching it off keeps
+    /// the statistics collected so far.
+    fn set_profiler(self_: PyRef<'_, Self>, enabled: bool) -> PyResult<()> {
+        match self_.conn.borrow().as_ref() {
+            Some(conn) => conn.tracer.set_profiling(enabled),
+            None => return Err(PyValueError::new_err("Connection already closed")),
+        }
+        Ok(())
+    }
+
+    /// Returns the statistics of the statement profiler, one dict per
+    /// normalized SQL text, and clears them if `reset` is true.
+    #[pyo3(signature = (reset=false))]
+    fn profiler_stats<'py>(self_: PyRef<'py, Self>, reset: bool) -> PyResult<&'py PyList> {
+        let py = self_.py();
+        match self_.conn.borrow().as_ref() {
+            Some(conn) => conn.tracer.stats(py, conn.remote, reset),
+            None => Ok(PyList::empty(py)),
+        }
+    }
+
+    /// Makes the connection wait for locks held by other connections with
+    /// exponential backoff, sleeping from `initial_delay` up to `max_delay`
+    /// seconds between retries, for at most `timeout` seconds per wait.
+    #[pyo3(signature = (timeout=None, *, initial_delay=0.001, max_delay=0.1, jitter=true))]
+    fn set_busy_handler(
+        self_: PyRef<'_, Self>,
+        timeout: Option<f64>,
+        initial_delay: f64,
+        max_delay: f64,
+        jitter: bool,
+    ) -> PyResult<()> {
+        let conn = self_.conn.borrow();
+        local_handle(conn.as_ref(), "set_busy_handler()")?;
+        let busy = &conn.as_ref().unwrap().busy;
+        let timeout = timeout.unwrap_or_else(|| busy.policy().timeout().as_secs_f64());
+        busy.set_policy(BusyPolicy::with_backoff(
+            timeout,
+            initial_delay,
+            max_delay,
+            jitter,
+        )?);
+        Ok(())
+    }
+
+    /// Returns how often and how long the connection waited for locks held
+    /// by other connections, and clears the counters if `reset` is true.
+    #[pyo3(signature = (reset=false))]
+    fn busy_stats<'py>(self_: PyRef<'py, Self>, reset: bool) -> PyResult<&'py PyDict> {
+        let py = self_.py();
+        match self_.conn.borrow().as_ref() {
+            Some(conn) => conn.busy.stats(py, reset),
+            None => Ok(PyDict::new(py)),
+        }
+    }
+
     #[getter]
     fn isolation_level(self_: PyRef<'_, Self>) -> Option<String> {
         self_.isolation_level.clone()
@@ -356,17 +913,26 @@ impl Connection {
     }
 }
 
-#[pyclass]
+#[pyclass(weakref)]
 pub struct Cursor {
     #[pyo3(get, set)]
     arraysize: usize,
     conn: RefCell<Option<Arc<ConnectionGuard>>>,
-    stmt: RefCell<Option<libsql_core::Statement>>,
+    stmt: RefCell<Option<CachedStatement>>,
     rows: RefCell<Option<libsql_core::Rows>>,
+    /// Rows read ahead by `__next__` that have not been handed out yet.
+    prefetched: RefCell<VecDeque<Vec<libsql_core::Value>>>,
     rowcount: RefCell<i64>,
     done: RefCell<bool>,
+    /// Set when a fetch was interrupted, timed out or stopped by a signal,
+    /// which loses the rest of the result set.
+    aborted: RefCell<bool>,
     isolation_level: Option<String>,
     autocommit: i32,
+    #[pyo3(get, set)]
+    row_factory: Option<PyObject>,
+    #[pyo3(get, set)]
+    blob_buffers: bool,
 }
 
 // SAFETY: The libsql crate guarantees that `Connection` is thread-safe.
@@ -374,43 +940,75 @@ unsafe impl Send for Cursor {}
 
 impl Drop for Cursor {
     fn drop(&mut self) {
-        let _enter = rt().enter();
+        self.detach();
+    }
+}
+
+impl Cursor {
+    /// Releases the result set and lets go of the connection.
+    fn detach(&self) {
+        let handle = self.runtime().handle();
+        let _enter = handle.enter();
+        self.release_statement();
         self.conn.replace(None);
-        self.stmt.replace(None);
+    }
+
+    /// The runtime of the connection this cursor belongs to.
+    fn runtime(&self) -> ConnectionRuntime {
+        match self.conn.borrow().as_ref() {
+            Some(conn) => conn.runtime.clone(),
+            None => ConnectionRuntime::Shared,
+        }
+    }
+
+    /// Drops the current result set and returns the statement that produced
+    /// it to the connection's statement cache.
+    fn release_statement(&self) {
         self.rows.replace(None);
+        self.prefetched.borrow_mut().clear();
+        self.done.replace(false);
+        self.aborted.replace(false);
+        if let Some(entry) = self.stmt.replace(None) {
+            if let Some(conn) = self.conn.borrow().as_ref() {
+                conn.release_statement(entry);
+            }
+        }
     }
 }
 
 #[pymethods]
 impl Cursor {
     fn close(self_: PyRef<'_, Self>) -> PyResult<()> {
-        rt().block_on(async {
-            let cursor: &Cursor = &self_;
-            cursor.conn.replace(None);
-            cursor.stmt.replace(None);
-            cursor.rows.replace(None);
-        });
+        self_.detach();
         Ok(())
     }
 
     fn execute<'a>(
         self_: PyRef<'a, Self>,
         sql: String,
-        parameters: Option<&PyTuple>,
+        parameters: Option<&PyAny>,
     ) -> PyResult<pyo3::PyRef<'a, Self>> {
-        rt().block_on(async { execute(&self_, sql, parameters).await })?;
+        execute(self_.py(), &self_, sql, parameters)?;
         Ok(self_)
     }
 
     fn executemany<'a>(
         self_: PyRef<'a, Self>,
         sql: String,
-        parameters: Option<&PyList>,
+        parameters: &PyAny,
     ) -> PyResult<pyo3::PyRef<'a, Cursor>> {
-        for parameters in parameters.unwrap().iter() {
-            let parameters = parameters.extract::<&PyTuple>()?;
-            rt().block_on(async { execute(&self_, sql.clone(), Some(parameters)).await })?;
-        }
+        executemany(self_.py(), &self_, sql, parameters)?;
+        Ok(self_)
+    }
+
+    #[pyo3(signature = (sql, vectors, parameters=None))]
+    fn executemany_vectors<'a>(
+        self_: PyRef<'a, Self>,
+        sql: String,
+        vectors: &PyAny,
+        parameters: Option<&PyAny>,
+    ) -> PyResult<pyo3::PyRef<'a, Cursor>> {
+        executemany_vectors(self_.py(), &self_, sql, vectors, parameters)?;
         Ok(self_)
     }
 
@@ -418,114 +1016,100 @@ impl Cursor {
         self_: PyRef<'a, Self>,
         script: String,
     ) -> PyResult<pyo3::PyRef<'a, Self>> {
-        rt().block_on(async {
-            self_
-                .conn
-                .borrow()
-                .as_ref()
-                .unwrap()
-                .execute_batch(&script)
-                .await
-        })
+        let conn = self_.conn.borrow().as_ref().unwrap().clone();
+        conn.tracer.trace(self_.py(), &script);
+        // Scripts usually change the schema.
+        conn.stmt_cache.lock().unwrap().schema_changed();
+        let guard = conn.clone();
+        run_statement(self_.py(), &guard, async move {
+            conn.execute_batch(&script).await.map(|_| ())
+        })?
         .map_err(to_py_err)?;
         Ok(self_)
     }
 
     #[getter]
     fn description(self_: PyRef<'_, Self>) -> PyResult<Option<&PyTuple>> {
+        let py = self_.py();
         let stmt = self_.stmt.borrow();
-        let mut elements: Vec<Py<PyAny>> = vec![];
-        match stmt.as_ref() {
-            Some(stmt) => {
-                for column in stmt.columns() {
-                    let name = column.name();
-                    let element = (
-                        name,
-                        self_.py().None(),
-                        self_.py().None(),
-                        self_.py().None(),
-                        self_.py().None(),
-                        self_.py().None(),
-                        self_.py().None(),
-                    )
-                        .to_object(self_.py());
-                    elements.push(element);
-                }
-                let elements = PyTuple::new(self_.py(), elements);
-                Ok(Some(elements))
-            }
+        Ok(stmt
+            .as_ref()
+            .map(|entry| entry.description(py).into_ref(py)))
+    }
+
+    fn __iter__(self_: PyRef<'_, Self>) -> PyRef<'_, Self> {
+        self_
+    }
+
+    /// Returns the next row, reading `arraysize` rows ahead at a time.
+    fn __next__(self_: PyRef<'_, Self>) -> PyResult<Option<PyObject>> {
+        let py = self_.py();
+        if self_.prefetched.borrow().is_empty() {
+            let size = self_.arraysize.max(1);
+            match fetch_rows(py, &self_, Some(size), |_| Vec::new())? {
+                Some(rows) => self_.prefetched.replace(VecDeque::from(rows)),
+                None => return Ok(None),
+            };
+        }
+        let row = self_.prefetched.borrow_mut().pop_front();
+        match row {
+            Some(row) => Ok(Some(RowFactory::new(self_).make_row(py, row)?)),
             None => Ok(None),
         }
     }
 
-    fn fetchone(self_: PyRef<'_, Self>) -> PyResult<Option<&PyTuple>> {
-        let mut rows = self_.rows.borrow_mut();
-        match rows.as_mut() {
-            Some(rows) => {
-                let row = rt().block_on(rows.next()).map_err(to_py_err)?;
-                match row {
-                    Some(row) => {
-                        let row = convert_row(self_.py(), row, rows.column_count())?;
-                        Ok(Some(row))
-                    }
-                    None => Ok(None),
-                }
-            }
+    fn fetchone(self_: PyRef<'_, Self>) -> PyResult<Option<PyObject>> {
+        let py = self_.py();
+        match fetch_rows(py, &self_, Some(1), |_| Vec::new())?.and_then(|mut rows| rows.pop()) {
+            Some(row) => Ok(Some(RowFactory::new(self_).make_row(py, row)?)),
             None => Ok(None),
         }
     }
 
     fn fetchmany(self_: PyRef<'_, Self>, size: Option<i64>) -> PyResult<Option<&PyList>> {
-        let mut rows = self_.rows.borrow_mut();
-        match rows.as_mut() {
-            Some(rows) => {
-                let size = size.unwrap_or(self_.arraysize as i64);
-                let mut elements: Vec<Py<PyAny>> = vec![];
-                // The libSQL Rows.next() method restarts the iteration if it
-                // has reached the end, which is why we need to check if we're
-                // done before iterating.
-                if !*self_.done.borrow() {
-                    for _ in 0..size {
-                        let row = rt()
-                            .block_on(async { rows.next().await })
-                            .map_err(to_py_err)?;
-                        match row {
-                            Some(row) => {
-                                let row = convert_row(self_.py(), row, rows.column_count())?;
-                                elements.push(row.into());
-                            }
-                            None => {
-                                self_.done.replace(true);
-                                break;
-                            }
-                        }
-                    }
-                }
-                Ok(Some(PyList::new(self_.py(), elements)))
-            }
+        let py = self_.py();
+        let size = size.unwrap_or(self_.arraysize as i64).max(0) as usize;
+        match fetch_rows(py, &self_, Some(size), |_| Vec::new())? {
+            Some(rows) => Ok(Some(RowFactory::new(self_).make_rows(py, rows)?)),
             None => Ok(None),
         }
     }
 
     fn fetchall(self_: PyRef<'_, Self>) -> PyResult<Option<&PyList>> {
-        let mut rows = self_.rows.borrow_mut();
-        match rows.as_mut() {
-            Some(rows) => {
-                let mut elements: Vec<Py<PyAny>> = vec![];
-                loop {
-                    let row = rt()
-                        .block_on(async { rows.next().await })
-                        .map_err(to_py_err)?;
-                    match row {
-                        Some(row) => {
-                            let row = convert_row(self_.py(), row, rows.column_count())?;
-                            elements.push(row.into());
-                        }
-                        None => break,
-                    }
-                }
-                Ok(Some(PyList::new(self_.py(), elements)))
-            }
+        let py = self_.py();
+        match fetch_rows(py, &self_, None, |_| Vec::new())? {
+            Some(rows) => Ok(Some(RowFactory::new(self_).make_rows(py, rows)?)),
+            None => Ok(None),
+        }
+    }
+
+    /// Fetches up to `size` rows (all remaining rows by default) as a list of
+    /// `ColumnArray`s, one per result column.
+    #[pyo3(signature = (size=None))]
+    fn fetch_columns(self_: PyRef<'_, Self>, size: Option<usize>) -> PyResult<Option<&PyList>> {
+        let py = self_.py();
+        match fetch_rows(py, &self_, size, ColumnsBuilder::new)? {
+            Some(columns) => Ok(Some(columns.into_py(py)?)),
+            None => Ok(None),
+        }
+    }
+
+    /// Fetches the float32 vectors in `column` (an index or name, the first
+    /// column by default) of up to `size` rows, all remaining rows by
+    /// default, as one buffer of shape `(rows, dimensions)`.
+    #[pyo3(signature = (column=None, size=None))]
+    fn fetch_vectors(
+        self_: PyRef<'_, Self>,
+        column: Option<&PyAny>,
+        size: Option<usize>,
+    ) -> PyResult<Option<Py<ColumnBuffer>>> {
+        let py = self_.py();
+        let column = match self_.stmt.borrow().as_ref() {
+            Some(entry) => vector::column_index(entry.columns(), column)?,
+            None => return Ok(None),
+        };
+        match fetch_rows(py, &self_, size, |_| VectorsBuilder::new(column))? {
+            Some(vectors) => Ok(Some(vectors.into_py(py)?)),
             None => Ok(None),
         }
     }
@@ -547,65 +1131,320 @@ impl Cursor {
     }
 }
 
-async fn begin_transaction(conn: &libsql_core::Connection) -> PyResult<()> {
-    conn.execute("BEGIN", ()).await.map_err(to_py_err)?;
+async fn begin_transaction(conn: &ConnectionGuard) -> PyResult<()> {
+    transaction::begin(conn, conn.behavior).await
+}
+
+fn execute(
+    py: Python<'_>,
+    cursor: &Cursor,
+    sql: String,
+    parameters: Option<&PyAny>,
+) -> PyResult<()> {
+    let conn = match cursor.conn.borrow().as_ref() {
+        Some(conn) => conn.clone(),
+        None => return Err(PyValueError::new_err("Connection already closed")),
+    };
+    cursor.release_statement();
+    let autocommit = determine_autocommit(cursor);
+    let params = to_params(parameters)?;
+    conn.tracer.trace(py, &sql);
+    let guard = conn.clone();
+    let (entry, rows, changes) = run_statement(py, &guard, async move {
+        execute_statement(&conn, sql, params, autocommit).await
+    })??;
+
+    cursor.rows.replace(rows);
+    *cursor.rowcount.borrow_mut() += changes;
+    cursor.stmt.replace(Some(entry));
     Ok(())
 }
 
-async fn execute(cursor: &Cursor, sql: String, parameters: Option<&PyTuple>) -> PyResult<()> {
-    if cursor.conn.borrow().as_ref().is_none() {
-        return Err(PyValueError::new_err("Connection already closed"));
-    }
-    let stmt_is_dml = stmt_is_dml(&sql);
+/// Runs `sql` once for every parameter sequence yielded by `parameters`.
+///
+/// The statement is prepared once and rebound for each row. Rows are pulled
+/// from the iterable in chunks of `EXECUTEMANY_CHUNK_SIZE`, and each chunk
+/// is executed with a single trip into the runtime.
+fn executemany(py: Python<'_>, cursor: &Cursor, sql: String, parameters: &PyAny) -> PyResult<()> {
+    let parameters = parameters.iter()?.map(|row| to_params(Some(row?)));
+    execute_many(py, cursor, sql, parameters)
+}
+
+/// Runs `sql` once for every row of `vectors`, binding the row as a
+/// float32 vector after the values of the matching item of `parameters`.
+fn executemany_vectors(
+    py: Python<'_>,
+    cursor: &Cursor,
+    sql: String,
+    vectors: &PyAny,
+    parameters: Option<&PyAny>,
+) -> PyResult<()> {
+    let parameters = vector::vector_params(vectors, parameters)?;
+    execute_many(py, cursor, sql, parameters)
+}
+
+/// Does the work of `executemany()` for parameter sets that have already
+/// been converted, or are converted lazily by the iterator.
+fn execute_many(
+    py: Python<'_>,
+    cursor: &Cursor,
+    sql: String,
+    mut parameters: impl Iterator<Item = PyResult<libsql_core::params::Params>>,
+) -> PyResult<()> {
+    let conn = match cursor.conn.borrow().as_ref() {
+        Some(conn) => conn.clone(),
+        None => return Err(PyValueError::new_err("Connection already closed")),
+    };
+    cursor.release_statement();
     let autocommit = determine_autocommit(cursor);
-    if !autocommit && stmt_is_dml && cursor.conn.borrow().as_ref().unwrap().is_autocommit() {
-        begin_transaction(&cursor.conn.borrow().as_ref().unwrap()).await?;
-    }
-    let params = match parameters {
-        Some(parameters) => {
-            let mut params = vec![];
-            for param in parameters.iter() {
-                let param = if param.is_none() {
-                    libsql_core::Value::Null
-                } else if let Ok(value) = param.extract::<i32>() {
-                    libsql_core::Value::Integer(value as i64)
-                } else if let Ok(value) = param.extract::<f64>() {
-                    libsql_core::Value::Real(value)
-                } else if let Ok(value) = param.extract::<&str>() {
-                    libsql_core::Value::Text(value.to_string())
-                } else if let Ok(value) = param.extract::<&[u8]>() {
-                    libsql_core::Value::Blob(value.to_vec())
-                } else {
-                    return Err(PyValueError::new_err("Unsupported parameter type"));
-                };
-                params.push(param);
-            }
-            libsql_core::params::Params::Positional(params)
+    let guard = conn.clone();
+    let mut entry = None;
+    let mut rowcount = 0;
+    loop {
+        let mut chunk = Vec::with_capacity(EXECUTEMANY_CHUNK_SIZE);
+        for params in parameters.by_ref().take(EXECUTEMANY_CHUNK_SIZE) {
+            chunk.push(params?);
+            conn.tracer.trace(py, &sql);
+        }
+        if chunk.is_empty() {
+            break;
+        }
+        let last = chunk.len() < EXECUTEMANY_CHUNK_SIZE;
+        let conn = conn.clone();
+        let sql = sql.clone();
+        let cached = entry.take();
+        let (stmt, changes) = run_statement(py, &guard, async move {
+            execute_bulk(&conn, sql, cached, chunk, autocommit).await
+        })??;
+        rowcount += changes;
+        entry = Some(stmt);
+        if last {
+            break;
+        }
+    }
+    *cursor.rowcount.borrow_mut() += rowcount;
+    cursor.stmt.replace(entry);
+    Ok(())
+}
+
+/// Checks the statement for `sql` out of the connection's statement cache,
+/// preparing it if it is not cached.
+///
+/// Statements that change the schema invalidate the cached statements.
+async fn checkout_statement(conn: &ConnectionGuard, sql: String) -> PyResult<CachedStatement> {
+    let cached = {
+        let mut cache = conn.stmt_cache.lock().unwrap();
+        if sql::is_ddl(&sql) {
+            cache.schema_changed();
         }
-        None => libsql_core::params::Params::None,
+        cache.take(&sql)
     };
-    let mut stmt = cursor
-        .conn
-        .borrow()
-        .as_ref()
-        .unwrap()
-        .prepare(&sql)
-        .await
-        .map_err(to_py_err)?;
+    match cached {
+        Some(entry) => Ok(entry),
+        None => {
+            let started = Instant::now();
+            let stmt = conn.prepare(&sql).await.map_err(to_py_err)?;
+            let mut entry = CachedStatement::new(sql, stmt, conn.detect_types);
+            entry.execution.prepare += started.elapsed();
+            conn.stmt_cache.lock().unwrap().prepared(&mut entry);
+            Ok(entry)
+        }
+    }
+}
 
-    if stmt.columns().iter().len() > 0 {
-        let rows = stmt.query(params).await.map_err(to_py_err)?;
-        cursor.rows.replace(Some(rows));
+/// Runs `sql` on `conn`, opening an implicit transaction first if needed.
+///
+/// Returns the checked-out statement, its result set if it produces rows and
+/// the number of rows changed.
+async fn execute_statement(
+    conn: &ConnectionGuard,
+    sql: String,
+    params: libsql_core::params::Params,
+    autocommit: bool,
+) -> PyResult<(CachedStatement, Option<libsql_core::Rows>, i64)> {
+    let mut entry = checkout_statement(conn, sql).await?;
+    if !autocommit && entry.is_dml && conn.is_autocommit() {
+        begin_transaction(conn).await?;
+    }
+    let params = entry.bind(params)?;
+    let started = Instant::now();
+    let rows = if entry.stmt.columns().iter().len() > 0 {
+        Some(entry.stmt.query(params).await.map_err(to_py_err)?)
     } else {
-        stmt.execute(params).await.map_err(to_py_err)?;
-        cursor.rows.replace(None);
+        entry.stmt.execute(params).await.map_err(to_py_err)?;
+        None
+    };
+    entry.execution.execute += started.elapsed();
+    entry.execution.runs += 1;
+    entry.check_columns();
+    Ok((entry, rows, conn.changes() as i64))
+}
+
+/// Runs `sql` once per parameter set in `batch`, reusing `entry` if the
+/// caller already holds the prepared statement.
+///
+/// In autocommit mode the batch is wrapped in a transaction of its own so
+/// that rows are not synced to disk one by one. Rows that succeeded before a
+/// failing one are still committed, as they would have been had they been
+/// executed separately.
+async fn execute_bulk(
+    conn: &ConnectionGuard,
+    sql: String,
+    entry: Option<CachedStatement>,
+    batch: Vec<libsql_core::params::Params>,
+    autocommit: bool,
+) -> PyResult<(CachedStatement, i64)> {
+    let mut entry = match entry {
+        Some(entry) => entry,
+        None => checkout_statement(conn, sql).await?,
+    };
+    let implicit_transaction = entry.is_dml && conn.is_autocommit();
+    if implicit_transaction {
+        begin_transaction(conn).await?;
     }
+    let mut changes = 0;
+    let mut result = Ok(());
+    for params in batch {
+        let params = match entry.bind(params) {
+            Ok(params) => params,
+            Err(err) => {
+                result = Err(err);
+                break;
+            }
+        };
+        entry.stmt.reset();
+        let started = Instant::now();
+        let executed = entry.stmt.execute(params).await;
+        entry.execution.execute += started.elapsed();
+        entry.execution.runs += 1;
+        match executed {
+            Ok(n) => changes += n as i64,
+            Err(err) => {
+                result = Err(to_py_err(err));
+                break;
+            }
+        }
+    }
+    if implicit_transaction && autocommit {
+        transaction::finish(conn, true).await?;
+    }
+    result?;
+    Ok((entry, changes))
+}
 
-    let mut rowcount = cursor.rowcount.borrow_mut();
-    *rowcount += cursor.conn.borrow().as_ref().unwrap().changes() as i64;
+/// Pulls up to `limit` rows (or all remaining rows) from the cursor's result
+/// set into the sink built by `new_sink`, with the GIL released. Returns
+/// `None` if the cursor has no result set.
+fn fetch_rows<S: RowSink>(
+    py: Python<'_>,
+    cursor: &Cursor,
+    limit: Option<usize>,
+    new_sink: impl FnOnce(&libsql_core::Rows) -> S,
+) -> PyResult<Option<S>> {
+    if *cursor.aborted.borrow() {
+        return Err(PyValueError::new_err(
+            "Cannot fetch from a cursor whose previous fetch was aborted",
+        ));
+    }
+    let mut sink = match cursor.rows.borrow().as_ref() {
+        Some(rows) => new_sink(rows),
+        None => return Ok(None),
+    };
+    let mut limit = limit.unwrap_or(usize::MAX);
+    // Rows that iteration has already read ahead come first.
+    {
+        let mut prefetched = cursor.prefetched.borrow_mut();
+        let count = limit.min(prefetched.len());
+        for row in prefetched.drain(..count) {
+            sink.push_values(row)?;
+        }
+        limit -= count;
+    }
+    // The libSQL Rows.next() method restarts the iteration if it
+    // has reached the end, which is why we need to check if we're
+    // done before iterating.
+    if limit == 0 || *cursor.done.borrow() {
+        return Ok(Some(sink));
+    }
+    let conn = match cursor.conn.borrow().as_ref() {
+        Some(conn) => conn.clone(),
+        None => return Err(PyValueError::new_err("Connection already closed")),
+    };
+    let mut rows = cursor.rows.borrow_mut().take().unwrap();
+    let started = Instant::now();
+    let outcome = run_statement(py, &conn, async move {
+        let result = read_rows(&mut rows, limit, &mut sink).await;
+        (rows, result.map(|fetched| (sink, fetched)))
+    });
+    // An aborted fetch drops the result set along with the future reading
+    // it, so later fetches must not mistake the cursor for exhausted.
+    let (rows, result) = outcome.map_err(|err| {
+        cursor.aborted.replace(true);
+        err
+    })?;
+    let elapsed = started.elapsed();
+    cursor.rows.replace(Some(rows));
+    let (sink, fetched) = result?;
+    if let Some(entry) = cursor.stmt.borrow_mut().as_mut() {
+        entry.execution.add_fetch(elapsed, &fetched);
+    }
+    if fetched.done {
+        cursor.done.replace(true);
+    }
+    Ok(Some(sink))
+}
 
-    cursor.stmt.replace(Some(stmt));
-    Ok(())
+/// Destination for rows read off a result set.
+///
+/// libSQL rows read their values lazily from the statement, so a sink has
+/// to copy out whatever it needs before the next row is fetched.
+pub(crate) trait RowSink: Send {
+    /// Adds a row, returning the number of bytes its values hold.
+    fn push_row(&mut self, row: &libsql_core::Row, column_count: i32) -> PyResult<usize>;
+
+    /// Adds a row whose values have already been read.
+    fn push_values(&mut self, row: Vec<libsql_core::Value>) -> PyResult<()>;
+}
+
+impl RowSink for Vec<Vec<libsql_core::Value>> {
+    fn push_row(&mut self, row: &libsql_core::Row, column_count: i32) -> PyResult<usize> {
+        let row = (0..column_count)
+            .map(|col_idx| row.get_value(col_idx))
+            .collect::<libsql_core::Result<Vec<_>>>()
+            .map_err(to_py_err)?;
+        let size = row.iter().map(trace::value_size).sum();
+        self.push(row);
+        Ok(size)
+    }
+
+    fn push_values(&mut self, row: Vec<libsql_core::Value>) -> PyResult<()> {
+        self.push(row);
+        Ok(())
+    }
+}
+
+/// Reads up to `limit` rows into `sink`. The result is marked `done` once
+/// the result set is exhausted.
+async fn read_rows<S: RowSink>(
+    rows: &mut libsql_core::Rows,
+    limit: usize,
+    sink: &mut S,
+) -> PyResult<Fetched> {
+    let column_count = rows.column_count();
+    let mut fetched = Fetched::default();
+    while fetched.rows < limit as u64 {
+        match rows.next().await.map_err(to_py_err)? {
+            Some(row) => {
+                fetched.bytes += sink.push_row(&row, column_count)? as u64;
+                fetched.rows += 1;
+            }
+            None => {
+                fetched.done = true;
+                break;
+            }
+        }
+    }
+    Ok(fetched)
 }
 
 fn determine_autocommit(cursor: &Cursor) -> bool {
@@ -623,61 +1462,272 @@ fn determine_autocommit(cursor: &Cursor) -> bool {
     }
 }
 
-fn stmt_is_dml(sql: &str) -> bool {
-    let sql = sql.trim();
-    let sql = sql.to_uppercase();
-    sql.starts_with("INSERT") || sql.starts_with("UPDATE") || sql.starts_with("DELETE")
+fn convert_value(py: Python<'_>, value: libsql_core::Value) -> Py<PyAny> {
+    match value {
+        libsql_core::Value::Integer(v) => v.into_py(py),
+        libsql_core::Value::Real(v) => v.into_py(py),
+        libsql_core::Value::Text(v) => v.into_py(py),
+        libsql_core::Value::Blob(v) => v.as_slice().into_py(py),
+        libsql_core::Value::Null => py.None(),
+    }
 }
 
-fn convert_row(py: Python, row: libsql_core::Row, column_count: i32) -> PyResult<&PyTuple> {
-    let mut elements: Vec<Py<PyAny>> = vec![];
-    for col_idx in 0..column_count {
-        let libsql_value = row.get_value(col_idx).map_err(to_py_err)?;
-        let value = match libsql_value {
-            libsql_core::Value::Integer(v) => {
-                let value = v as i64;
-                value.into_py(py)
-            }
-            libsql_core::Value::Real(v) => v.into_py(py),
-            libsql_core::Value::Text(v) => v.into_py(py),
-            libsql_core::Value::Blob(v) => {
-                let value = v.as_slice();
-                value.into_py(py)
-            }
-            libsql_core::Value::Null => py.None(),
-        };
-        elements.push(value);
+/// Converts a fetched value like `convert_value()`, except that blobs
+/// become buffers that take over the fetched bytes if `blob_buffers` is set.
+fn convert_fetched(
+    py: Python<'_>,
+    value: libsql_core::Value,
+    blob_buffers: bool,
+) -> PyResult<Py<PyAny>> {
+    match value {
+        libsql_core::Value::Blob(v) if blob_buffers => {
+            let len = v.len();
+            let buffer = ColumnBuffer::with_shape(Storage::Bytes(v), vec![len]);
+            Ok(Py::new(py, buffer)?.into_py(py))
+        }
+        value => Ok(convert_value(py, value)),
+    }
+}
+
+/// Converts a fetched row, applying `converters` if the statement has any.
+fn convert_row<'py>(
+    py: Python<'py>,
+    row: Vec<libsql_core::Value>,
+    converters: Option<&Converters>,
+) -> PyResult<&'py PyTuple> {
+    convert_fetched_row(py, row, converters, false)
+}
+
+fn convert_fetched_row<'py>(
+    py: Python<'py>,
+    row: Vec<libsql_core::Value>,
+    converters: Option<&Converters>,
+    blob_buffers: bool,
+) -> PyResult<&'py PyTuple> {
+    if let Some(converters) = converters {
+        return converters.convert_row(py, row, blob_buffers);
+    }
+    if !blob_buffers {
+        let elements = row.into_iter().map(|value| convert_value(py, value));
+        return Ok(PyTuple::new(py, elements));
+    }
+    let mut elements: Vec<Py<PyAny>> = Vec::with_capacity(row.len());
+    for value in row {
+        elements.push(convert_fetched(py, value, true)?);
     }
     Ok(PyTuple::new(py, elements))
 }
 
+fn convert_rows<'py>(
+    py: Python<'py>,
+    rows: Vec<Vec<libsql_core::Value>>,
+    converters: Option<&Converters>,
+) -> PyResult<&'py PyList> {
+    let mut elements: Vec<Py<PyAny>> = Vec::with_capacity(rows.len());
+    for row in rows {
+        elements.push(convert_row(py, row, converters)?.into());
+    }
+    Ok(PyList::new(py, elements))
+}
+
+/// The shape of the rows a cursor's `row_factory` asks for.
+enum RowShape {
+    Tuple,
+    Row(Arc<RowIndex>),
+    Callable { factory: PyObject, cursor: PyObject },
+}
+
+impl RowShape {
+    fn new(cursor: PyRef<'_, Cursor>) -> Self {
+        let py = cursor.py();
+        let factory = match cursor.row_factory.as_ref() {
+            Some(factory) if !factory.is_none(py) => factory.clone_ref(py),
+            _ => return RowShape::Tuple,
+        };
+        if factory.as_ref(py).is(py.get_type::<Row>()) {
+            return match cursor.stmt.borrow().as_ref() {
+                Some(entry) => RowShape::Row(entry.row_index()),
+                None => RowShape::Tuple,
+            };
+        }
+        RowShape::Callable {
+            factory,
+            cursor: cursor.into_py(py),
+        }
+    }
+}
+
+/// How fetched rows are turned into Python objects, as chosen by a cursor's
+/// `row_factory`, its `blob_buffers` and the converters of its statement.
+struct RowFactory {
+    shape: RowShape,
+    converters: Option<Arc<Converters>>,
+    blob_buffers: bool,
+}
+
+impl RowFactory {
+    fn new(cursor: PyRef<'_, Cursor>) -> Self {
+        let py = cursor.py();
+        let converters = cursor
+            .stmt
+            .borrow()
+            .as_ref()
+            .and_then(|entry| entry.converters(py));
+        let blob_buffers = cursor.blob_buffers;
+        let shape = RowShape::new(cursor);
+        RowFactory {
+            shape,
+            converters,
+            blob_buffers,
+        }
+    }
+
+    fn make_row(&self, py: Python<'_>, row: Vec<libsql_core::Value>) -> PyResult<PyObject> {
+        let values = convert_fetched_row(py, row, self.converters.as_deref(), self.blob_buffers)?;
+        match &self.shape {
+            RowShape::Tuple => Ok(values.into()),
+            RowShape::Row(index) => {
+                Ok(Py::new(py, Row::with_index(index.clone(), values.into()))?.into_py(py))
+            }
+            RowShape::Callable { factory, cursor } => factory.call1(py, (cursor, values)),
+        }
+    }
+
+    fn make_rows<'py>(
+        &self,
+        py: Python<'py>,
+        rows: Vec<Vec<libsql_core::Value>>,
+    ) -> PyResult<&'py PyList> {
+        let mut elements: Vec<PyObject> = Vec::with_capacity(rows.len());
+        for row in rows {
+            elements.push(self.make_row(py, row)?);
+        }
+        Ok(PyList::new(py, elements))
+    }
+}
+
 create_exception!(libsql, Error, pyo3::exceptions::PyException);
 
 #[pymodule]
 fn libsql(py: Python, m: &PyModule) -> PyResult<()> {
     let _ = tracing_subscriber::fmt::try_init();
     m.add("LEGACY_TRANSACTION_CONTROL", LEGACY_TRANSACTION_CONTROL)?;
+    m.add("PARSE_DECLTYPES", PARSE_DECLTYPES)?;
+    m.add("PARSE_COLNAMES", PARSE_COLNAMES)?;
     m.add("paramstyle", "qmark")?;
     m.add("sqlite_version_info", (3, 42, 0))?;
     m.add("Error", py.get_type::<Error>())?;
     m.add_function(wrap_pyfunction!(connect, m)?)?;
+    m.add_function(wrap_pyfunction!(params::register_adapter, m)?)?;
+    m.add("adapters", params::adapters(py))?;
+    m.add_function(wrap_pyfunction!(converters::register_converter, m)?)?;
+    m.add_function(wrap_pyfunction!(vector::vector32, m)?)?;
+    m.add_function(wrap_pyfunction!(runtime::configure_runtime, m)?)?;
+    m.add_function(wrap_pyfunction!(runtime::runtime_metrics, m)?)?;
     m.add_class::<Connection>()?;
     m.add_class::<Cursor>()?;
+    m.add_class::<Transaction>()?;
+    m.add_class::<blob::Blob>()?;
+    m.add_class::<Row>()?;
+    m.add_class::<batch::ResultSet>()?;
+    m.add_class::<SyncHandle>()?;
+    m.add_class::<pool::Pool>()?;
+    m.add_class::<columnar::ColumnArray>()?;
+    m.add_class::<columnar::ColumnBuffer>()?;
+    let aio = PyModule::new(py, "aio")?;
+    aio::register(py, aio)?;
+    m.add_submodule(aio)?;
     Ok(())
 }
 
-async fn check_signals<F, R>(py: Python<'_>, mut fut: std::pin::Pin<&mut F>) -> R
+/// Runs `fut` to completion on `runtime` with the GIL released.
+///
+/// Python objects must not be touched by `fut`: convert parameters before
+/// calling this and results after it returns.
+fn block_on<F>(py: Python<'_>, runtime: &ConnectionRuntime, fut: F) -> PyResult<F::Output>
+where
+    F: std::future::Future + Send,
+    F::Output: Send,
+{
+    py.allow_threads(move || {
+        tokio::pin!(fut);
+        runtime.block_on(check_signals(fut))
+    })
+}
+
+/// Records that the function `name` of `narg` arguments was registered
+/// or removed on `conn`.
+fn register_function(conn: &ConnectionGuard, name: &str, narg: i32) {
+    let mut registered = conn.registered_functions.lock().unwrap();
+    if !registered
+        .iter()
+        .any(|(other, n)| *n == narg && other.eq_ignore_ascii_case(name))
+    {
+        registered.push((name.to_string(), narg));
+    }
+}
+
+/// Returns the SQLite handle of `conn` for `operation`, which is not
+/// supported on remote connections.
+fn local_handle<'a>(
+    conn: Option<&'a Arc<ConnectionGuard>>,
+    operation: &str,
+) -> PyResult<&'a functions::SqliteHandle> {
+    match conn {
+        Some(conn) => conn.handle.as_ref().ok_or_else(|| {
+            PyValueError::new_err(format!("{operation} is not supported for remote databases"))
+        }),
+        None => Err(PyValueError::new_err("Connection already closed")),
+    }
+}
+
+/// Runs a statement future of `conn` like `block_on()`, abandoning it when
+/// the connection is interrupted or its statement timeout expires.
+fn run_statement<F>(py: Python<'_>, conn: &Arc<ConnectionGuard>, fut: F) -> PyResult<F::Output>
+where
+    F: std::future::Future + Send,
+    F::Output: Send,
+{
+    conn.timed_out.store(false, Ordering::Relaxed);
+    // Local statements step synchronously inside the future, even on a
+    // dedicated runtime, so the timeout fires on the shared runtime's
+    // workers where it can interrupt them.
+    let watchdog = conn.statement_timeout().map(|timeout| {
+        let conn = conn.clone();
+        runtime().spawn(async move {
+            tokio::time::sleep(timeout).await;
+            conn.timed_out.store(true, Ordering::Relaxed);
+            let _ = conn.interrupt();
+        })
+    });
+    let interrupted = conn.interrupted.notified();
+    let result = block_on(py, &conn.runtime, async move {
+        tokio::select! {
+            out = fut => Some(out),
+            _ = interrupted => None,
+        }
+    });
+    if let Some(watchdog) = watchdog {
+        watchdog.abort();
+    }
+    if conn.timed_out.load(Ordering::Relaxed) {
+        return Err(PyTimeoutError::new_err("Statement timed out"));
+    }
+    result?.ok_or_else(|| PyValueError::new_err("interrupted"))
+}
+
+async fn check_signals<F, R>(mut fut: std::pin::Pin<&mut F>) -> PyResult<R>
 where
     F: std::future::Future<Output = R>,
 {
     loop {
         tokio::select! {
             out = &mut fut => {
-                break out;
+                break Ok(out);
             }
 
-            _ = tokio::time::sleep(std::time::Duration::from_millis(300)) => {
-                py.check_signals().unwrap();
+            _ = tokio::time::sleep(SIGNAL_CHECK_INTERVAL) => {
+                Python::with_gil(|py| py.check_signals())?;
             }
         }
     }
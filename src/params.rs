@@ -0,0 +1,157 @@
+//! Conversion of Python parameters into libSQL values.
+//!
+//! Adapters registered with `register_adapter()` take precedence. Other
+//! parameters are dispatched on their exact type, so the common builtin
+//! types cost a single type check, before falling back to subclass and
+//! buffer protocol checks.
+
+use ::libsql as libsql_core;
+use pyo3::exceptions::PyValueError;
+use pyo3::ffi;
+use pyo3::prelude::*;
+use pyo3::sync::GILOnceCell;
+use pyo3::types::{
+    PyBool, PyByteArray, PyBytes, PyDict, PyFloat, PyList, PyLong, PyMapping, PySequence, PyString,
+    PyTuple, PyType,
+};
+
+static ADAPTERS: GILOnceCell<Py<PyDict>> = GILOnceCell::new();
+
+/// The registered adapters by type, exposed as `libsql.adapters`.
+pub(crate) fn adapters(py: Python<'_>) -> &PyDict {
+    ADAPTERS
+        .get_or_init(py, || PyDict::new(py).into())
+        .as_ref(py)
+}
+
+/// Registers `adapter` to convert parameters of exactly type `type_` into
+/// a value libSQL can bind, like `sqlite3.register_adapter()`.
+#[pyfunction]
+pub(crate) fn register_adapter(py: Python<'_>, type_: &PyType, adapter: PyObject) -> PyResult<()> {
+    adapters(py).set_item(type_, adapter)
+}
+
+/// Converts the parameters passed to `execute()`.
+///
+/// Sequences become positional parameters. Mappings become named
+/// parameters keyed by name without the `:`, `@` or `$` prefix; they are
+/// matched to the statement's parameters by `CachedStatement::bind()`.
+pub(crate) fn to_params(parameters: Option<&PyAny>) -> PyResult<libsql_core::params::Params> {
+    let parameters = match parameters {
+        Some(parameters) if !parameters.is_none() => parameters,
+        _ => return Ok(libsql_core::params::Params::None),
+    };
+    if let Ok(parameters) = parameters.downcast::<PyTuple>() {
+        return to_positional(parameters.iter());
+    }
+    if let Ok(parameters) = parameters.downcast::<PyList>() {
+        return to_positional(parameters.iter());
+    }
+    if let Ok(parameters) = parameters.downcast::<PyDict>() {
+        return to_named(parameters.iter());
+    }
+    if let Ok(parameters) = parameters.downcast::<PyMapping>() {
+        let items = parameters
+            .items()?
+            .iter()?
+            .map(|item| item?.extract::<(&PyAny, &PyAny)>())
+            .collect::<PyResult<Vec<_>>>()?;
+        return to_named(items.into_iter());
+    }
+    to_positional(parameters.downcast::<PySequence>()?.to_tuple()?.iter())
+}
+
+fn to_positional<'py>(
+    parameters: impl Iterator<Item = &'py PyAny>,
+) -> PyResult<libsql_core::params::Params> {
+    let mut params = Vec::with_capacity(parameters.size_hint().0);
+    for param in parameters {
+        params.push(to_value(param)?);
+    }
+    Ok(libsql_core::params::Params::Positional(params))
+}
+
+fn to_named<'py>(
+    parameters: impl Iterator<Item = (&'py PyAny, &'py PyAny)>,
+) -> PyResult<libsql_core::params::Params> {
+    let mut params = Vec::with_capacity(parameters.size_hint().0);
+    for (name, param) in parameters {
+        params.push((name.extract::<String>()?, to_value(param)?));
+    }
+    Ok(libsql_core::params::Params::Named(params))
+}
+
+pub(crate) fn to_value(param: &PyAny) -> PyResult<libsql_core::Value> {
+    let adapters = adapters(param.py());
+    if !adapters.is_empty() {
+        if let Some(adapter) = adapters.get_item(param.get_type()) {
+            let adapted = adapter.call1((param,))?;
+            return match builtin_value(adapted)? {
+                Some(value) => Ok(value),
+                None => fallback_value(adapted),
+            };
+        }
+    }
+    match builtin_value(param)? {
+        Some(value) => Ok(value),
+        None => fallback_value(param),
+    }
+}
+
+/// Converts instances of the builtin types, matching the exact type only.
+fn builtin_value(param: &PyAny) -> PyResult<Option<libsql_core::Value>> {
+    let value = if param.is_none() {
+        libsql_core::Value::Null
+    } else if param.is_exact_instance_of::<PyLong>() {
+        libsql_core::Value::Integer(param.extract::<i64>()?)
+    } else if param.is_exact_instance_of::<PyFloat>() {
+        libsql_core::Value::Real(unsafe { param.downcast_unchecked::<PyFloat>() }.value())
+    } else if param.is_exact_instance_of::<PyString>() {
+        let value = unsafe { param.downcast_unchecked::<PyString>() }.to_str()?;
+        libsql_core::Value::Text(value.to_owned())
+    } else if param.is_exact_instance_of::<PyBytes>() {
+        let value = unsafe { param.downcast_unchecked::<PyBytes>() }.as_bytes();
+        libsql_core::Value::Blob(value.to_vec())
+    } else if param.is_exact_instance_of::<PyBool>() {
+        libsql_core::Value::Integer(param.is_true()? as i64)
+    } else if param.is_exact_instance_of::<PyByteArray>() {
+        libsql_core::Value::Blob(unsafe { param.downcast_unchecked::<PyByteArray>() }.to_vec())
+    } else if unsafe { ffi::PyMemoryView_Check(param.as_ptr()) } != 0 {
+        libsql_core::Value::Blob(buffer_to_vec(param)?)
+    } else {
+        return Ok(None);
+    };
+    Ok(Some(value))
+}
+
+/// Converts subclasses of the builtin types and other buffer objects.
+fn fallback_value(param: &PyAny) -> PyResult<libsql_core::Value> {
+    let value = if param.is_instance_of::<PyBool>() {
+        libsql_core::Value::Integer(param.is_true()? as i64)
+    } else if param.is_instance_of::<PyLong>() {
+        libsql_core::Value::Integer(param.extract::<i64>()?)
+    } else if param.is_instance_of::<PyFloat>() {
+        libsql_core::Value::Real(param.extract::<f64>()?)
+    } else if param.is_instance_of::<PyString>() {
+        libsql_core::Value::Text(param.extract::<&str>()?.to_owned())
+    } else if unsafe { ffi::PyObject_CheckBuffer(param.as_ptr()) } != 0 {
+        libsql_core::Value::Blob(buffer_to_vec(param)?)
+    } else {
+        return Err(PyValueError::new_err("Unsupported parameter type"));
+    };
+    Ok(value)
+}
+
+/// Copies the contents of a contiguous buffer object.
+fn buffer_to_vec(param: &PyAny) -> PyResult<Vec<u8>> {
+    unsafe {
+        let mut view = std::mem::MaybeUninit::<ffi::Py_buffer>::uninit();
+        if ffi::PyObject_GetBuffer(param.as_ptr(), view.as_mut_ptr(), ffi::PyBUF_SIMPLE) == -1 {
+            return Err(PyErr::fetch(param.py()));
+        }
+        let mut view = view.assume_init();
+        let bytes = std::slice::from_raw_parts(view.buf as *const u8, view.len as usize).to_vec();
+        ffi::PyBuffer_Release(&mut view);
+        Ok(bytes)
+    }
+}
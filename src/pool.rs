@@ -0,0 +1,385 @@
+//! Connection pooling over a single shared `Database`.
+//!
+//! Opening a `Database` is the expensive part of `connect()`: it sets up the
+//! sync machinery for embedded replicas and the HTTP client for remote
+//! databases. A `Pool` opens it once and hands out `Connection`s backed by
+//! reusable libSQL connections. Closing a pooled `Connection` returns its
+//! libSQL connection to the pool instead of dropping it.
+
+use crate::{
+    block_on, connect_guard, open_database, replica::Database, runtime::ConnectionRuntime,
+    transaction, Connection, ConnectionGuard, DEFAULT_CACHED_STATEMENTS,
+    LEGACY_TRANSACTION_CONTROL,
+};
+use ::libsql as libsql_core;
+use pyo3::exceptions::{PyTimeoutError, PyValueError};
+use pyo3::prelude::*;
+use pyo3::types::PyDict;
+use std::cell::RefCell;
+use std::collections::VecDeque;
+use std::sync::{Arc, Condvar, Mutex};
+use std::time::{Duration, Instant};
+
+/// How long a waiting `acquire()` sleeps before checking for signals.
+const WAIT_SLICE: Duration = Duration::from_millis(100);
+
+struct PoolConfig {
+    timeout: f64,
+    cached_statements: usize,
+    detect_types: i32,
+    behavior: libsql_core::TransactionBehavior,
+    min_size: usize,
+    max_size: usize,
+    idle_timeout: Option<Duration>,
+    health_check: bool,
+}
+
+struct IdleConnection {
+    conn: Arc<ConnectionGuard>,
+    since: Instant,
+}
+
+#[derive(Default)]
+struct PoolStats {
+    acquired: u64,
+    created: u64,
+    discarded: u64,
+    waits: u64,
+    timeouts: u64,
+    wait_time: Duration,
+    max_wait: Duration,
+}
+
+struct PoolState {
+    /// Idle connections, oldest first. Checkouts take the most recently
+    /// used one so that idle timeouts can trim the cold end.
+    idle: VecDeque<IdleConnection>,
+    /// Connections that are open, idle or checked out.
+    open: usize,
+    waiting: usize,
+    closed: bool,
+    stats: PoolStats,
+}
+
+impl PoolState {
+    fn record_checkout(&mut self, started: Instant, waited: bool) {
+        self.stats.acquired += 1;
+        if waited {
+            let wait = started.elapsed();
+            self.stats.wait_time += wait;
+            self.stats.max_wait = self.stats.max_wait.max(wait);
+        }
+    }
+}
+
+/// Pool state shared between the `Pool` and the connections it handed out.
+pub(crate) struct PoolShared {
+    db: Arc<Database>,
+    config: PoolConfig,
+    state: Mutex<PoolState>,
+    available: Condvar,
+}
+
+impl PoolShared {
+    fn connect(&self) -> PyResult<Arc<ConnectionGuard>> {
+        connect_guard(
+            &self.db,
+            self.config.timeout,
+            self.config.cached_statements,
+            self.config.detect_types,
+            self.config.behavior,
+            ConnectionRuntime::Shared,
+        )
+    }
+
+    /// Removes idle connections that have outlived `idle_timeout`, keeping
+    /// at least `min_size` connections open.
+    fn expire_idle(&self, state: &mut PoolState) -> Vec<IdleConnection> {
+        let mut expired = vec![];
+        if let Some(idle_timeout) = self.config.idle_timeout {
+            while state.open > self.config.min_size {
+                match state.idle.front() {
+                    Some(idle) if idle.since.elapsed() >= idle_timeout => {
+                        expired.extend(state.idle.pop_front());
+                        state.open -= 1;
+                        state.stats.discarded += 1;
+                    }
+                    _ => break,
+                }
+            }
+        }
+        expired
+    }
+
+    fn is_healthy(&self, py: Python<'_>, conn: &Arc<ConnectionGuard>) -> bool {
+        let conn = conn.clone();
+        let result = block_on(py, &ConnectionRuntime::Shared, async move {
+            conn.query("SELECT 1", ()).await.map(|_| ())
+        });
+        matches!(result, Ok(Ok(())))
+    }
+
+    fn discard(&self) {
+        let mut state = self.state.lock().unwrap();
+        state.open -= 1;
+        state.stats.discarded += 1;
+        self.available.notify_one();
+    }
+
+    fn checkout(
+        &self,
+        py: Python<'_>,
+        timeout: Option<Duration>,
+    ) -> PyResult<Arc<ConnectionGuard>> {
+        let started = Instant::now();
+        let deadline = timeout.map(|timeout| started + timeout);
+        let mut waited = false;
+        loop {
+            let mut state = self.state.lock().unwrap();
+            if state.closed {
+                return Err(PyValueError::new_err("Pool already closed"));
+            }
+            let expired = self.expire_idle(&mut state);
+            if let Some(idle) = state.idle.pop_back() {
+                state.record_checkout(started, waited);
+                drop(state);
+                drop(expired);
+                if self.config.health_check && !self.is_healthy(py, &idle.conn) {
+                    drop(idle);
+                    self.discard();
+                    continue;
+                }
+                return Ok(idle.conn);
+            }
+            if state.open < self.config.max_size {
+                state.open += 1;
+                drop(state);
+                drop(expired);
+                return match self.connect() {
+                    Ok(conn) => {
+                        let mut state = self.state.lock().unwrap();
+                        state.stats.created += 1;
+                        state.record_checkout(started, waited);
+                        Ok(conn)
+                    }
+                    Err(err) => {
+                        let mut state = self.state.lock().unwrap();
+                        state.open -= 1;
+                        self.available.notify_one();
+                        Err(err)
+                    }
+                };
+            }
+            drop(expired);
+            let slice = match deadline {
+                Some(deadline) => {
+                    let remaining = deadline.saturating_duration_since(Instant::now());
+                    if remaining.is_zero() {
+                        state.stats.timeouts += 1;
+                        return Err(PyTimeoutError::new_err(
+                            "Timed out waiting for a pooled connection",
+                        ));
+                    }
+                    remaining.min(WAIT_SLICE)
+                }
+                None => WAIT_SLICE,
+            };
+            if !waited {
+                state.stats.waits += 1;
+                waited = true;
+            }
+            state.waiting += 1;
+            drop(state);
+            py.allow_threads(|| {
+                let state = self.state.lock().unwrap();
+                if state.idle.is_empty() && state.open >= self.config.max_size && !state.closed {
+                    let _ = self.available.wait_timeout(state, slice).unwrap();
+                }
+            });
+            self.state.lock().unwrap().waiting -= 1;
+            py.check_signals()?;
+        }
+    }
+
+    /// Takes a connection back from a pooled `Connection`.
+    ///
+    /// Connections that are still inside a transaction or still used by a
+    /// cursor are closed instead of being reused, and so are those whose
+    /// functions cannot be removed.
+    pub(crate) fn release(&self, conn: Arc<ConnectionGuard>) {
+        let reusable = Arc::strong_count(&conn) == 1
+            && conn.is_autocommit()
+            && conn.remove_functions().is_ok();
+        let mut state = self.state.lock().unwrap();
+        if reusable && !state.closed {
+            // The next holder starts without this one's functions, trace
+            // callback, statement timeout and busy handler settings.
+            conn.tracer.reset();
+            *conn.statement_timeout.lock().unwrap() = None;
+            conn.discard_transaction();
+            conn.busy.reset();
+            state.idle.push_back(IdleConnection {
+                conn,
+                since: Instant::now(),
+            });
+            self.available.notify_one();
+        } else {
+            state.open -= 1;
+            state.stats.discarded += 1;
+            self.available.notify_one();
+            drop(state);
+            drop(conn);
+        }
+    }
+}
+
+#[pyclass(module = "libsql")]
+pub struct Pool {
+    shared: Arc<PoolShared>,
+    isolation_level: Option<String>,
+}
+
+#[pymethods]
+impl Pool {
+    #[new]
+    #[pyo3(signature = (database, min_size=0, max_size=10, idle_timeout=None, health_check=false, timeout=5.0, isolation_level="DEFERRED".to_string(), sync_url=None, sync_interval=None, auth_token="", encryption_key=None, cached_statements=DEFAULT_CACHED_STATEMENTS, detect_types=0))]
+    fn new(
+        py: Python<'_>,
+        database: String,
+        min_size: usize,
+        max_size: usize,
+        idle_timeout: Option<f64>,
+        health_check: bool,
+        timeout: f64,
+        isolation_level: Option<String>,
+        sync_url: Option<String>,
+        sync_interval: Option<f64>,
+        auth_token: &str,
+        encryption_key: Option<String>,
+        cached_statements: usize,
+        detect_types: i32,
+    ) -> PyResult<Self> {
+        if max_size == 0 || min_size > max_size {
+            return Err(PyValueError::new_err(
+                "max_size must be positive and at least min_size",
+            ));
+        }
+        let behavior = transaction::parse_behavior(isolation_level.as_deref(), "isolation_level")?;
+        let auth_token = auth_token.to_string();
+        let db = block_on(
+            py,
+            &ConnectionRuntime::Shared,
+            open_database(
+                database,
+                sync_url,
+                sync_interval,
+                auth_token,
+                encryption_key,
+            ),
+        )??;
+        let shared = Arc::new(PoolShared {
+            db: Arc::new(db),
+            config: PoolConfig {
+                timeout,
+                cached_statements,
+                detect_types,
+                behavior,
+                min_size,
+                max_size,
+                idle_timeout: idle_timeout.map(Duration::from_secs_f64),
+                health_check,
+            },
+            state: Mutex::new(PoolState {
+                idle: VecDeque::with_capacity(max_size),
+                open: 0,
+                waiting: 0,
+                closed: false,
+                stats: PoolStats::default(),
+            }),
+            available: Condvar::new(),
+        });
+        for _ in 0..min_size {
+            let conn = shared.connect()?;
+            let mut state = shared.state.lock().unwrap();
+            state.open += 1;
+            state.stats.created += 1;
+            state.idle.push_back(IdleConnection {
+                conn,
+                since: Instant::now(),
+            });
+        }
+        Ok(Pool {
+            shared,
+            isolation_level,
+        })
+    }
+
+    /// Checks a connection out of the pool, waiting up to `timeout` seconds
+    /// (forever by default) for one to become available.
+    #[pyo3(signature = (timeout=None))]
+    fn acquire(&self, py: Python<'_>, timeout: Option<f64>) -> PyResult<Connection> {
+        let conn = self
+            .shared
+            .checkout(py, timeout.map(Duration::from_secs_f64))?;
+        Ok(Connection {
+            db: self.shared.db.clone(),
+            conn: RefCell::new(Some(conn)),
+            runtime: ConnectionRuntime::Shared,
+            isolation_level: self.isolation_level.clone(),
+            autocommit: LEGACY_TRANSACTION_CONTROL,
+            pool: Some(self.shared.clone()),
+            cursors: RefCell::new(Vec::new()),
+            row_factory: None,
+            blob_buffers: false,
+        })
+    }
+
+    /// Closes all idle connections. Connections that are checked out are
+    /// closed when they are returned.
+    fn close(&self) {
+        let idle: Vec<IdleConnection> = {
+            let mut state = self.shared.state.lock().unwrap();
+            state.closed = true;
+            state.open -= state.idle.len();
+            state.stats.discarded += state.idle.len() as u64;
+            state.idle.drain(..).collect()
+        };
+        self.shared.available.notify_all();
+        drop(idle);
+    }
+
+    /// Syncs the shared embedded replica and returns what was synced.
+    fn sync<'py>(&self, py: Python<'py>) -> PyResult<&'py PyDict> {
+        let db = self.shared.db.clone();
+        block_on(
+            py,
+            &ConnectionRuntime::Shared,
+            async move { db.sync().await },
+        )??
+        .to_dict(py)
+    }
+
+    fn sync_stats<'py>(&self, py: Python<'py>) -> PyResult<&'py PyDict> {
+        self.shared.db.stats(py)
+    }
+
+    /// Returns pool occupancy and wait-queue metrics.
+    fn stats<'py>(&self, py: Python<'py>) -> PyResult<&'py PyDict> {
+        let state = self.shared.state.lock().unwrap();
+        let stats = PyDict::new(py);
+        stats.set_item("size", state.open)?;
+        stats.set_item("idle", state.idle.len())?;
+        stats.set_item("in_use", state.open - state.idle.len())?;
+        stats.set_item("min_size", self.shared.config.min_size)?;
+        stats.set_item("max_size", self.shared.config.max_size)?;
+        stats.set_item("waiting", state.waiting)?;
+        stats.set_item("acquired", state.stats.acquired)?;
+        stats.set_item("created", state.stats.created)?;
+        stats.set_item("discarded", state.stats.discarded)?;
+        stats.set_item("waits", state.stats.waits)?;
+        stats.set_item("timeouts", state.stats.timeouts)?;
+        stats.set_item("wait_seconds", state.stats.wait_time.as_secs_f64())?;
+        stats.set_item("max_wait_seconds", state.stats.max_wait.as_secs_f64())?;
+        Ok(stats)
+    }
+}
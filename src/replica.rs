@@ -0,0 +1,244 @@
+//! Embedded replica syncing.
+//!
+//! Every connection, pool and `libsql.aio` connection holds the libSQL
+//! `Database` through the `Database` wrapper below, which records the
+//! outcome of each sync that goes through this module. `sync_async()`
+//! runs a sync as a task on the shared runtime and returns a `SyncHandle`
+//! to wait on it.
+
+use crate::runtime::{rt, ConnectionRuntime};
+use crate::{block_on, to_py_err};
+use ::libsql as libsql_core;
+use pyo3::exceptions::PyTimeoutError;
+use pyo3::prelude::*;
+use pyo3::types::PyDict;
+use std::future::Future;
+use std::ops::Deref;
+use std::sync::{Arc, Mutex};
+use std::time::{Duration, Instant};
+use tokio::sync::Notify;
+
+/// The outcome of a single sync.
+#[derive(Clone, Copy)]
+pub(crate) struct SyncResult {
+    replication_index: Option<u64>,
+    frames_synced: usize,
+    duration: Duration,
+}
+
+impl SyncResult {
+    pub(crate) fn to_dict<'py>(&self, py: Python<'py>) -> PyResult<&'py PyDict> {
+        let result = PyDict::new(py);
+        result.set_item("replication_index", self.replication_index)?;
+        result.set_item("frames_synced", self.frames_synced)?;
+        result.set_item("duration_seconds", self.duration.as_secs_f64())?;
+        Ok(result)
+    }
+}
+
+#[derive(Default)]
+struct SyncStats {
+    syncs: u64,
+    errors: u64,
+    frames_synced: u64,
+    replication_index: Option<u64>,
+    last_duration: Duration,
+    total_duration: Duration,
+    in_progress: usize,
+}
+
+/// Counts a sync as in progress until it completes or is cancelled.
+struct InProgress<'a>(&'a Mutex<SyncStats>);
+
+impl<'a> InProgress<'a> {
+    fn start(stats: &'a Mutex<SyncStats>) -> Self {
+        stats.lock().unwrap().in_progress += 1;
+        InProgress(stats)
+    }
+}
+
+impl Drop for InProgress<'_> {
+    fn drop(&mut self) {
+        self.0.lock().unwrap().in_progress -= 1;
+    }
+}
+
+/// A libSQL `Database` together with the statistics of its syncs.
+pub(crate) struct Database {
+    db: libsql_core::Database,
+    remote: bool,
+    encrypted: bool,
+    stats: Mutex<SyncStats>,
+}
+
+impl Deref for Database {
+    type Target = libsql_core::Database;
+
+    fn deref(&self) -> &Self::Target {
+        &self.db
+    }
+}
+
+impl Database {
+    pub(crate) fn new(db: libsql_core::Database, remote: bool, encrypted: bool) -> Self {
+        Database {
+            db,
+            remote,
+            encrypted,
+            stats: Mutex::new(SyncStats::default()),
+        }
+    }
+
+    /// Whether this is a remote database accessed over Hrana.
+    pub(crate) fn is_remote(&self) -> bool {
+        self.remote
+    }
+
+    /// Whether this is a local database or replica opened with an
+    /// encryption key.
+    pub(crate) fn is_encrypted(&self) -> bool {
+        self.encrypted
+    }
+
+    /// Pulls new frames from the primary.
+    pub(crate) async fn sync(&self) -> PyResult<SyncResult> {
+        self.record(self.db.sync()).await
+    }
+
+    /// Syncs until the replica has applied `replication_index`. Returns
+    /// without contacting the primary if it already has.
+    pub(crate) async fn sync_until(&self, replication_index: u64) -> PyResult<SyncResult> {
+        if let Some(current) = self.replication_index().await? {
+            if current >= replication_index {
+                return Ok(SyncResult {
+                    replication_index: Some(current),
+                    frames_synced: 0,
+                    duration: Duration::ZERO,
+                });
+            }
+        }
+        self.record(self.db.sync_until(replication_index)).await
+    }
+
+    pub(crate) async fn replication_index(&self) -> PyResult<Option<u64>> {
+        self.db.replication_index().await.map_err(to_py_err)
+    }
+
+    async fn record<F>(&self, fut: F) -> PyResult<SyncResult>
+    where
+        F: Future<Output = libsql_core::Result<libsql_core::replication::Replicated>>,
+    {
+        let _in_progress = InProgress::start(&self.stats);
+        let started = Instant::now();
+        let result = fut.await;
+        let duration = started.elapsed();
+        let mut stats = self.stats.lock().unwrap();
+        stats.last_duration = duration;
+        stats.total_duration += duration;
+        match result {
+            Ok(replicated) => {
+                stats.syncs += 1;
+                stats.frames_synced += replicated.frames_synced() as u64;
+                if replicated.frame_no().is_some() {
+                    stats.replication_index = replicated.frame_no();
+                }
+                Ok(SyncResult {
+                    replication_index: replicated.frame_no(),
+                    frames_synced: replicated.frames_synced(),
+                    duration,
+                })
+            }
+            Err(err) => {
+                stats.errors += 1;
+                Err(to_py_err(err))
+            }
+        }
+    }
+
+    pub(crate) fn stats<'py>(&self, py: Python<'py>) -> PyResult<&'py PyDict> {
+        let stats = self.stats.lock().unwrap();
+        let result = PyDict::new(py);
+        result.set_item("syncs", stats.syncs)?;
+        result.set_item("errors", stats.errors)?;
+        result.set_item("frames_synced", stats.frames_synced)?;
+        result.set_item("replication_index", stats.replication_index)?;
+        result.set_item("last_duration_seconds", stats.last_duration.as_secs_f64())?;
+        result.set_item("total_duration_seconds", stats.total_duration.as_secs_f64())?;
+        result.set_item("in_progress", stats.in_progress)?;
+        Ok(result)
+    }
+}
+
+struct SyncTask {
+    outcome: Mutex<Option<PyResult<SyncResult>>>,
+    finished: Notify,
+}
+
+/// A sync running in the background, returned by `sync_async()`.
+#[pyclass(module = "libsql")]
+pub struct SyncHandle {
+    task: Arc<SyncTask>,
+}
+
+impl SyncHandle {
+    /// Starts syncing `db` on the shared runtime. A dedicated runtime only
+    /// runs while its connection blocks on it, so a sync spawned there would
+    /// not make progress until `result()` is called.
+    pub(crate) fn spawn(db: Arc<Database>) -> Self {
+        let task = Arc::new(SyncTask {
+            outcome: Mutex::new(None),
+            finished: Notify::new(),
+        });
+        let state = task.clone();
+        rt().spawn(async move {
+            let outcome = db.sync().await;
+            *state.outcome.lock().unwrap() = Some(outcome);
+            state.finished.notify_waiters();
+        });
+        SyncHandle { task }
+    }
+}
+
+#[pymethods]
+impl SyncHandle {
+    /// Returns `True` once the sync has finished.
+    fn done(&self) -> bool {
+        self.task.outcome.lock().unwrap().is_some()
+    }
+
+    /// Waits for the sync to finish and returns its result, raising the
+    /// sync's error if it failed.
+    #[pyo3(signature = (timeout=None))]
+    fn result<'py>(&self, py: Python<'py>, timeout: Option<f64>) -> PyResult<&'py PyDict> {
+        let task = self.task.clone();
+        let finished = async move {
+            loop {
+                let notified = task.finished.notified();
+                let done = task.outcome.lock().unwrap().is_some();
+                if done {
+                    break;
+                }
+                notified.await;
+            }
+        };
+        let finished = match timeout {
+            Some(timeout) => {
+                let timeout = Duration::from_secs_f64(timeout);
+                block_on(py, &ConnectionRuntime::Shared, async move {
+                    tokio::time::timeout(timeout, finished).await.is_ok()
+                })?
+            }
+            None => {
+                block_on(py, &ConnectionRuntime::Shared, finished)?;
+                true
+            }
+        };
+        if !finished {
+            return Err(PyTimeoutError::new_err("Timed out waiting for sync"));
+        }
+        match self.task.outcome.lock().unwrap().as_ref().unwrap() {
+            Ok(result) => result.to_dict(py),
+            Err(err) => Err(err.clone_ref(py)),
+        }
+    }
+}
@@ -0,0 +1,137 @@
+//! The `libsql.Row` row factory.
+//!
+//! A `Row` is a tuple of values plus a reference to a `RowIndex` that is
+//! built once per prepared statement and shared by every row it produces,
+//! so named access costs a hash lookup and no per-row allocation.
+
+use pyo3::basic::CompareOp;
+use pyo3::exceptions::{PyIndexError, PyTypeError};
+use pyo3::prelude::*;
+use pyo3::types::{PyLong, PySlice, PyString, PyTuple};
+use std::collections::HashMap;
+use std::sync::Arc;
+
+/// Column names of a result set and their positions.
+pub(crate) struct RowIndex {
+    names: Vec<String>,
+    positions: HashMap<String, usize>,
+}
+
+impl RowIndex {
+    pub(crate) fn new(names: Vec<String>) -> Self {
+        let mut positions = HashMap::with_capacity(names.len());
+        for (idx, name) in names.iter().enumerate().rev() {
+            positions.insert(name.clone(), idx);
+        }
+        RowIndex { names, positions }
+    }
+
+    /// Looks `name` up, falling back to an ASCII case-insensitive match like
+    /// `sqlite3.Row` does.
+    fn position(&self, name: &str) -> Option<usize> {
+        self.positions.get(name).copied().or_else(|| {
+            self.names
+                .iter()
+                .position(|column| column.eq_ignore_ascii_case(name))
+        })
+    }
+}
+
+#[pyclass(module = "libsql")]
+pub struct Row {
+    index: Arc<RowIndex>,
+    values: Py<PyTuple>,
+}
+
+impl Row {
+    pub(crate) fn with_index(index: Arc<RowIndex>, values: Py<PyTuple>) -> Self {
+        Row { index, values }
+    }
+}
+
+#[pymethods]
+impl Row {
+    /// Builds a row from a cursor's `description`, so that `Row` can also
+    /// be called like any other row factory.
+    #[new]
+    fn new(cursor: &PyAny, values: &PyTuple) -> PyResult<Self> {
+        let description = cursor.getattr("description")?;
+        let names = if description.is_none() {
+            vec![]
+        } else {
+            description
+                .iter()?
+                .map(|column| column?.get_item(0)?.extract::<String>())
+                .collect::<PyResult<Vec<_>>>()?
+        };
+        Ok(Row {
+            index: Arc::new(RowIndex::new(names)),
+            values: values.into(),
+        })
+    }
+
+    fn keys(&self) -> Vec<String> {
+        self.index.names.clone()
+    }
+
+    fn __len__(&self, py: Python<'_>) -> usize {
+        self.values.as_ref(py).len()
+    }
+
+    fn __getitem__(&self, py: Python<'_>, key: &PyAny) -> PyResult<PyObject> {
+        let values = self.values.as_ref(py);
+        if key.is_instance_of::<PyLong>() {
+            let len = values.len() as isize;
+            let mut idx = key.extract::<isize>()?;
+            if idx < 0 {
+                idx += len;
+            }
+            if idx < 0 || idx >= len {
+                return Err(PyIndexError::new_err("Index out of range"));
+            }
+            return Ok(values.get_item(idx as usize)?.into());
+        }
+        if let Ok(name) = key.downcast::<PyString>() {
+            return match self.index.position(name.to_str()?) {
+                Some(idx) => Ok(values.get_item(idx)?.into()),
+                None => Err(PyIndexError::new_err("No item with that key")),
+            };
+        }
+        if key.is_instance_of::<PySlice>() {
+            return Ok(values.as_ref().get_item(key)?.into());
+        }
+        Err(PyTypeError::new_err("Index must be int or string"))
+    }
+
+    fn __iter__(&self, py: Python<'_>) -> PyResult<PyObject> {
+        let values: &PyAny = self.values.as_ref(py);
+        Ok(values.iter()?.into())
+    }
+
+    fn __hash__(&self, py: Python<'_>) -> PyResult<isize> {
+        let names = PyTuple::new(py, &self.index.names);
+        Ok(names.hash()? ^ self.values.as_ref(py).hash()?)
+    }
+
+    fn __richcmp__(&self, py: Python<'_>, other: &PyAny, op: CompareOp) -> PyResult<PyObject> {
+        let other = match other.downcast::<PyCell<Row>>() {
+            Ok(other) => other.borrow(),
+            Err(_) => return Ok(py.NotImplemented()),
+        };
+        let equal = (Arc::ptr_eq(&self.index, &other.index)
+            || self.index.names == other.index.names)
+            && self.values.as_ref(py).eq(other.values.as_ref(py))?;
+        match op {
+            CompareOp::Eq => Ok(equal.into_py(py)),
+            CompareOp::Ne => Ok((!equal).into_py(py)),
+            _ => Ok(py.NotImplemented()),
+        }
+    }
+
+    fn __repr__(&self, py: Python<'_>) -> PyResult<String> {
+        Ok(format!(
+            "<libsql.Row {}>",
+            self.values.as_ref(py).repr()?.to_str()?
+        ))
+    }
+}
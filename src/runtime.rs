@@ -0,0 +1,150 @@
+//! The tokio runtimes that drive libSQL futures.
+//!
+//! By default every connection shares one multi-threaded runtime, which is
+//! built lazily on first use and can be tuned with `configure_runtime()`
+//! before that. Connections opened with `dedicated_runtime=True` instead
+//! own a current-thread runtime that only runs while the connection is
+//! blocking on it.
+
+use pyo3::exceptions::PyRuntimeError;
+use pyo3::prelude::*;
+use pyo3::types::PyDict;
+use std::future::Future;
+use std::sync::{Arc, Mutex, OnceLock};
+use tokio::runtime::{Handle, Runtime};
+
+#[derive(Clone, Copy)]
+struct RuntimeConfig {
+    worker_threads: Option<usize>,
+    max_blocking_threads: Option<usize>,
+}
+
+static CONFIG: Mutex<RuntimeConfig> = Mutex::new(RuntimeConfig {
+    worker_threads: None,
+    max_blocking_threads: None,
+});
+
+static RT: OnceLock<Runtime> = OnceLock::new();
+
+/// Returns the shared runtime, building it on first use.
+pub(crate) fn runtime() -> &'static Runtime {
+    RT.get_or_init(|| {
+        let config = CONFIG.lock().unwrap();
+        let mut builder = tokio::runtime::Builder::new_multi_thread();
+        if let Some(worker_threads) = config.worker_threads {
+            builder.worker_threads(worker_threads);
+        }
+        if let Some(max_blocking_threads) = config.max_blocking_threads {
+            builder.max_blocking_threads(max_blocking_threads);
+        }
+        builder
+            .thread_name("libsql-runtime")
+            .enable_all()
+            .build()
+            .unwrap()
+    })
+}
+
+pub(crate) fn rt() -> Handle {
+    runtime().handle().clone()
+}
+
+/// A current-thread runtime owned by a single connection.
+pub(crate) struct DedicatedRuntime(Option<Runtime>);
+
+impl DedicatedRuntime {
+    fn get(&self) -> &Runtime {
+        self.0.as_ref().expect("Runtime already shut down")
+    }
+}
+
+impl Drop for DedicatedRuntime {
+    fn drop(&mut self) {
+        // The last reference may go away inside a future running on this
+        // very runtime, where a regular drop would panic.
+        if let Some(runtime) = self.0.take() {
+            runtime.shutdown_background();
+        }
+    }
+}
+
+/// The runtime a connection blocks on.
+#[derive(Clone)]
+pub(crate) enum ConnectionRuntime {
+    Shared,
+    Dedicated(Arc<DedicatedRuntime>),
+}
+
+impl ConnectionRuntime {
+    pub(crate) fn new(dedicated: bool) -> PyResult<Self> {
+        if !dedicated {
+            return Ok(ConnectionRuntime::Shared);
+        }
+        let runtime = tokio::runtime::Builder::new_current_thread()
+            .enable_all()
+            .build()
+            .map_err(|err| PyRuntimeError::new_err(err.to_string()))?;
+        Ok(ConnectionRuntime::Dedicated(Arc::new(DedicatedRuntime(
+            Some(runtime),
+        ))))
+    }
+
+    pub(crate) fn handle(&self) -> Handle {
+        match self {
+            ConnectionRuntime::Shared => rt(),
+            ConnectionRuntime::Dedicated(runtime) => runtime.get().handle().clone(),
+        }
+    }
+
+    pub(crate) fn block_on<F: Future>(&self, fut: F) -> F::Output {
+        match self {
+            ConnectionRuntime::Shared => runtime().block_on(fut),
+            ConnectionRuntime::Dedicated(runtime) => runtime.get().block_on(fut),
+        }
+    }
+}
+
+/// Configures the shared runtime. Must be called before the first
+/// connection is opened.
+#[pyfunction]
+#[pyo3(signature = (worker_threads=None, max_blocking_threads=None))]
+pub(crate) fn configure_runtime(
+    worker_threads: Option<usize>,
+    max_blocking_threads: Option<usize>,
+) -> PyResult<()> {
+    if worker_threads == Some(0) || max_blocking_threads == Some(0) {
+        return Err(PyRuntimeError::new_err(
+            "worker_threads and max_blocking_threads must be greater than zero",
+        ));
+    }
+    let mut config = CONFIG.lock().unwrap();
+    if RT.get().is_some() {
+        return Err(PyRuntimeError::new_err(
+            "configure_runtime() must be called before the runtime is started",
+        ));
+    }
+    config.worker_threads = worker_threads;
+    config.max_blocking_threads = max_blocking_threads;
+    Ok(())
+}
+
+/// Returns scheduler metrics of the shared runtime.
+#[pyfunction]
+pub(crate) fn runtime_metrics(py: Python<'_>) -> PyResult<&PyDict> {
+    let metrics = runtime().metrics();
+    let workers = metrics.num_workers();
+    let busy: Vec<f64> = (0..workers)
+        .map(|worker| metrics.worker_total_busy_duration(worker).as_secs_f64())
+        .collect();
+    let parks: Vec<u64> = (0..workers)
+        .map(|worker| metrics.worker_park_count(worker))
+        .collect();
+    let stats = PyDict::new(py);
+    stats.set_item("workers", workers)?;
+    stats.set_item("alive_tasks", metrics.num_alive_tasks())?;
+    stats.set_item("global_queue_depth", metrics.global_queue_depth())?;
+    stats.set_item("busy_seconds", busy.iter().sum::<f64>())?;
+    stats.set_item("worker_busy_seconds", busy)?;
+    stats.set_item("worker_park_count", parks)?;
+    Ok(stats)
+}
@@ -0,0 +1,375 @@
+//! `Connection.backup()`, `serialize()` and `deserialize()`.
+//!
+//! libSQL exposes neither the SQLite online backup API nor
+//! `sqlite3_serialize()`, so snapshots go through a database file. The
+//! source is written out with `VACUUM INTO`, which reads it in a single
+//! transaction and, in WAL mode, does not block its writers. The file is
+//! then attached to the target, whose tables are replaced by the ones of
+//! the snapshot and filled with `INSERT INTO ... SELECT`, a few tables per
+//! trip into the runtime. Indexes, views and triggers are created once the
+//! data is in place, so triggers do not fire on the copied rows.
+
+use crate::columnar::{ColumnBuffer, Storage};
+use crate::{block_on, read_rows, to_py_err, ConnectionGuard};
+use ::libsql as libsql_core;
+use pyo3::buffer::PyBuffer;
+use pyo3::exceptions::PyValueError;
+use pyo3::prelude::*;
+use std::collections::hash_map::RandomState;
+use std::collections::HashMap;
+use std::fs::OpenOptions;
+use std::hash::{BuildHasher, Hasher};
+use std::io::ErrorKind;
+use std::path::PathBuf;
+use std::sync::Arc;
+
+const SNAPSHOT_SCHEMA: &str = "libsql_snapshot";
+
+/// A database file in the temporary directory, removed when dropped.
+pub(crate) struct SnapshotFile {
+    path: PathBuf,
+}
+
+impl SnapshotFile {
+    /// Creates an empty file with a random name that only the current user
+    /// can read. Creation fails rather than reuse a file that exists, so
+    /// other users of the temporary directory cannot plant one.
+    pub(crate) fn new() -> PyResult<Self> {
+        let mut options = OpenOptions::new();
+        options.write(true).create_new(true);
+        #[cfg(unix)]
+        std::os::unix::fs::OpenOptionsExt::mode(&mut options, 0o600);
+        loop {
+            let id = RandomState::new().build_hasher().finish();
+            let path = std::env::temp_dir().join(format!("libsql-snapshot-{id:016x}.db"));
+            match options.open(&path) {
+                Ok(_) => return Ok(SnapshotFile { path }),
+                Err(err) if err.kind() == ErrorKind::AlreadyExists => continue,
+                Err(err) => return Err(PyValueError::new_err(err.to_string())),
+            }
+        }
+    }
+
+    fn path(&self) -> libsql_core::Value {
+        libsql_core::Value::Text(self.path.to_string_lossy().into_owned())
+    }
+
+    /// Returns the contents of the file as a one-dimensional byte buffer.
+    pub(crate) fn read(&self, py: Python<'_>) -> PyResult<Py<ColumnBuffer>> {
+        let data = py
+            .allow_threads(|| std::fs::read(&self.path))
+            .map_err(|err| PyValueError::new_err(err.to_string()))?;
+        let len = data.len();
+        Py::new(
+            py,
+            ColumnBuffer::with_shape(Storage::Bytes(data), vec![len]),
+        )
+    }
+
+    /// Writes the bytes of the buffer `data` to the file.
+    pub(crate) fn write(&self, data: &PyAny) -> PyResult<()> {
+        let py = data.py();
+        let buffer = PyBuffer::<u8>::get(data)?;
+        let bytes = if buffer.is_c_contiguous() {
+            unsafe { std::slice::from_raw_parts(buffer.buf_ptr() as *const u8, buffer.len_bytes()) }
+                .to_vec()
+        } else {
+            buffer.to_vec(py)?
+        };
+        py.allow_threads(|| std::fs::write(&self.path, bytes))
+            .map_err(|err| PyValueError::new_err(err.to_string()))
+    }
+}
+
+impl Drop for SnapshotFile {
+    fn drop(&mut self) {
+        let _ = std::fs::remove_file(&self.path);
+    }
+}
+
+fn quote_identifier(name: &str) -> String {
+    format!("\"{}\"", name.replace('"', "\"\""))
+}
+
+fn quote_literal(value: &str) -> String {
+    format!("'{}'", value.replace('\'', "''"))
+}
+
+/// A table whose rows are copied from the snapshot.
+struct TableCopy {
+    table: String,
+    /// The quoted, comma-separated columns that store values, leaving out
+    /// generated columns.
+    columns: String,
+    /// Whether the table has rows of its own to delete first, like the
+    /// shadow tables that creating a virtual table fills in.
+    clear: bool,
+}
+
+/// Rejects remote and encrypted databases. The snapshot file is written
+/// without the encryption key and attached as a plain database, so it
+/// could neither be read back into an encrypted database nor be left
+/// unencrypted in the temporary directory.
+fn check_supported(conn: &ConnectionGuard, operation: &str) -> PyResult<()> {
+    if conn.remote {
+        return Err(PyValueError::new_err(format!(
+            "{operation} is not supported for remote databases"
+        )));
+    }
+    if conn.encrypted {
+        return Err(PyValueError::new_err(format!(
+            "{operation} is not supported for encrypted databases"
+        )));
+    }
+    Ok(())
+}
+
+/// Writes the database `name` of `conn` to `file`.
+pub(crate) fn save(
+    py: Python<'_>,
+    conn: &Arc<ConnectionGuard>,
+    name: &str,
+    file: &SnapshotFile,
+) -> PyResult<()> {
+    check_supported(conn, "Snapshotting")?;
+    let sql = format!("VACUUM {} INTO ?", quote_identifier(name));
+    let params = libsql_core::params::Params::Positional(vec![file.path()]);
+    let runtime = conn.runtime.clone();
+    let conn = conn.clone();
+    block_on(
+        py,
+        &runtime,
+        async move { conn.execute(&sql, params).await },
+    )?
+    .map_err(to_py_err)?;
+    Ok(())
+}
+
+/// Replaces the contents of the main database of `conn` with `file`,
+/// copying `tables_per_step` tables per step (all of them if it is not
+/// positive) and calling `progress(status, remaining, total)` after each.
+pub(crate) fn restore(
+    py: Python<'_>,
+    conn: &Arc<ConnectionGuard>,
+    file: &SnapshotFile,
+    tables_per_step: i32,
+    progress: Option<&PyAny>,
+) -> PyResult<()> {
+    check_supported(conn, "Restoring")?;
+    if !conn.is_autocommit() {
+        return Err(PyValueError::new_err(
+            "Cannot restore a database inside a transaction",
+        ));
+    }
+    let runtime = conn.runtime.clone();
+    let path = file.path();
+    let guard = conn.clone();
+    let tables = block_on(py, &runtime, async move {
+        let attach = format!("ATTACH DATABASE ? AS {SNAPSHOT_SCHEMA}");
+        let params = libsql_core::params::Params::Positional(vec![path]);
+        guard.execute(&attach, params).await.map_err(to_py_err)?;
+        let tables = replace_schema(&guard).await;
+        if tables.is_err() {
+            abort(&guard).await;
+        }
+        tables
+    })??;
+    let result = copy_tables(py, conn, tables, tables_per_step, progress);
+    let guard = conn.clone();
+    block_on(py, &runtime, async move {
+        let result = match result {
+            Ok(()) => create_schema(&guard, "s.type IN ('index', 'view', 'trigger')").await,
+            Err(err) => Err(err),
+        };
+        match result {
+            Ok(()) => {
+                let committed = guard.execute("COMMIT", ()).await.map_err(to_py_err);
+                if committed.is_err() {
+                    abort(&guard).await;
+                } else {
+                    detach(&guard).await;
+                }
+                committed.map(|_| ())
+            }
+            Err(err) => {
+                abort(&guard).await;
+                Err(err)
+            }
+        }
+    })?
+}
+
+fn copy_tables(
+    py: Python<'_>,
+    conn: &Arc<ConnectionGuard>,
+    tables: Vec<TableCopy>,
+    tables_per_step: i32,
+    progress: Option<&PyAny>,
+) -> PyResult<()> {
+    let total = tables.len();
+    let step = match usize::try_from(tables_per_step) {
+        Ok(step) if step > 0 => step,
+        _ => total.max(1),
+    };
+    let mut copied = 0;
+    for chunk in tables.chunks(step) {
+        let guard = conn.clone();
+        copied += chunk.len();
+        let chunk = chunk.to_vec();
+        block_on(py, &conn.runtime, async move {
+            for copy in chunk {
+                let table = quote_identifier(&copy.table);
+                if copy.clear {
+                    let sql = format!("DELETE FROM main.{table}");
+                    guard.execute(&sql, ()).await.map_err(to_py_err)?;
+                }
+                let columns = &copy.columns;
+                let sql = format!(
+                    "INSERT INTO main.{table} ({columns}) \
+                     SELECT {columns} FROM {SNAPSHOT_SCHEMA}.{table}"
+                );
+                guard.execute(&sql, ()).await.map_err(to_py_err)?;
+            }
+            Ok::<_, PyErr>(())
+        })??;
+        if let Some(progress) = progress {
+            progress.call1((0, total - copied, total))?;
+        }
+    }
+    Ok(())
+}
+
+/// Drops the tables and views of the main database and creates the tables
+/// of the attached snapshot in a new transaction. Returns the tables to
+/// copy.
+async fn replace_schema(conn: &ConnectionGuard) -> PyResult<Vec<TableCopy>> {
+    conn.execute("BEGIN IMMEDIATE", ())
+        .await
+        .map_err(to_py_err)?;
+    // Dropping a parent table must not trip over the rows of its children,
+    // which are replaced too.
+    conn.execute("PRAGMA defer_foreign_keys = ON", ())
+        .await
+        .map_err(to_py_err)?;
+    // Shadow tables go away with their virtual table, and views before
+    // the tables they select from.
+    let existing = query(
+        conn,
+        "SELECT type, name FROM pragma_table_list \
+         WHERE schema = 'main' AND type IN ('view', 'virtual', 'table') \
+         AND name NOT LIKE 'sqlite_%' \
+         ORDER BY type = 'table', type = 'virtual'",
+    )
+    .await?;
+    for row in existing {
+        let kind = if row[0] == "view" { "VIEW" } else { "TABLE" };
+        let sql = format!("DROP {kind} IF EXISTS main.{}", quote_identifier(&row[1]));
+        conn.execute(&sql, ()).await.map_err(to_py_err)?;
+    }
+    create_schema(conn, "s.type = 'table'").await?;
+    let kinds: HashMap<String, String> = query(
+        conn,
+        &format!(
+            "SELECT name, type FROM pragma_table_list \
+             WHERE schema = {}",
+            quote_literal(SNAPSHOT_SCHEMA)
+        ),
+    )
+    .await?
+    .into_iter()
+    .map(|row| (row[0].clone(), row[1].clone()))
+    .collect();
+    let tables = query(
+        conn,
+        &format!(
+            "SELECT name FROM {SNAPSHOT_SCHEMA}.sqlite_schema \
+             WHERE type = 'table' AND (name NOT LIKE 'sqlite_%' OR name = 'sqlite_sequence') \
+             ORDER BY rowid"
+        ),
+    )
+    .await?;
+    let mut copies = vec![];
+    for row in tables {
+        let table = &row[0];
+        // The rows of a virtual table live in its shadow tables, if it has
+        // any, which creating it has set up afresh.
+        let clear = match kinds.get(table).map(String::as_str) {
+            Some("virtual") => continue,
+            Some("shadow") => true,
+            _ => table == "sqlite_sequence",
+        };
+        let columns = query(
+            conn,
+            &format!(
+                "SELECT name FROM pragma_table_xinfo({}, {}) WHERE hidden = 0 ORDER BY cid",
+                quote_literal(table),
+                quote_literal(SNAPSHOT_SCHEMA)
+            ),
+        )
+        .await?;
+        let columns: Vec<String> = columns
+            .iter()
+            .map(|row| quote_identifier(&row[0]))
+            .collect();
+        copies.push(TableCopy {
+            table: table.clone(),
+            columns: columns.join(", "),
+            clear,
+        });
+    }
+    Ok(copies)
+}
+
+/// Creates the objects of the attached snapshot that match `filter`, in the
+/// order they were created there. Tables created as shadow tables of a
+/// virtual table are left to the virtual table.
+async fn create_schema(conn: &ConnectionGuard, filter: &str) -> PyResult<()> {
+    let schema = query(
+        conn,
+        &format!(
+            "SELECT s.sql FROM {SNAPSHOT_SCHEMA}.sqlite_schema AS s \
+             LEFT JOIN pragma_table_list AS t ON t.schema = {} AND t.name = s.name \
+             WHERE s.sql IS NOT NULL AND s.name NOT LIKE 'sqlite_%' \
+             AND ({filter}) AND coalesce(t.type, '') <> 'shadow' \
+             ORDER BY CASE s.type WHEN 'index' THEN 1 WHEN 'view' THEN 2 \
+             WHEN 'trigger' THEN 3 ELSE 0 END, s.rowid",
+            quote_literal(SNAPSHOT_SCHEMA)
+        ),
+    )
+    .await?;
+    for row in schema {
+        conn.execute(&row[0], ()).await.map_err(to_py_err)?;
+    }
+    Ok(())
+}
+
+/// Returns the rows of `sql` with their values as text.
+async fn query(conn: &ConnectionGuard, sql: &str) -> PyResult<Vec<Vec<String>>> {
+    let mut rows = conn.query(sql, ()).await.map_err(to_py_err)?;
+    let mut values: Vec<Vec<libsql_core::Value>> = vec![];
+    read_rows(&mut rows, usize::MAX, &mut values).await?;
+    Ok(values
+        .into_iter()
+        .map(|row| {
+            row.into_iter()
+                .map(|value| match value {
+                    libsql_core::Value::Text(text) => text,
+                    _ => String::new(),
+                })
+                .collect()
+        })
+        .collect())
+}
+
+async fn abort(conn: &ConnectionGuard) {
+    if !conn.is_autocommit() {
+        let _ = conn.execute("ROLLBACK", ()).await;
+    }
+    detach(conn).await;
+}
+
+async fn detach(conn: &ConnectionGuard) {
+    let _ = conn
+        .execute(&format!("DETACH DATABASE {SNAPSHOT_SCHEMA}"), ())
+        .await;
+}
@@ -0,0 +1,368 @@
+//! A small SQL lexer.
+//!
+//! It only tells apart what this crate needs to look at: string literals,
+//! quoted identifiers and comments are returned as single tokens, so that
+//! placeholders, keywords and statement separators are only recognized
+//! where SQLite would recognize them.
+
+use ::libsql as libsql_core;
+use pyo3::exceptions::PyValueError;
+use pyo3::prelude::*;
+use std::collections::HashMap;
+use std::fmt::Write;
+
+#[derive(Clone, Copy, Debug, PartialEq, Eq)]
+pub(crate) enum TokenKind {
+    Space,
+    Comment,
+    /// A keyword, identifier or number.
+    Word,
+    /// A quoted identifier.
+    Quoted,
+    /// A string or blob literal.
+    Literal,
+    Placeholder,
+    Semicolon,
+    Punct,
+}
+
+#[derive(Clone, Copy, Debug)]
+pub(crate) struct Token<'a> {
+    pub(crate) kind: TokenKind,
+    pub(crate) text: &'a str,
+}
+
+/// Splits SQL text into tokens.
+pub(crate) struct Lexer<'a> {
+    sql: &'a str,
+    pos: usize,
+}
+
+impl<'a> Lexer<'a> {
+    pub(crate) fn new(sql: &'a str) -> Self {
+        Lexer { sql, pos: 0 }
+    }
+
+    /// Returns the position right after the `close` that ends a quoted
+    /// token starting at `start`, treating a doubled `close` as escaped.
+    fn quoted_end(&self, start: usize, close: u8) -> usize {
+        let bytes = self.sql.as_bytes();
+        let mut pos = start + 1;
+        while pos < bytes.len() {
+            if bytes[pos] == close {
+                if close != b']' && bytes.get(pos + 1) == Some(&close) {
+                    pos += 2;
+                    continue;
+                }
+                return pos + 1;
+            }
+            pos += 1;
+        }
+        bytes.len()
+    }
+
+    fn word_end(&self, start: usize) -> usize {
+        let bytes = self.sql.as_bytes();
+        let mut pos = start;
+        while pos < bytes.len() && is_word_byte(bytes[pos]) {
+            pos += 1;
+        }
+        pos
+    }
+}
+
+/// Bytes that may appear in identifiers. Non-ASCII bytes are identifier
+/// characters in SQLite, which also keeps multi-byte characters whole.
+fn is_word_byte(byte: u8) -> bool {
+    byte.is_ascii_alphanumeric() || byte == b'_' || byte == b'$' || byte >= 0x80
+}
+
+impl<'a> Iterator for Lexer<'a> {
+    type Item = Token<'a>;
+
+    fn next(&mut self) -> Option<Token<'a>> {
+        let bytes = self.sql.as_bytes();
+        let start = self.pos;
+        let byte = *bytes.get(start)?;
+        let next = bytes.get(start + 1).copied();
+        let (kind, end) = match byte {
+            b' ' | b'\t' | b'\n' | b'\r' | b'\x0c' => {
+                let mut end = start + 1;
+                while end < bytes.len()
+                    && matches!(bytes[end], b' ' | b'\t' | b'\n' | b'\r' | b'\x0c')
+                {
+                    end += 1;
+                }
+                (TokenKind::Space, end)
+            }
+            b'-' if next == Some(b'-') => {
+                let end = match self.sql[start..].find('\n') {
+                    Some(offset) => start + offset,
+                    None => bytes.len(),
+                };
+                (TokenKind::Comment, end)
+            }
+            b'/' if next == Some(b'*') => {
+                let end = match self.sql[start + 2..].find("*/") {
+                    Some(offset) => start + 2 + offset + 2,
+                    None => bytes.len(),
+                };
+                (TokenKind::Comment, end)
+            }
+            b'\'' => (TokenKind::Literal, self.quoted_end(start, b'\'')),
+            b'x' | b'X' if next == Some(b'\'') => {
+                (TokenKind::Literal, self.quoted_end(start + 1, b'\''))
+            }
+            b'"' => (TokenKind::Quoted, self.quoted_end(start, b'"')),
+            b'`' => (TokenKind::Quoted, self.quoted_end(start, b'`')),
+            b'[' => (TokenKind::Quoted, self.quoted_end(start, b']')),
+            b'?' => {
+                let mut end = start + 1;
+                while end < bytes.len() && bytes[end].is_ascii_digit() {
+                    end += 1;
+                }
+                (TokenKind::Placeholder, end)
+            }
+            b':' | b'@' | b'$' if next.map_or(false, is_word_byte) => {
+                (TokenKind::Placeholder, self.word_end(start + 1))
+            }
+            b';' => (TokenKind::Semicolon, start + 1),
+            byte if is_word_byte(byte) => (TokenKind::Word, self.word_end(start)),
+            _ => (TokenKind::Punct, start + 1),
+        };
+        self.pos = end;
+        Some(Token {
+            kind,
+            text: &self.sql[start..end],
+        })
+    }
+}
+
+/// Returns whether `sql` is an `INSERT`, `UPDATE`, `DELETE` or `REPLACE`
+/// statement, the statements that open an implicit transaction.
+pub(crate) fn is_dml(sql: &str) -> bool {
+    statement_keyword(sql).map_or(false, |keyword| {
+        ["INSERT", "UPDATE", "DELETE", "REPLACE"]
+            .iter()
+            .any(|dml| keyword.eq_ignore_ascii_case(dml))
+    })
+}
+
+/// Returns whether `sql` is a `CREATE`, `ALTER` or `DROP` statement, the
+/// statements that change the schema.
+pub(crate) fn is_ddl(sql: &str) -> bool {
+    statement_keyword(sql).map_or(false, |keyword| {
+        ["CREATE", "ALTER", "DROP"]
+            .iter()
+            .any(|ddl| keyword.eq_ignore_ascii_case(ddl))
+    })
+}
+
+/// Returns whether `sql` is a `SELECT` or `VALUES` statement.
+pub(crate) fn is_query(sql: &str) -> bool {
+    statement_keyword(sql).map_or(false, |keyword| {
+        keyword.eq_ignore_ascii_case("SELECT") || keyword.eq_ignore_ascii_case("VALUES")
+    })
+}
+
+/// Returns the keyword that tells what kind of statement `sql` is. Leading
+/// comments are skipped, and for a statement with a `WITH` clause the
+/// first keyword after the common table expressions decides.
+fn statement_keyword(sql: &str) -> Option<&str> {
+    let mut depth = 0usize;
+    let mut with = false;
+    for token in Lexer::new(sql) {
+        match token.kind {
+            TokenKind::Space | TokenKind::Comment => {}
+            TokenKind::Punct if token.text == "(" => depth += 1,
+            TokenKind::Punct if token.text == ")" => depth = depth.saturating_sub(1),
+            TokenKind::Word if depth == 0 => {
+                let word = token.text;
+                if !with && word.eq_ignore_ascii_case("WITH") {
+                    with = true;
+                } else if !with
+                    || ["SELECT", "VALUES", "INSERT", "UPDATE", "DELETE", "REPLACE"]
+                        .iter()
+                        .any(|keyword| word.eq_ignore_ascii_case(keyword))
+                {
+                    return Some(word);
+                }
+            }
+            TokenKind::Semicolon => return None,
+            _ if !with => return None,
+            _ => {}
+        }
+    }
+    None
+}
+
+/// Returns `sql` without a trailing semicolon, raising `ValueError` if it
+/// holds more than one statement.
+pub(crate) fn single_statement(sql: &str) -> PyResult<&str> {
+    let mut offset = 0;
+    let mut end = None;
+    for token in Lexer::new(sql) {
+        match (token.kind, end) {
+            (TokenKind::Semicolon, None) => end = Some(offset),
+            (TokenKind::Space | TokenKind::Comment | TokenKind::Semicolon, _) | (_, None) => {}
+            _ => {
+                return Err(PyValueError::new_err(
+                    "You can only execute one statement at a time.",
+                ))
+            }
+        }
+        offset += token.text.len();
+    }
+    Ok(&sql[..end.unwrap_or(sql.len())])
+}
+
+/// Returns `sql` with its placeholders replaced by `params` rendered as SQL
+/// literals, and its comments replaced by spaces.
+///
+/// Placeholders are numbered the way SQLite numbers them: `?NNN` takes
+/// index NNN, and `?` and every new name take the next unused index.
+pub(crate) fn inline_params(sql: &str, params: &libsql_core::params::Params) -> PyResult<String> {
+    let mut out = String::with_capacity(sql.len());
+    let mut names: HashMap<&str, usize> = HashMap::new();
+    let named: HashMap<&str, &libsql_core::Value> = match params {
+        libsql_core::params::Params::Named(values) => values
+            .iter()
+            .map(|(key, value)| (key.as_str(), value))
+            .collect(),
+        _ => HashMap::new(),
+    };
+    let mut max_index = 0;
+    for token in Lexer::new(sql) {
+        match token.kind {
+            TokenKind::Comment => out.push(' '),
+            TokenKind::Placeholder => {
+                let index = match token.text.as_bytes()[0] {
+                    b'?' if token.text.len() > 1 => token.text[1..]
+                        .parse::<usize>()
+                        .map_err(|_| PyValueError::new_err("Invalid parameter index"))?,
+                    b'?' => max_index + 1,
+                    _ => match names.get(token.text) {
+                        Some(index) => *index,
+                        None => {
+                            names.insert(token.text, max_index + 1);
+                            max_index + 1
+                        }
+                    },
+                };
+                max_index = max_index.max(index);
+                push_literal(&mut out, param_value(token.text, index, params, &named)?);
+            }
+            _ => out.push_str(token.text),
+        }
+    }
+    Ok(out)
+}
+
+/// Returns the value bound to a placeholder. `named` maps the names of
+/// named parameters to their values.
+fn param_value<'p>(
+    placeholder: &str,
+    index: usize,
+    params: &'p libsql_core::params::Params,
+    named: &HashMap<&str, &'p libsql_core::Value>,
+) -> PyResult<&'p libsql_core::Value> {
+    if index == 0 {
+        return Err(PyValueError::new_err("Invalid parameter index"));
+    }
+    match params {
+        libsql_core::params::Params::Named(_) => {
+            if placeholder.starts_with('?') {
+                return Err(PyValueError::new_err(format!(
+                    "Binding {index} has no name, but you supplied a dictionary"
+                )));
+            }
+            let name = &placeholder[1..];
+            match named.get(name) {
+                Some(value) => Ok(*value),
+                None => Err(PyValueError::new_err(format!(
+                    "You did not supply a value for binding parameter :{name}"
+                ))),
+            }
+        }
+        libsql_core::params::Params::Positional(values) => match values.get(index - 1) {
+            Some(value) => Ok(value),
+            None => Err(PyValueError::new_err(format!(
+                "Incorrect number of bindings supplied. There are {} supplied.",
+                values.len()
+            ))),
+        },
+        libsql_core::params::Params::None => Err(PyValueError::new_err(
+            "Incorrect number of bindings supplied. There are 0 supplied.",
+        )),
+    }
+}
+
+/// Appends `value` to `out` as a SQL literal.
+fn push_literal(out: &mut String, value: &libsql_core::Value) {
+    match value {
+        libsql_core::Value::Null => out.push_str("NULL"),
+        // Negative numbers are parenthesized: after a `-`, as in `1-?`, a
+        // bare minus sign would start a `--` comment.
+        // The literal 9223372036854775808 would overflow before negation.
+        libsql_core::Value::Integer(i64::MIN) => out.push_str("(-9223372036854775807-1)"),
+        libsql_core::Value::Integer(value) if *value < 0 => write!(out, "({value})").unwrap(),
+        libsql_core::Value::Integer(value) => write!(out, "{value}").unwrap(),
+        // SQLite stores NaN as NULL and reads out-of-range reals as infinity.
+        libsql_core::Value::Real(value) if value.is_nan() => out.push_str("NULL"),
+        libsql_core::Value::Real(value) if value.is_infinite() => {
+            out.push_str(if *value > 0.0 { "9e999" } else { "(-9e999)" })
+        }
+        libsql_core::Value::Real(value) if value.is_sign_negative() => {
+            write!(out, "({value:?})").unwrap()
+        }
+        libsql_core::Value::Real(value) => write!(out, "{value:?}").unwrap(),
+        libsql_core::Value::Text(value) if value.contains('\0') => {
+            out.push_str("CAST(");
+            push_blob(out, value.as_bytes());
+            out.push_str(" AS TEXT)");
+        }
+        libsql_core::Value::Text(value) => {
+            out.push('\'');
+            out.push_str(&value.replace('\'', "''"));
+            out.push('\'');
+        }
+        libsql_core::Value::Blob(value) => push_blob(out, value),
+    }
+}
+
+fn push_blob(out: &mut String, value: &[u8]) {
+    out.push_str("X'");
+    for byte in value {
+        write!(out, "{byte:02X}").unwrap();
+    }
+    out.push('\'');
+}
+
+/// Returns `sql` with literals replaced by `?` and whitespace and comments
+/// collapsed to single spaces, so that statements that differ only in
+/// their constants are profiled together.
+pub(crate) fn normalize(sql: &str) -> String {
+    let mut out = String::with_capacity(sql.len());
+    for token in Lexer::new(sql) {
+        match token.kind {
+            TokenKind::Space | TokenKind::Comment => {
+                if !out.is_empty() && !out.ends_with(' ') {
+                    out.push(' ');
+                }
+            }
+            TokenKind::Literal => out.push('?'),
+            // The lexer splits `1.5` at the dot; fold it back into one `?`.
+            TokenKind::Word if token.text.as_bytes()[0].is_ascii_digit() => {
+                if out.ends_with("?.") {
+                    out.pop();
+                } else {
+                    out.push('?');
+                }
+            }
+            _ => out.push_str(token.text),
+        }
+    }
+    let len = out.trim_end_matches([' ', ';']).len();
+    out.truncate(len);
+    out
+}
@@ -0,0 +1,336 @@
+use crate::converters::{self, Converters};
+use crate::row::RowIndex;
+use crate::sql;
+use crate::trace::Execution;
+use crate::{PARSE_COLNAMES, PARSE_DECLTYPES};
+use ::libsql as libsql_core;
+use pyo3::exceptions::PyValueError;
+use pyo3::prelude::*;
+use pyo3::types::PyTuple;
+use std::cell::{OnceCell, RefCell};
+use std::collections::{BTreeMap, HashMap};
+use std::sync::Arc;
+
+/// A prepared statement together with the SQL text it was prepared from.
+///
+/// Cursors check entries out of the per-connection `StatementCache` while
+/// they are executing or iterating over them and hand them back once they
+/// are done, so a statement is never shared between two live result sets.
+pub(crate) struct CachedStatement {
+    pub(crate) sql: String,
+    pub(crate) stmt: libsql_core::Statement,
+    /// Parameter names without their `:`, `@` or `$` prefix, in parameter
+    /// order, looked up the first time named parameters are bound.
+    param_names: OnceCell<Vec<Option<String>>>,
+    /// The connection's `detect_types` flags.
+    detect_types: i32,
+    /// Result column names and declared types.
+    columns: OnceCell<Columns>,
+    /// `Cursor.description`, built on first access and reused by every
+    /// later execution of the statement.
+    description: OnceCell<Py<PyTuple>>,
+    /// Column names shared by every `libsql.Row` the statement produces.
+    row_index: OnceCell<Arc<RowIndex>>,
+    /// Converters of the result columns, together with the converter
+    /// registry generation they were resolved against.
+    converters: RefCell<Option<(u64, Option<Arc<Converters>>)>>,
+    /// The SQL text the profiler groups the statement under.
+    normalized_sql: OnceCell<String>,
+    /// Timings of the statement since it was checked out.
+    pub(crate) execution: Execution,
+    /// Whether the statement opens an implicit transaction.
+    pub(crate) is_dml: bool,
+    /// The schema generation of the cache the statement was prepared for.
+    generation: u64,
+}
+
+/// Result column metadata of a statement.
+pub(crate) struct Columns {
+    /// Column names, with any `[type]` suffix removed under
+    /// `PARSE_COLNAMES`.
+    pub(crate) names: Vec<String>,
+    /// Declared types of columns that come straight from a table column.
+    pub(crate) decltypes: Vec<Option<String>>,
+    /// Names of the converters that apply to each column under
+    /// `detect_types`.
+    pub(crate) converter_names: Vec<Option<String>>,
+}
+
+impl CachedStatement {
+    pub(crate) fn new(sql: String, stmt: libsql_core::Statement, detect_types: i32) -> Self {
+        let is_dml = sql::is_dml(&sql);
+        CachedStatement {
+            sql,
+            stmt,
+            param_names: OnceCell::new(),
+            detect_types,
+            columns: OnceCell::new(),
+            description: OnceCell::new(),
+            row_index: OnceCell::new(),
+            converters: RefCell::new(None),
+            normalized_sql: OnceCell::new(),
+            execution: Execution::default(),
+            is_dml,
+            generation: 0,
+        }
+    }
+
+    pub(crate) fn columns(&self) -> &Columns {
+        self.columns.get_or_init(|| {
+            let columns = self.stmt.columns();
+            let names = columns
+                .iter()
+                .map(|column| match self.detect_types & PARSE_COLNAMES {
+                    0 => column.name().to_string(),
+                    _ => strip_colname_type(column.name()).to_string(),
+                })
+                .collect();
+            let decltypes = columns
+                .iter()
+                .map(|column| column.decl_type().map(str::to_string))
+                .collect();
+            let converter_names = columns
+                .iter()
+                .map(|column| {
+                    converters::converter_name(
+                        column.name(),
+                        column.decl_type(),
+                        self.detect_types & PARSE_COLNAMES != 0,
+                        self.detect_types & PARSE_DECLTYPES != 0,
+                    )
+                })
+                .collect();
+            Columns {
+                names,
+                decltypes,
+                converter_names,
+            }
+        })
+    }
+
+    /// Returns the DB-API description of the result columns. Under
+    /// `PARSE_DECLTYPES` the declared type goes into the `type_code` slot.
+    pub(crate) fn description(&self, py: Python<'_>) -> Py<PyTuple> {
+        self.description
+            .get_or_init(|| {
+                let columns = self.columns();
+                let elements =
+                    columns
+                        .names
+                        .iter()
+                        .zip(&columns.decltypes)
+                        .map(|(name, decltype)| {
+                            let type_code = match self.detect_types & PARSE_DECLTYPES {
+                                0 => None,
+                                _ => decltype.as_deref(),
+                            };
+                            let none = py.None();
+                            (name, type_code, &none, &none, &none, &none, &none).to_object(py)
+                        });
+                PyTuple::new(py, elements).into()
+            })
+            .clone_ref(py)
+    }
+
+    pub(crate) fn row_index(&self) -> Arc<RowIndex> {
+        self.row_index
+            .get_or_init(|| Arc::new(RowIndex::new(self.columns().names.clone())))
+            .clone()
+    }
+
+    /// Returns the converters to apply to fetched rows, or `None` if
+    /// `detect_types` is off or no column has a converter. They are looked
+    /// up again only after `register_converter()` has been called.
+    pub(crate) fn converters(&self, py: Python<'_>) -> Option<Arc<Converters>> {
+        if self.detect_types == 0 {
+            return None;
+        }
+        let generation = converters::generation();
+        let mut cached = self.converters.borrow_mut();
+        match cached.as_ref() {
+            Some((resolved, converters)) if *resolved == generation => converters.clone(),
+            _ => {
+                let converters = Converters::resolve(py, &self.columns().converter_names);
+                *cached = Some((generation, converters.clone()));
+                converters
+            }
+        }
+    }
+
+    pub(crate) fn normalized_sql(&self) -> &str {
+        self.normalized_sql
+            .get_or_init(|| sql::normalize(&self.sql))
+    }
+
+    /// Drops the column metadata if the statement no longer has as many
+    /// columns as it was built for, as after another connection altered a
+    /// table the statement reads. SQLite prepares the statement again, but
+    /// the metadata would stay stale.
+    pub(crate) fn check_columns(&mut self) {
+        let stale = match self.columns.get() {
+            Some(columns) => columns.names.len() != self.stmt.columns().len(),
+            None => false,
+        };
+        if stale {
+            self.columns.take();
+            self.description.take();
+            self.row_index.take();
+            self.converters.get_mut().take();
+        }
+    }
+
+    fn param_names(&self) -> &[Option<String>] {
+        self.param_names.get_or_init(|| {
+            (1..=self.stmt.parameter_count() as i32)
+                .map(|idx| {
+                    self.stmt
+                        .parameter_name(idx)
+                        .map(|name| name.trim_start_matches([':', '@', '$']).to_string())
+                })
+                .collect()
+        })
+    }
+
+    /// Turns named parameters into positional ones in the order the
+    /// statement expects them. Other parameters are returned unchanged.
+    pub(crate) fn bind(
+        &self,
+        params: libsql_core::params::Params,
+    ) -> PyResult<libsql_core::params::Params> {
+        let mut values: HashMap<String, libsql_core::Value> = match params {
+            libsql_core::params::Params::Named(values) => values.into_iter().collect(),
+            params => return Ok(params),
+        };
+        let mut params = Vec::with_capacity(values.len());
+        for (idx, name) in self.param_names().iter().enumerate() {
+            let name = match name {
+                Some(name) => name,
+                None => {
+                    return Err(PyValueError::new_err(format!(
+                        "Binding {} has no name, but you supplied a dictionary",
+                        idx + 1
+                    )))
+                }
+            };
+            match values.get_mut(name.as_str()) {
+                Some(value) => params.push(std::mem::replace(value, libsql_core::Value::Null)),
+                None => {
+                    return Err(PyValueError::new_err(format!(
+                        "You did not supply a value for binding parameter :{name}"
+                    )))
+                }
+            }
+        }
+        Ok(libsql_core::params::Params::Positional(params))
+    }
+}
+
+/// Strips a `[type]` suffix from a column name, like `sqlite3` does under
+/// `PARSE_COLNAMES`.
+fn strip_colname_type(name: &str) -> &str {
+    match name.find('[') {
+        Some(idx) => name[..idx].trim_end(),
+        None => name,
+    }
+}
+
+/// Per-connection LRU cache of prepared statements keyed by SQL text.
+pub(crate) struct StatementCache {
+    capacity: usize,
+    tick: u64,
+    /// Bumped whenever the connection changes the schema, which makes the
+    /// column metadata of every statement prepared before stale.
+    generation: u64,
+    entries: HashMap<String, (u64, CachedStatement)>,
+    /// The SQL text of every entry by the tick it was last returned at,
+    /// least recently used first.
+    order: BTreeMap<u64, String>,
+    hits: u64,
+    misses: u64,
+}
+
+impl StatementCache {
+    pub(crate) fn new(capacity: usize) -> Self {
+        StatementCache {
+            capacity,
+            tick: 0,
+            generation: 0,
+            entries: HashMap::with_capacity(capacity),
+            order: BTreeMap::new(),
+            hits: 0,
+            misses: 0,
+        }
+    }
+
+    /// Checks out the cached statement for `sql`, if there is one.
+    pub(crate) fn take(&mut self, sql: &str) -> Option<CachedStatement> {
+        match self.entries.remove(sql) {
+            Some((tick, entry)) => {
+                self.order.remove(&tick);
+                self.hits += 1;
+                Some(entry)
+            }
+            None => {
+                self.misses += 1;
+                None
+            }
+        }
+    }
+
+    /// Stamps a newly prepared statement with the current schema
+    /// generation.
+    pub(crate) fn prepared(&self, entry: &mut CachedStatement) {
+        entry.generation = self.generation;
+    }
+
+    /// Drops every statement prepared before the schema changed. Those that
+    /// are checked out are dropped when they are returned.
+    pub(crate) fn schema_changed(&mut self) {
+        self.generation += 1;
+        self.clear();
+    }
+
+    /// Returns a statement to the cache, evicting the least recently used
+    /// entry if the cache is full.
+    pub(crate) fn put(&mut self, mut entry: CachedStatement) {
+        if self.capacity == 0 || entry.generation != self.generation {
+            return;
+        }
+        entry.stmt.reset();
+        if !self.entries.contains_key(&entry.sql) && self.entries.len() >= self.capacity {
+            self.evict_lru();
+        }
+        self.tick += 1;
+        self.order.insert(self.tick, entry.sql.clone());
+        if let Some((tick, _)) = self.entries.insert(entry.sql.clone(), (self.tick, entry)) {
+            self.order.remove(&tick);
+        }
+    }
+
+    fn evict_lru(&mut self) {
+        if let Some((_, sql)) = self.order.pop_first() {
+            self.entries.remove(&sql);
+        }
+    }
+
+    pub(crate) fn clear(&mut self) {
+        self.entries.clear();
+        self.order.clear();
+    }
+
+    pub(crate) fn capacity(&self) -> usize {
+        self.capacity
+    }
+
+    pub(crate) fn len(&self) -> usize {
+        self.entries.len()
+    }
+
+    pub(crate) fn hits(&self) -> u64 {
+        self.hits
+    }
+
+    pub(crate) fn misses(&self) -> u64 {
+        self.misses
+    }
+}
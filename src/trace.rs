@@ -0,0 +1,276 @@
+//! Per-connection statement tracing and profiling.
+//!
+//! `set_trace_callback()` registers a callable that receives the SQL text
+//! of every statement a connection runs. The profiler, switched on with
+//! `set_profiler()`, aggregates the time statements spend being prepared,
+//! executed and fetched, keyed by their normalized SQL text.
+//!
+//! Statements accumulate their timings in `Execution` while a cursor holds
+//! them. The timings are added to the profile when the statement is handed
+//! back to the connection, so the hot paths only read the clock.
+
+use crate::statement_cache::CachedStatement;
+use ::libsql as libsql_core;
+use pyo3::prelude::*;
+use pyo3::types::{PyDict, PyList};
+use std::collections::HashMap;
+use std::sync::atomic::{AtomicBool, Ordering};
+use std::sync::Mutex;
+use std::time::Duration;
+
+/// What a statement did since it was checked out of the statement cache.
+#[derive(Default)]
+pub(crate) struct Execution {
+    pub(crate) runs: u64,
+    pub(crate) prepare: Duration,
+    pub(crate) execute: Duration,
+    pub(crate) fetch: Duration,
+    pub(crate) rows: u64,
+    pub(crate) bytes: u64,
+}
+
+impl Execution {
+    pub(crate) fn add_fetch(&mut self, elapsed: Duration, fetched: &Fetched) {
+        self.fetch += elapsed;
+        self.rows += fetched.rows;
+        self.bytes += fetched.bytes;
+    }
+}
+
+/// What one read off a result set returned.
+#[derive(Default)]
+pub(crate) struct Fetched {
+    /// Whether the result set is exhausted.
+    pub(crate) done: bool,
+    pub(crate) rows: u64,
+    pub(crate) bytes: u64,
+}
+
+/// Returns the number of bytes `value` holds, counting numbers as 8 bytes.
+pub(crate) fn value_size(value: &libsql_core::Value) -> usize {
+    match value {
+        libsql_core::Value::Null => 0,
+        libsql_core::Value::Integer(_) | libsql_core::Value::Real(_) => 8,
+        libsql_core::Value::Text(value) => value.len(),
+        libsql_core::Value::Blob(value) => value.len(),
+    }
+}
+
+/// Latencies in exponentially sized buckets: bucket `i` counts values in
+/// `(2^(i/8), 2^((i+1)/8)]` microseconds, which is the layout of an
+/// OpenTelemetry exponential histogram with scale 3. Quantiles read off it
+/// are within 5% of the true value.
+struct Histogram {
+    zero_count: u64,
+    counts: Vec<u64>,
+    max: Duration,
+}
+
+const HISTOGRAM_SCALE: i32 = 3;
+/// Index of the bucket that starts at 2^-10 microseconds, about 1ns.
+const HISTOGRAM_OFFSET: i32 = -10 << HISTOGRAM_SCALE;
+/// Buckets up to 2^40 microseconds, about 12 days.
+const HISTOGRAM_BUCKETS: usize = 50 << HISTOGRAM_SCALE;
+
+impl Histogram {
+    fn new() -> Self {
+        Histogram {
+            zero_count: 0,
+            counts: vec![0; HISTOGRAM_BUCKETS],
+            max: Duration::ZERO,
+        }
+    }
+
+    fn record(&mut self, value: Duration, count: u64) {
+        self.max = self.max.max(value);
+        let micros = value.as_secs_f64() * 1e6;
+        if micros <= 0.0 {
+            self.zero_count += count;
+            return;
+        }
+        let index = (micros.log2() * (1 << HISTOGRAM_SCALE) as f64).ceil() as i32 - 1;
+        let bucket = (index - HISTOGRAM_OFFSET).clamp(0, HISTOGRAM_BUCKETS as i32 - 1);
+        self.counts[bucket as usize] += count;
+    }
+
+    fn total(&self) -> u64 {
+        self.zero_count + self.counts.iter().sum::<u64>()
+    }
+
+    /// Returns the value below which a fraction `q` of the values lie, as
+    /// the geometric midpoint of the bucket it falls into.
+    fn quantile(&self, q: f64) -> Duration {
+        let total = self.total();
+        if total == 0 {
+            return Duration::ZERO;
+        }
+        let rank = ((q * total as f64).ceil() as u64).max(1);
+        let mut seen = self.zero_count;
+        if seen >= rank {
+            return Duration::ZERO;
+        }
+        for (bucket, count) in self.counts.iter().enumerate() {
+            seen += count;
+            if seen >= rank {
+                let index = bucket as i32 + HISTOGRAM_OFFSET;
+                let exponent = (index as f64 + 0.5) / (1 << HISTOGRAM_SCALE) as f64;
+                let micros = 2f64.powf(exponent);
+                return Duration::from_secs_f64(micros / 1e6).min(self.max);
+            }
+        }
+        self.max
+    }
+
+    /// Returns the histogram in the shape of an OpenTelemetry exponential
+    /// histogram data point, in microseconds.
+    fn to_dict<'py>(&self, py: Python<'py>) -> PyResult<&'py PyDict> {
+        let first = self.counts.iter().position(|count| *count > 0);
+        let last = self.counts.iter().rposition(|count| *count > 0);
+        let (offset, counts) = match (first, last) {
+            (Some(first), Some(last)) => {
+                (first as i32 + HISTOGRAM_OFFSET, &self.counts[first..=last])
+            }
+            _ => (0, &self.counts[..0]),
+        };
+        let histogram = PyDict::new(py);
+        histogram.set_item("unit", "us")?;
+        histogram.set_item("scale", HISTOGRAM_SCALE)?;
+        histogram.set_item("zero_count", self.zero_count)?;
+        histogram.set_item("offset", offset)?;
+        histogram.set_item("bucket_counts", counts)?;
+        Ok(histogram)
+    }
+}
+
+/// Aggregated statistics of one normalized SQL text.
+struct StatementProfile {
+    count: u64,
+    rows: u64,
+    bytes: u64,
+    prepare: Duration,
+    execute: Duration,
+    fetch: Duration,
+    latency: Histogram,
+}
+
+#[derive(Default)]
+struct Profiler {
+    statements: HashMap<String, StatementProfile>,
+}
+
+/// The trace callback and profiler of a connection.
+#[derive(Default)]
+pub(crate) struct Tracer {
+    callback: Mutex<Option<PyObject>>,
+    profiling: AtomicBool,
+    profiler: Mutex<Profiler>,
+}
+
+impl Tracer {
+    pub(crate) fn set_callback(&self, callback: Option<PyObject>) {
+        *self.callback.lock().unwrap() = callback;
+    }
+
+    /// Passes `sql` to the trace callback, if there is one. Errors raised
+    /// by the callback are ignored, as `sqlite3` does by default.
+    pub(crate) fn trace(&self, py: Python<'_>, sql: &str) {
+        let callback = match self.callback.lock().unwrap().as_ref() {
+            Some(callback) => callback.clone_ref(py),
+            None => return,
+        };
+        let _ = callback.call1(py, (sql,));
+    }
+
+    pub(crate) fn set_profiling(&self, enabled: bool) {
+        self.profiling.store(enabled, Ordering::Relaxed);
+    }
+
+    pub(crate) fn is_profiling(&self) -> bool {
+        self.profiling.load(Ordering::Relaxed)
+    }
+
+    /// Switches tracing and profiling off and drops the profile, for
+    /// connections returned to a pool.
+    pub(crate) fn reset(&self) {
+        self.set_callback(None);
+        self.set_profiling(false);
+        self.profiler.lock().unwrap().statements.clear();
+    }
+
+    /// Adds what `entry` did to the profile and clears its timings.
+    pub(crate) fn finish(&self, entry: &mut CachedStatement) {
+        let execution = std::mem::take(&mut entry.execution);
+        if execution.runs == 0 || !self.is_profiling() {
+            return;
+        }
+        let sql = entry.normalized_sql();
+        let mut profiler = self.profiler.lock().unwrap();
+        if !profiler.statements.contains_key(sql) {
+            profiler.statements.insert(
+                sql.to_string(),
+                StatementProfile {
+                    count: 0,
+                    rows: 0,
+                    bytes: 0,
+                    prepare: Duration::ZERO,
+                    execute: Duration::ZERO,
+                    fetch: Duration::ZERO,
+                    latency: Histogram::new(),
+                },
+            );
+        }
+        let profile = profiler.statements.get_mut(sql).unwrap();
+        profile.count += execution.runs;
+        profile.rows += execution.rows;
+        profile.bytes += execution.bytes;
+        profile.prepare += execution.prepare;
+        profile.execute += execution.execute;
+        profile.fetch += execution.fetch;
+        // Statements run by executemany() contribute their average latency
+        // once per run.
+        let total = execution.prepare + execution.execute + execution.fetch;
+        let average = Duration::from_secs_f64(total.as_secs_f64() / execution.runs as f64);
+        profile.latency.record(average, execution.runs);
+    }
+
+    /// Returns the profile as one dict per normalized SQL text, slowest in
+    /// total first.
+    pub(crate) fn stats<'py>(
+        &self,
+        py: Python<'py>,
+        remote: bool,
+        reset: bool,
+    ) -> PyResult<&'py PyList> {
+        let mut profiler = self.profiler.lock().unwrap();
+        let mut statements: Vec<(&String, &StatementProfile)> =
+            profiler.statements.iter().collect();
+        statements.sort_by_key(|(_, profile)| {
+            std::cmp::Reverse(profile.prepare + profile.execute + profile.fetch)
+        });
+        let result = PyList::empty(py);
+        for (sql, profile) in statements {
+            let total = profile.prepare + profile.execute + profile.fetch;
+            let stats = PyDict::new(py);
+            stats.set_item("sql", sql)?;
+            stats.set_item("count", profile.count)?;
+            stats.set_item("rows", profile.rows)?;
+            stats.set_item("bytes", profile.bytes)?;
+            stats.set_item("prepare_seconds", profile.prepare.as_secs_f64())?;
+            stats.set_item("execute_seconds", profile.execute.as_secs_f64())?;
+            stats.set_item("fetch_seconds", profile.fetch.as_secs_f64())?;
+            // Every step of a statement on a remote database is a round trip.
+            let network = if remote { total } else { Duration::ZERO };
+            stats.set_item("network_seconds", network.as_secs_f64())?;
+            stats.set_item("total_seconds", total.as_secs_f64())?;
+            stats.set_item("p50_seconds", profile.latency.quantile(0.5).as_secs_f64())?;
+            stats.set_item("p99_seconds", profile.latency.quantile(0.99).as_secs_f64())?;
+            stats.set_item("max_seconds", profile.latency.max.as_secs_f64())?;
+            stats.set_item("histogram", profile.latency.to_dict(py)?)?;
+            result.append(stats)?;
+        }
+        if reset {
+            profiler.statements.clear();
+        }
+        Ok(result)
+    }
+}
@@ -0,0 +1,180 @@
+//! `Connection.transaction()` and the transactions connections open
+//! implicitly.
+//!
+//! Outermost transactions are libSQL transactions, begun with the locking
+//! behavior of the connection's `isolation_level` unless a mode is given,
+//! and kept on the connection until they are committed or rolled back.
+//! Transactions entered while another one is open are savepoints.
+
+use crate::{block_on, to_py_err, ConnectionGuard};
+use ::libsql as libsql_core;
+use libsql_core::TransactionBehavior;
+use pyo3::exceptions::PyValueError;
+use pyo3::prelude::*;
+use std::sync::atomic::Ordering;
+use std::sync::Arc;
+
+/// Parses an isolation level or transaction mode, case-insensitively.
+pub(crate) fn parse_behavior(mode: Option<&str>, name: &str) -> PyResult<TransactionBehavior> {
+    match mode.map(str::to_ascii_uppercase).as_deref() {
+        None | Some("") | Some("DEFERRED") => Ok(TransactionBehavior::Deferred),
+        Some("IMMEDIATE") => Ok(TransactionBehavior::Immediate),
+        Some("EXCLUSIVE") => Ok(TransactionBehavior::Exclusive),
+        _ => Err(PyValueError::new_err(format!(
+            "{name} must be 'DEFERRED', 'IMMEDIATE' or 'EXCLUSIVE'"
+        ))),
+    }
+}
+
+pub(crate) fn begin_sql(behavior: TransactionBehavior) -> &'static str {
+    match behavior {
+        TransactionBehavior::Immediate => "BEGIN IMMEDIATE",
+        TransactionBehavior::Exclusive => "BEGIN EXCLUSIVE",
+        _ => "BEGIN DEFERRED",
+    }
+}
+
+/// Begins a transaction on `conn` and keeps it on the connection.
+pub(crate) async fn begin(conn: &ConnectionGuard, behavior: TransactionBehavior) -> PyResult<()> {
+    // A transaction that was ended with plain SQL is dropped first; the
+    // connection is in autocommit mode, so this does not roll anything back.
+    drop(conn.transaction.lock().unwrap().take());
+    let tx = conn
+        .transaction_with_behavior(behavior)
+        .await
+        .map_err(to_py_err)?;
+    *conn.transaction.lock().unwrap() = Some(tx);
+    Ok(())
+}
+
+/// Commits or rolls back the transaction `conn` is in, through the libSQL
+/// transaction that began it if there is one.
+pub(crate) async fn finish(conn: &ConnectionGuard, commit: bool) -> PyResult<()> {
+    let tx = conn.transaction.lock().unwrap().take();
+    conn.savepoints.store(0, Ordering::Relaxed);
+    if conn.is_autocommit() {
+        drop(tx);
+        return Ok(());
+    }
+    let result = match (tx, commit) {
+        (Some(tx), true) => tx.commit().await,
+        (Some(tx), false) => tx.rollback().await,
+        (None, true) => conn.execute("COMMIT", ()).await.map(|_| ()),
+        (None, false) => conn.execute("ROLLBACK", ()).await.map(|_| ()),
+    };
+    result.map_err(to_py_err)
+}
+
+/// A transaction, or a savepoint if it is entered inside another one.
+///
+/// Leaving the `with` block commits it, or rolls it back if the block
+/// raised.
+#[pyclass(module = "libsql")]
+pub struct Transaction {
+    conn: Arc<ConnectionGuard>,
+    behavior: TransactionBehavior,
+    /// The savepoint this transaction is, once entered inside another one.
+    savepoint: Option<String>,
+}
+
+impl Transaction {
+    pub(crate) fn new(conn: Arc<ConnectionGuard>, behavior: TransactionBehavior) -> Self {
+        Transaction {
+            conn,
+            behavior,
+            savepoint: None,
+        }
+    }
+}
+
+#[pymethods]
+impl Transaction {
+    fn __enter__<'py>(
+        mut slf: PyRefMut<'py, Self>,
+        py: Python<'_>,
+    ) -> PyResult<PyRefMut<'py, Self>> {
+        let conn = slf.conn.clone();
+        if conn.is_autocommit() {
+            let behavior = slf.behavior;
+            conn.tracer.trace(py, begin_sql(behavior));
+            let guard = conn.clone();
+            block_on(
+                py,
+                &conn.runtime,
+                async move { begin(&guard, behavior).await },
+            )??;
+        } else {
+            let depth = conn.savepoints.fetch_add(1, Ordering::Relaxed);
+            let name = format!("libsql_savepoint_{depth}");
+            let sql = format!("SAVEPOINT {name}");
+            conn.tracer.trace(py, &sql);
+            let guard = conn.clone();
+            let saved = block_on(
+                py,
+                &conn.runtime,
+                async move { guard.execute(&sql, ()).await },
+            )?;
+            if let Err(err) = saved {
+                conn.savepoints.fetch_sub(1, Ordering::Relaxed);
+                return Err(to_py_err(err));
+            }
+            slf.savepoint = Some(name);
+        }
+        Ok(slf)
+    }
+
+    fn __exit__(
+        &mut self,
+        py: Python<'_>,
+        exc_type: Option<&PyAny>,
+        _exc_value: Option<&PyAny>,
+        _traceback: Option<&PyAny>,
+    ) -> PyResult<bool> {
+        let commit = exc_type.is_none();
+        let conn = self.conn.clone();
+        match self.savepoint.take() {
+            Some(name) => {
+                // commit() or rollback() inside the block already ended the
+                // transaction, savepoints included.
+                if conn.is_autocommit() {
+                    return Ok(false);
+                }
+                conn.savepoints.fetch_sub(1, Ordering::Relaxed);
+                let mut statements = vec![];
+                if !commit {
+                    statements.push(format!("ROLLBACK TO {name}"));
+                }
+                statements.push(format!("RELEASE {name}"));
+                for sql in &statements {
+                    conn.tracer.trace(py, sql);
+                }
+                let guard = conn.clone();
+                block_on(py, &conn.runtime, async move {
+                    for sql in statements {
+                        guard.execute(&sql, ()).await.map_err(to_py_err)?;
+                    }
+                    Ok::<_, PyErr>(())
+                })??;
+            }
+            None => {
+                if conn.is_autocommit() {
+                    return Ok(false);
+                }
+                conn.tracer
+                    .trace(py, if commit { "COMMIT" } else { "ROLLBACK" });
+                let guard = conn.clone();
+                let finished = block_on(py, &conn.runtime, async move {
+                    let result = finish(&guard, commit).await;
+                    // A commit that failed, for example on a busy database,
+                    // leaves the transaction open.
+                    if result.is_err() && !guard.is_autocommit() {
+                        let _ = guard.execute("ROLLBACK", ()).await;
+                    }
+                    result
+                })?;
+                finished?;
+            }
+        }
+        Ok(false)
+    }
+}
@@ -0,0 +1,244 @@
+//! Helpers for libSQL vector columns.
+//!
+//! libSQL stores a `F32_BLOB` value as the float32 components of the vector
+//! in little-endian byte order. `vector32()` and `executemany_vectors()`
+//! encode float32 or float64 buffers, such as NumPy arrays, and sequences
+//! of numbers in that format, so embeddings are bound as blobs instead of
+//! going through `vector('[...]')` text. `Cursor.fetch_vectors()` decodes a
+//! vector column of a result set into one two-dimensional float32 buffer
+//! while the GIL is released.
+
+use crate::columnar::{ColumnBuffer, Storage};
+use crate::statement_cache::Columns;
+use crate::{to_params, RowSink};
+use ::libsql as libsql_core;
+use pyo3::buffer::PyBuffer;
+use pyo3::exceptions::{PyIndexError, PyValueError};
+use pyo3::ffi;
+use pyo3::prelude::*;
+use pyo3::types::{PyBytes, PyLong, PyString};
+
+/// Encodes a one-dimensional float32 or float64 buffer, or a sequence of
+/// numbers, as a `F32_BLOB` value.
+#[pyfunction]
+pub(crate) fn vector32<'py>(py: Python<'py>, values: &PyAny) -> PyResult<&'py PyBytes> {
+    let (blob, shape) = read_vectors(values)?;
+    if shape.len() != 1 {
+        return Err(PyValueError::new_err(
+            "vector32() takes a one-dimensional vector",
+        ));
+    }
+    Ok(PyBytes::new(py, &blob))
+}
+
+/// Reads a vector or an array of vectors into the `F32_BLOB` encoding of
+/// its items in row-major order, together with its shape.
+fn read_vectors(values: &PyAny) -> PyResult<(Vec<u8>, Vec<usize>)> {
+    let py = values.py();
+    if unsafe { ffi::PyObject_CheckBuffer(values.as_ptr()) } != 0 {
+        if let Ok(buffer) = PyBuffer::<f32>::get(values) {
+            let blob = if cfg!(target_endian = "little") && buffer.is_c_contiguous() {
+                // The buffer already holds the encoded vectors.
+                unsafe {
+                    std::slice::from_raw_parts(buffer.buf_ptr() as *const u8, buffer.len_bytes())
+                }
+                .to_vec()
+            } else {
+                encode(buffer.to_vec(py)?)
+            };
+            return Ok((blob, buffer.shape().to_vec()));
+        }
+        if let Ok(buffer) = PyBuffer::<f64>::get(values) {
+            let blob = encode(buffer.to_vec(py)?.into_iter().map(|value| value as f32));
+            return Ok((blob, buffer.shape().to_vec()));
+        }
+        return Err(PyValueError::new_err(
+            "Vector buffers must hold float32 or float64 values",
+        ));
+    }
+    // An empty sequence is read as a single vector without dimensions.
+    if let Ok(values) = values.extract::<Vec<f64>>() {
+        let shape = vec![values.len()];
+        return Ok((encode(values.into_iter().map(|value| value as f32)), shape));
+    }
+    let rows = values.extract::<Vec<Vec<f64>>>()?;
+    let dim = rows.first().map_or(0, Vec::len);
+    if rows.iter().any(|row| row.len() != dim) {
+        return Err(PyValueError::new_err(
+            "All vectors must have the same number of dimensions",
+        ));
+    }
+    let shape = vec![rows.len(), dim];
+    let blob = encode(rows.into_iter().flatten().map(|value| value as f32));
+    Ok((blob, shape))
+}
+
+fn encode(values: impl IntoIterator<Item = f32>) -> Vec<u8> {
+    values
+        .into_iter()
+        .flat_map(|value| value.to_le_bytes())
+        .collect()
+}
+
+/// Converts the arguments of `executemany_vectors()` into one parameter set
+/// per vector: the values of the matching item of `parameters`, if given,
+/// followed by the vector.
+pub(crate) fn vector_params<'py>(
+    vectors: &'py PyAny,
+    parameters: Option<&'py PyAny>,
+) -> PyResult<impl Iterator<Item = PyResult<libsql_core::params::Params>> + 'py> {
+    let (blob, shape) = read_vectors(vectors)?;
+    let (rows, dim) = match shape[..] {
+        [rows, dim] => (rows, dim),
+        // An empty sequence holds no vectors.
+        [0] => (0, 0),
+        _ => {
+            return Err(PyValueError::new_err(
+                "vectors must be a two-dimensional array or a sequence of vectors",
+            ))
+        }
+    };
+    let mismatch = || PyValueError::new_err("vectors and parameters differ in length");
+    let mut parameters = match parameters {
+        Some(parameters) if !parameters.is_none() => {
+            if matches!(parameters.len(), Ok(len) if len != rows) {
+                return Err(mismatch());
+            }
+            Some(parameters.iter()?)
+        }
+        _ => None,
+    };
+    let row_size = dim * std::mem::size_of::<f32>();
+    let mut row = 0;
+    Ok(std::iter::from_fn(move || {
+        if row > rows {
+            return None;
+        }
+        row += 1;
+        let params = parameters.as_mut().map(|parameters| parameters.next());
+        if row > rows {
+            return match params {
+                Some(Some(_)) => Some(Err(mismatch())),
+                _ => None,
+            };
+        }
+        let mut values = match params {
+            None => vec![],
+            Some(None) => return Some(Err(mismatch())),
+            Some(Some(params)) => match params.and_then(|params| to_params(Some(params))) {
+                Ok(libsql_core::params::Params::Positional(values)) => values,
+                Ok(libsql_core::params::Params::None) => vec![],
+                Ok(libsql_core::params::Params::Named(_)) => {
+                    return Some(Err(PyValueError::new_err(
+                        "executemany_vectors() takes sequences of parameters",
+                    )))
+                }
+                Err(err) => return Some(Err(err)),
+            },
+        };
+        let vector = &blob[(row - 1) * row_size..row * row_size];
+        values.push(libsql_core::Value::Blob(vector.to_vec()));
+        Some(Ok(libsql_core::params::Params::Positional(values)))
+    }))
+}
+
+/// Returns the index of the result column selected by `column`, a column
+/// index or name. Defaults to the first column.
+pub(crate) fn column_index(columns: &Columns, column: Option<&PyAny>) -> PyResult<usize> {
+    let column = match column {
+        Some(column) if !column.is_none() => column,
+        _ => return Ok(0),
+    };
+    let index = if column.is_instance_of::<PyString>() {
+        let name = column.extract::<&str>()?;
+        columns.names.iter().position(|column| column == name)
+    } else if column.is_instance_of::<PyLong>() {
+        let index = column.extract::<isize>()?;
+        usize::try_from(index)
+            .ok()
+            .filter(|index| *index < columns.names.len())
+    } else {
+        return Err(PyValueError::new_err("column must be an index or a name"));
+    };
+    index.ok_or_else(|| PyIndexError::new_err("No such column"))
+}
+
+/// Collects the vectors of one result column into a float32 matrix.
+pub(crate) struct VectorsBuilder {
+    column: usize,
+    dim: Option<usize>,
+    rows: usize,
+    data: Vec<f32>,
+}
+
+impl VectorsBuilder {
+    pub(crate) fn new(column: usize) -> Self {
+        VectorsBuilder {
+            column,
+            dim: None,
+            rows: 0,
+            data: vec![],
+        }
+    }
+
+    /// Adds the vector in `value`, returning its size in bytes.
+    fn push(&mut self, value: libsql_core::Value) -> PyResult<usize> {
+        let blob = match value {
+            libsql_core::Value::Blob(blob) if blob.len() % 4 == 0 => blob,
+            libsql_core::Value::Null => {
+                return Err(PyValueError::new_err(format!(
+                    "Row {} holds NULL instead of a vector",
+                    self.rows
+                )))
+            }
+            _ => {
+                return Err(PyValueError::new_err(format!(
+                    "Row {} does not hold a float32 vector",
+                    self.rows
+                )))
+            }
+        };
+        let dim = blob.len() / 4;
+        match self.dim {
+            None => self.dim = Some(dim),
+            Some(expected) if expected != dim => {
+                return Err(PyValueError::new_err(format!(
+                    "Row {} holds a vector of {dim} dimensions, expected {expected}",
+                    self.rows
+                )))
+            }
+            Some(_) => {}
+        }
+        self.data.extend(
+            blob.chunks_exact(4)
+                .map(|chunk| f32::from_le_bytes(chunk.try_into().unwrap())),
+        );
+        self.rows += 1;
+        Ok(blob.len())
+    }
+
+    /// Returns the vectors as a buffer of shape `(rows, dimensions)`.
+    pub(crate) fn into_py(self, py: Python<'_>) -> PyResult<Py<ColumnBuffer>> {
+        let shape = vec![self.rows, self.dim.unwrap_or(0)];
+        Py::new(
+            py,
+            ColumnBuffer::with_shape(Storage::Float32(self.data), shape),
+        )
+    }
+}
+
+impl RowSink for VectorsBuilder {
+    fn push_row(&mut self, row: &libsql_core::Row, _column_count: i32) -> PyResult<usize> {
+        let value = row
+            .get_value(self.column as i32)
+            .map_err(crate::to_py_err)?;
+        self.push(value)
+    }
+
+    fn push_values(&mut self, row: Vec<libsql_core::Value>) -> PyResult<()> {
+        match row.into_iter().nth(self.column) {
+            Some(value) => self.push(value).map(|_| ()),
+            None => Err(PyIndexError::new_err("No such column")),
+        }
+    }
+}
@@ -0,0 +1,11 @@
+import hrana_server
+import pytest
+
+
+@pytest.fixture
+def remote_database(tmp_path):
+    """Serves a new database over Hrana and returns its URL."""
+    server = hrana_server.serve(str(tmp_path / "remote.db"))
+    yield server.url
+    server.shutdown()
+    server.server_close()
@@ -0,0 +1,324 @@
+#!/usr/bin/env python3
+"""Local stand-in for a libSQL server, used by the tests and the remote
+benchmarks.
+
+Serves the Hrana-over-HTTP protocol (the `/v2/pipeline`, `/v3/pipeline`
+and `/v3/cursor` endpoints) on top of a stdlib `sqlite3` database, so
+that the remote code paths of the binding can be tested and benchmarked
+without network latency or a running `sqld`. It implements what the client
+needs to execute statements, batches and transactions, and nothing more:
+it is not a conformant server.
+
+    python3 tests/hrana_server.py --port 8080 [--database bench-remote.db]
+"""
+
+import argparse
+import base64
+import http.server
+import itertools
+import json
+import sqlite3
+import threading
+import time
+
+
+class HranaError(Exception):
+    pass
+
+
+def decode_value(value):
+    kind = value["type"]
+    if kind == "null":
+        return None
+    if kind == "integer":
+        return int(value["value"])
+    if kind == "float":
+        return float(value["value"])
+    if kind == "text":
+        return value["value"]
+    if kind == "blob":
+        data = value["base64"]
+        return base64.b64decode(data + "=" * (-len(data) % 4))
+    raise HranaError(f"Unsupported value type {kind!r}")
+
+
+def encode_value(value):
+    if value is None:
+        return {"type": "null"}
+    if isinstance(value, int):
+        return {"type": "integer", "value": str(value)}
+    if isinstance(value, float):
+        return {"type": "float", "value": value}
+    if isinstance(value, str):
+        return {"type": "text", "value": value}
+    return {"type": "blob", "base64": base64.b64encode(value).decode().rstrip("=")}
+
+
+def encode_error(err):
+    return {"message": str(err), "code": "SQLITE_ERROR"}
+
+
+def split_statements(sql):
+    """Splits a script into complete statements."""
+    statements = []
+    current = ""
+    for part in sql.split(";"):
+        current += part + ";"
+        if sqlite3.complete_statement(current):
+            if current.strip(" \t\r\n;"):
+                statements.append(current)
+            current = ""
+    if current.strip(" \t\r\n;"):
+        statements.append(current)
+    return statements
+
+
+class Stream:
+    """A Hrana stream: one SQLite connection and its stored SQL texts."""
+
+    def __init__(self, path):
+        self.conn = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        self.sqls = {}
+        self.lock = threading.Lock()
+
+    def close(self):
+        self.conn.close()
+
+    def sql(self, stmt):
+        if stmt.get("sql") is not None:
+            return stmt["sql"]
+        try:
+            return self.sqls[stmt["sql_id"]]
+        except KeyError:
+            raise HranaError(f"Unknown SQL text id {stmt.get('sql_id')}") from None
+
+    def execute(self, stmt):
+        sql = self.sql(stmt)
+        if stmt.get("named_args"):
+            args = {
+                arg["name"].lstrip(":@$"): decode_value(arg["value"])
+                for arg in stmt["named_args"]
+            }
+        else:
+            args = [decode_value(arg) for arg in stmt.get("args") or []]
+        started = time.perf_counter()
+        try:
+            cursor = self.conn.execute(sql, args)
+            rows = cursor.fetchall() if stmt.get("want_rows", True) else []
+        except sqlite3.Error as err:
+            raise HranaError(err) from err
+        cols = [{"name": column[0], "decltype": None} for column in cursor.description or ()]
+        return {
+            "cols": cols,
+            "rows": [[encode_value(value) for value in row] for row in rows],
+            "affected_row_count": max(cursor.rowcount, 0),
+            "last_insert_rowid": str(cursor.lastrowid) if cursor.lastrowid else None,
+            "replication_index": None,
+            "rows_read": len(rows),
+            "rows_written": max(cursor.rowcount, 0),
+            "query_duration_ms": (time.perf_counter() - started) * 1000,
+        }
+
+    def condition(self, cond, results, errors):
+        kind = cond["type"]
+        if kind == "ok":
+            return results[cond["step"]] is not None
+        if kind == "error":
+            return errors[cond["step"]] is not None
+        if kind == "not":
+            return not self.condition(cond["cond"], results, errors)
+        if kind == "and":
+            return all(self.condition(c, results, errors) for c in cond["conds"])
+        if kind == "or":
+            return any(self.condition(c, results, errors) for c in cond["conds"])
+        if kind == "is_autocommit":
+            return not self.conn.in_transaction
+        raise HranaError(f"Unsupported condition {kind!r}")
+
+    def steps(self, batch):
+        """Runs the steps of a batch, yielding `(index, result, error)`."""
+        results, errors = [], []
+        for index, step in enumerate(batch["steps"]):
+            result = error = None
+            if step.get("condition") is None or self.condition(step["condition"], results, errors):
+                try:
+                    result = self.execute(step["stmt"])
+                except HranaError as err:
+                    error = encode_error(err)
+            results.append(result)
+            errors.append(error)
+            yield index, result, error
+
+    def request(self, request):
+        kind = request["type"]
+        if kind == "execute":
+            return {"type": "execute", "result": self.execute(request["stmt"])}
+        if kind == "batch":
+            results, errors = [], []
+            for _, result, error in self.steps(request["batch"]):
+                results.append(result)
+                errors.append(error)
+            return {
+                "type": "batch",
+                "result": {"step_results": results, "step_errors": errors},
+            }
+        if kind == "sequence":
+            sql = self.sql(request)
+            try:
+                for statement in split_statements(sql):
+                    self.conn.execute(statement)
+            except sqlite3.Error as err:
+                raise HranaError(err) from err
+            return {"type": "sequence"}
+        if kind == "describe":
+            try:
+                self.conn.execute("EXPLAIN " + self.sql(request)).fetchall()
+            except sqlite3.Error as err:
+                raise HranaError(err) from err
+            return {
+                "type": "describe",
+                "result": {"params": [], "cols": [], "is_explain": False, "is_readonly": False},
+            }
+        if kind == "store_sql":
+            self.sqls[request["sql_id"]] = request["sql"]
+            return {"type": "store_sql"}
+        if kind == "close_sql":
+            self.sqls.pop(request["sql_id"], None)
+            return {"type": "close_sql"}
+        if kind == "get_autocommit":
+            return {"type": "get_autocommit", "is_autocommit": not self.conn.in_transaction}
+        raise HranaError(f"Unsupported request {kind!r}")
+
+
+class Server(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, path):
+        super().__init__(address, Handler)
+        self.database = path
+        self.streams = {}
+        self.batons = (f"baton-{n}" for n in itertools.count())
+        self.lock = threading.Lock()
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def open_stream(self, baton):
+        """Returns the stream for `baton`, or a new stream if it is None."""
+        with self.lock:
+            if baton is None:
+                return Stream(self.database)
+            try:
+                return self.streams.pop(baton)
+            except KeyError:
+                raise HranaError("Unknown baton") from None
+
+    def keep_stream(self, stream):
+        """Parks an open stream and returns the baton to resume it with."""
+        with self.lock:
+            baton = next(self.batons)
+            self.streams[baton] = stream
+            return baton
+
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server: Server
+
+    def log_message(self, format, *args):
+        pass
+
+    def reply(self, status, body, content_type="application/json"):
+        data = body if isinstance(body, bytes) else json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path.rstrip("/") in ("", "/health", "/v2", "/v3", "/version"):
+            self.reply(200, b"", "text/plain")
+        else:
+            self.reply(404, {"error": "Not found"})
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        path = self.path.rstrip("/")
+        try:
+            stream = self.server.open_stream(body.get("baton"))
+        except HranaError as err:
+            self.reply(400, {"error": str(err)})
+            return
+        with stream.lock:
+            if path in ("/v2/pipeline", "/v3/pipeline"):
+                self.reply(200, self.pipeline(stream, body["requests"]))
+            elif path == "/v3/cursor":
+                self.reply(200, self.cursor(stream, body["batch"]), "text/plain")
+            else:
+                stream.close()
+                self.reply(404, {"error": "Not found"})
+
+    def finish_stream(self, stream, closed):
+        if closed:
+            stream.close()
+            return None
+        return self.server.keep_stream(stream)
+
+    def pipeline(self, stream, requests):
+        results = []
+        closed = False
+        for request in requests:
+            if request["type"] == "close":
+                closed = True
+                results.append({"type": "ok", "response": {"type": "close"}})
+                continue
+            try:
+                results.append({"type": "ok", "response": stream.request(request)})
+            except HranaError as err:
+                results.append({"type": "error", "error": encode_error(err)})
+        baton = self.finish_stream(stream, closed)
+        return {"baton": baton, "base_url": None, "results": results}
+
+    def cursor(self, stream, batch):
+        entries = []
+        for index, result, error in stream.steps(batch):
+            if error is not None:
+                entries.append({"type": "step_error", "step": index, "error": error})
+            elif result is not None:
+                entries.append({"type": "step_begin", "step": index, "cols": result["cols"]})
+                entries.extend({"type": "row", "row": row} for row in result["rows"])
+                entries.append(
+                    {
+                        "type": "step_end",
+                        "affected_row_count": result["affected_row_count"],
+                        "last_insert_rowid": result["last_insert_rowid"],
+                    }
+                )
+        baton = self.finish_stream(stream, False)
+        lines = [{"baton": baton, "base_url": None}] + entries
+        return "".join(json.dumps(line) + "\n" for line in lines).encode()
+
+
+def serve(path, host="127.0.0.1", port=0):
+    """Starts a server on a background thread and returns it."""
+    server = Server((host, port), path)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--database", default="bench-remote.db")
+    args = parser.parse_args()
+    server = Server((args.host, args.port), args.database)
+    print(f"Serving {args.database} at {server.url}")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
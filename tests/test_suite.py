@@ -1,10 +1,14 @@
 #!/usr/bin/env python3
 
+import array
+import datetime
 import sqlite3
+import struct
 import sys
 import libsql
 import pytest
 import tempfile
+import time
 
 @pytest.mark.parametrize("provider", ["libsql", "sqlite"])
 def test_connection_timeout(provider):
@@ -89,6 +93,24 @@ def test_cursor_fetchmany(provider):
     assert [] == res.fetchmany(2)
 
 
+@pytest.mark.parametrize("provider", ["libsql", "sqlite"])
+def test_cursor_iter(provider):
+    conn = connect(provider, ":memory:")
+    cur = conn.cursor()
+    cur.execute("CREATE TABLE users (id INTEGER, email TEXT)")
+    data = [(i, f"user{i}@example.com") for i in range(10)]
+    cur.executemany("INSERT INTO users VALUES (?, ?)", data)
+    assert [] == list(cur)
+    cur.arraysize = 3
+    res = cur.execute("SELECT id FROM users")
+    assert (0,) == next(res)
+    assert [(1,), (2,)] == res.fetchmany(2)
+    assert [(3,), (4,)] == [row for _, row in zip(range(2), res)]
+    assert [(i,) for i in range(5, 10)] == res.fetchall()
+    assert [] == list(res)
+    assert data == [row for row in cur.execute("SELECT * FROM users")]
+
+
 @pytest.mark.parametrize("provider", ["sqlite", "libsql"])
 def test_cursor_execute_blob(provider):
     conn = connect(provider, ":memory:")
@@ -99,6 +121,93 @@ def test_cursor_execute_blob(provider):
     assert (1, b"foobar") == res.fetchone()
 
 
+@pytest.mark.parametrize("provider", ["libsql", "sqlite"])
+def test_param_types(provider):
+    conn = connect(provider, ":memory:")
+    conn.execute("CREATE TABLE data (value)")
+    values = [2**40, -(2**63), True, 1.5, "foo", b"bar", bytearray(b"baz"), memoryview(b"qux")]
+    conn.executemany("INSERT INTO data VALUES (?)", [(value,) for value in values])
+    res = conn.execute("SELECT value, typeof(value) FROM data")
+    assert [
+        (2**40, "integer"),
+        (-(2**63), "integer"),
+        (1, "integer"),
+        (1.5, "real"),
+        ("foo", "text"),
+        (b"bar", "blob"),
+        (b"baz", "blob"),
+        (b"qux", "blob"),
+    ] == res.fetchall()
+
+
+@pytest.mark.parametrize("provider", ["libsql", "sqlite"])
+def test_named_params(provider):
+    conn = connect(provider, ":memory:")
+    conn.execute("CREATE TABLE users (id INTEGER, email TEXT)")
+    conn.execute(
+        "INSERT INTO users VALUES (:id, :email)", {"id": 1, "email": "alice@example.com"}
+    )
+    conn.executemany(
+        "INSERT INTO users VALUES (@id, $email)",
+        [{"email": "bob@example.com", "id": 2}, {"email": "carol@example.com", "id": 3}],
+    )
+    res = conn.execute("SELECT email FROM users WHERE id = :id OR id = :id + 1", {"id": 1})
+    assert [("alice@example.com",), ("bob@example.com",)] == res.fetchall()
+    res = conn.execute("SELECT email FROM users WHERE id = ?", [3])
+    assert ("carol@example.com",) == res.fetchone()
+    with pytest.raises(Exception):
+        conn.execute("SELECT :missing", {"id": 1})
+    names = [f"p{i}" for i in range(500)]
+    sql = "SELECT " + " + ".join(f":{name}" for name in reversed(names))
+    assert (sum(range(500)),) == conn.execute(sql, dict(zip(names, range(500)))).fetchone()
+
+
+@pytest.mark.parametrize("provider", ["libsql", "sqlite"])
+def test_register_adapter(provider):
+    class Point:
+        def __init__(self, x, y):
+            self.x, self.y = x, y
+
+    module = libsql if provider == "libsql" else sqlite3
+    key = Point if provider == "libsql" else (Point, sqlite3.PrepareProtocol)
+    module.register_adapter(Point, lambda point: f"{point.x};{point.y}")
+    try:
+        conn = connect(provider, ":memory:")
+        res = conn.execute("SELECT ?", (Point(1, 2),))
+        assert ("1;2",) == res.fetchone()
+    finally:
+        del module.adapters[key]
+    with pytest.raises(Exception):
+        conn.execute("SELECT ?", (Point(1, 2),))
+
+
+@pytest.mark.parametrize("provider", ["libsql", "sqlite"])
+def test_row_factory(provider):
+    module = libsql if provider == "libsql" else sqlite3
+    conn = connect(provider, ":memory:")
+    conn.execute("CREATE TABLE users (id INTEGER, email TEXT)")
+    conn.executemany(
+        "INSERT INTO users VALUES (?, ?)", [(1, "alice@example.com"), (2, "bob@example.com")]
+    )
+    conn.row_factory = module.Row
+    res = conn.execute("SELECT * FROM users")
+    row = res.fetchone()
+    assert isinstance(row, module.Row)
+    assert ["id", "email"] == row.keys()
+    assert (1, "alice@example.com") == (row[0], row["email"])
+    assert "alice@example.com" == row["EMAIL"] == row[-1]
+    assert [1, "alice@example.com"] == list(row)
+    assert {"id": 2, "email": "bob@example.com"} == dict(zip(row.keys(), res.fetchone()))
+    with pytest.raises(IndexError):
+        row["missing"]
+    cur = conn.cursor()
+    cur.row_factory = lambda cursor, row: {d[0]: v for d, v in zip(cursor.description, row)}
+    rows = cur.execute("SELECT * FROM users").fetchall()
+    assert [{"id": 1, "email": "alice@example.com"}, {"id": 2, "email": "bob@example.com"}] == rows
+    conn.row_factory = None
+    assert (1, "alice@example.com") == conn.execute("SELECT * FROM users").fetchone()
+
+
 @pytest.mark.parametrize("provider", ["libsql", "sqlite"])
 def test_cursor_executemany(provider):
     conn = connect(provider, ":memory:")
@@ -110,6 +219,30 @@ def test_cursor_executemany(provider):
     assert [(1, "alice@example.com"), (2, "bob@example.com")] == res.fetchall()
 
 
+@pytest.mark.parametrize("provider", ["libsql", "sqlite"])
+def test_executemany_iterable(provider):
+    conn = connect(provider, ":memory:")
+    conn.execute("CREATE TABLE users (id INTEGER, email TEXT)")
+    data = ([i, f"user{i}@example.com"] for i in range(2500))
+    cur = conn.executemany("INSERT INTO users VALUES (?, ?)", data)
+    assert cur.rowcount == 2500
+    conn.commit()
+    res = conn.execute("SELECT COUNT(*), MAX(id) FROM users")
+    assert (2500, 2499) == res.fetchone()
+
+
+@pytest.mark.parametrize("provider", ["libsql", "sqlite"])
+def test_executemany_autocommit_error(provider):
+    conn = connect(provider, ":memory:", isolation_level=None)
+    conn.execute("CREATE TABLE users (id INTEGER PRIMARY KEY, email TEXT)")
+    data = [(1, "alice@example.com"), (2, "bob@example.com"), (1, "carol@example.com")]
+    with pytest.raises(Exception):
+        conn.executemany("INSERT INTO users VALUES (?, ?)", data)
+    assert not conn.in_transaction
+    res = conn.execute("SELECT * FROM users")
+    assert [(1, "alice@example.com"), (2, "bob@example.com")] == res.fetchall()
+
+
 @pytest.mark.parametrize("provider", ["libsql", "sqlite"])
 def test_cursor_executescript(provider):
     conn = connect(provider, ":memory:")
@@ -295,6 +428,150 @@ def test_in_transaction(provider):
     assert conn.in_transaction == True
 
 
+@pytest.mark.parametrize(
+    "sql",
+    [
+        "-- comment\n insert INTO users VALUES (3, 'c')",
+        "/* comment */ REPLACE INTO users VALUES (3, 'c')",
+        "INSERT OR IGNORE INTO users VALUES (3, 'c')",
+        "WITH RECURSIVE n(i) AS (SELECT 3) INSERT INTO users SELECT i, 'c' FROM n",
+        "WITH ids AS (SELECT 1 AS id) DELETE FROM users WHERE id IN ids",
+    ],
+)
+def test_implicit_transaction_statements(sql):
+    conn = libsql.connect(":memory:")
+    conn.execute("CREATE TABLE users (id INTEGER PRIMARY KEY, email TEXT)")
+    conn.execute("INSERT INTO users VALUES (1, 'a')")
+    conn.commit()
+    conn.execute("WITH x AS (SELECT 1) SELECT replace('a', 'a', 'b') FROM x")
+    assert not conn.in_transaction
+    conn.execute(sql)
+    assert conn.in_transaction
+    conn.rollback()
+    assert [(1, "a")] == conn.execute("SELECT * FROM users").fetchall()
+
+
+def test_transaction():
+    conn = libsql.connect(":memory:", isolation_level=None)
+    conn.execute("CREATE TABLE users (id INTEGER, email TEXT)")
+    with conn.transaction():
+        conn.execute("INSERT INTO users VALUES (1, 'alice@example.com')")
+        assert conn.in_transaction
+        with pytest.raises(ZeroDivisionError):
+            with conn.transaction():
+                conn.execute("INSERT INTO users VALUES (2, 'bob@example.com')")
+                1 / 0
+        with conn.transaction():
+            conn.execute("INSERT INTO users VALUES (3, 'carol@example.com')")
+    assert not conn.in_transaction
+    with pytest.raises(ZeroDivisionError):
+        with conn.transaction(mode="exclusive"):
+            conn.execute("DELETE FROM users")
+            1 / 0
+    assert [(1,), (3,)] == conn.execute("SELECT id FROM users").fetchall()
+    with pytest.raises(ValueError):
+        conn.transaction(mode="eventually")
+
+
+def test_isolation_level_immediate():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = f"{tmpdir}/test.db"
+        conn = libsql.connect(path, isolation_level="IMMEDIATE")
+        conn.execute("CREATE TABLE users (id INTEGER, email TEXT)")
+        conn.commit()
+        other = libsql.connect(path, timeout=0, isolation_level="IMMEDIATE")
+        conn.execute("INSERT INTO users VALUES (1, 'alice@example.com')")
+        with pytest.raises(ValueError, match="locked"):
+            other.execute("INSERT INTO users VALUES (2, 'bob@example.com')")
+        conn.commit()
+        with conn.transaction():
+            # Begun immediately, so it holds the write lock before writing.
+            with pytest.raises(ValueError, match="locked"):
+                other.execute("INSERT INTO users VALUES (2, 'bob@example.com')")
+        other.close()
+        conn.close()
+    with pytest.raises(ValueError):
+        libsql.connect(":memory:", isolation_level="SOMETIMES")
+
+
+def test_busy_handler():
+    import threading
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = f"{tmpdir}/test.db"
+        conn = libsql.connect(path)
+        conn.execute("CREATE TABLE users (id INTEGER, email TEXT)")
+        conn.commit()
+        other = libsql.connect(path, isolation_level="IMMEDIATE")
+        other.set_busy_handler(timeout=0.2, initial_delay=0.01, max_delay=0.05)
+        conn.execute("INSERT INTO users VALUES (1, 'alice@example.com')")
+        with pytest.raises(ValueError, match="locked"):
+            other.execute("INSERT INTO users VALUES (2, 'bob@example.com')")
+        stats = other.busy_stats(reset=True)
+        assert stats["waits"] == 1
+        assert stats["retries"] >= 2
+        assert stats["timeouts"] == 1
+        assert 0.1 < stats["blocked_seconds"] <= stats["max_wait_seconds"] < 1.0
+
+        other.set_busy_handler(timeout=5.0)
+        threading.Timer(0.1, conn.commit).start()
+        other.execute("INSERT INTO users VALUES (2, 'bob@example.com')")
+        other.commit()
+        stats = other.busy_stats()
+        assert stats["waits"] == 1
+        assert stats["timeouts"] == 0
+        assert [(2,)] == other.execute("SELECT COUNT(*) FROM users").fetchall()
+        with pytest.raises(ValueError):
+            other.set_busy_handler(initial_delay=0)
+        other.close()
+        conn.close()
+
+
+@pytest.mark.parametrize("provider", ["libsql", "sqlite"])
+def test_blobopen(provider):
+    conn = connect(provider, ":memory:")
+    conn.execute("CREATE TABLE files (id INTEGER PRIMARY KEY, data BLOB)")
+    conn.execute("INSERT INTO files VALUES (1, zeroblob(10))")
+    conn.commit()
+    with conn.blobopen("files", "data", 1) as blob:
+        assert 10 == len(blob)
+        blob.write(b"hello")
+        blob.write(memoryview(b"world"))
+        assert 10 == blob.tell()
+        with pytest.raises(ValueError):
+            blob.write(b"!")
+        blob.seek(-5, 2)
+        assert b"wor" == blob.read(3)
+        blob.seek(0)
+        assert b"helloworld" == blob.read()
+        assert b"" == blob.read()
+    conn.commit()
+    assert [(b"helloworld",)] == conn.execute("SELECT data FROM files").fetchall()
+    blob = conn.blobopen("files", "data", 1, readonly=True)
+    assert b"hello" == blob.read(5)
+    blob.close()
+    with pytest.raises(Exception):
+        blob.read()
+
+
+def test_blob_buffers():
+    conn = libsql.connect(":memory:")
+    conn.execute("CREATE TABLE files (id INTEGER, data BLOB)")
+    conn.execute("INSERT INTO files VALUES (1, x'00010203')")
+    cur = conn.cursor()
+    assert not cur.blob_buffers
+    assert [(1, b"\x00\x01\x02\x03")] == cur.execute("SELECT * FROM files").fetchall()
+    conn.blob_buffers = True
+    cur = conn.cursor()
+    assert cur.blob_buffers
+    id, data = cur.execute("SELECT * FROM files").fetchone()
+    assert 1 == id
+    assert 4 == len(data)
+    assert b"\x00\x01\x02\x03" == memoryview(data).tobytes()
+    rows = cur.execute("SELECT data FROM files").fetchall()
+    assert b"\x00\x01\x02\x03" == bytes(rows[0][0])
+
+
 @pytest.mark.parametrize("provider", ["libsql-remote", "libsql", "sqlite"])
 def test_fetch_expression(provider):
     dbname = "/tmp/test.db" if provider == "libsql-remote" else ":memory:"
@@ -321,6 +598,657 @@ def test_int64(provider):
     assert [(1, 1099511627776)] == res.fetchall()
 
 
+@pytest.mark.parametrize("provider", ["libsql", "sqlite"])
+def test_concurrent_connections(provider):
+    import threading
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = f"{tmpdir}/test.db"
+        conn = connect(provider, path, isolation_level=None)
+        conn.execute("CREATE TABLE users (id INTEGER, email TEXT)")
+        conn.executemany(
+            "INSERT INTO users VALUES (?, ?)",
+            [(i, f"user{i}@example.com") for i in range(100)],
+        )
+        results = []
+
+        def worker():
+            worker_conn = connect(provider, path)
+            res = worker_conn.execute("SELECT COUNT(*) FROM users")
+            results.append(res.fetchone())
+            worker_conn.close()
+
+        threads = [threading.Thread(target=worker) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert [(100,)] * 8 == results
+        conn.close()
+
+
+def test_statement_cache():
+    conn = libsql.connect(":memory:", cached_statements=8)
+    conn.execute("CREATE TABLE users (id INTEGER, email TEXT)")
+    for i in range(3):
+        conn.execute("INSERT INTO users VALUES (?, ?)", (i, "alice@example.com"))
+    stats = conn.statement_cache_stats()
+    assert stats["misses"] == 2
+    assert stats["hits"] == 2
+    assert stats["size"] == 2
+    assert stats["capacity"] == 8
+
+
+def test_statement_cache_schema_change():
+    conn = libsql.connect(":memory:")
+    conn.row_factory = libsql.Row
+    conn.execute("CREATE TABLE users (id INTEGER)")
+    conn.execute("INSERT INTO users VALUES (1)")
+    cur = conn.execute("SELECT * FROM users")
+    assert ["id"] == cur.fetchone().keys()
+    conn.execute("ALTER TABLE users ADD COLUMN email TEXT")
+    cur = conn.execute("SELECT * FROM users")
+    assert ["id", "email"] == [column[0] for column in cur.description]
+    row = cur.fetchone()
+    assert ["id", "email"] == row.keys()
+    assert (1, None) == tuple(row)
+    conn.executescript("ALTER TABLE users RENAME COLUMN email TO mail;")
+    cur = conn.execute("SELECT * FROM users")
+    assert ["id", "mail"] == [column[0] for column in cur.description]
+
+
+def test_statement_cache_disabled():
+    conn = libsql.connect(":memory:", cached_statements=0)
+    conn.execute("CREATE TABLE users (id INTEGER, email TEXT)")
+    for i in range(3):
+        conn.execute("INSERT INTO users VALUES (?, ?)", (i, "alice@example.com"))
+    stats = conn.statement_cache_stats()
+    assert stats["hits"] == 0
+    assert stats["size"] == 0
+    res = conn.execute("SELECT COUNT(*) FROM users")
+    assert (3,) == res.fetchone()
+
+
+def test_pool():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        pool = libsql.Pool(f"{tmpdir}/pool.db", min_size=1, max_size=2)
+        assert 1 == pool.stats()["size"]
+        conn = pool.acquire()
+        conn.execute("CREATE TABLE users (id INTEGER)")
+        conn.execute("INSERT INTO users VALUES (1)")
+        conn.commit()
+        conn.close()
+        first = pool.acquire()
+        second = pool.acquire()
+        with pytest.raises(TimeoutError):
+            pool.acquire(timeout=0.05)
+        assert [(1,)] == first.execute("SELECT * FROM users").fetchall()
+        first.close()
+        third = pool.acquire(timeout=0.05)
+        stats = pool.stats()
+        assert 2 == stats["size"]
+        assert 2 == stats["in_use"]
+        assert 2 == stats["created"]
+        assert 1 == stats["timeouts"]
+        second.close()
+        third.close()
+        pool.close()
+        with pytest.raises(Exception):
+            pool.acquire()
+
+
+def test_pool_reset():
+    class Total:
+        def __init__(self):
+            self.total = 0
+
+        def step(self, value):
+            self.total += value
+
+        def finalize(self):
+            return self.total
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        pool = libsql.Pool(f"{tmpdir}/pool.db", max_size=1)
+        conn = pool.acquire()
+        conn.create_function("double", 1, lambda x: x * 2)
+        conn.create_aggregate("total", 1, Total)
+        conn.statement_timeout = 1.0
+        assert [(4, 2)] == conn.execute("SELECT double(2), total(2)").fetchall()
+        conn.close()
+        # The same connection comes back without the previous holder's
+        # functions and settings.
+        conn = pool.acquire()
+        assert 1 == pool.stats()["created"]
+        assert conn.statement_timeout is None
+        with pytest.raises(Exception, match="no such function"):
+            conn.execute("SELECT double(2)")
+        with pytest.raises(Exception, match="no such function"):
+            conn.execute("SELECT total(2)")
+        conn.close()
+        pool.close()
+
+
+def test_pool_reuse_with_cursor():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        pool = libsql.Pool(f"{tmpdir}/pool.db", max_size=1)
+        conn = pool.acquire()
+        cur = conn.execute("SELECT 1 UNION ALL SELECT 2")
+        assert (1,) == cur.fetchone()
+        conn.close()
+        # The cursor is closed with its connection, which goes back to the
+        # pool instead of being discarded.
+        with pytest.raises(ValueError):
+            cur.execute("SELECT 1")
+        conn = pool.acquire(timeout=0.05)
+        assert [(1,)] == conn.execute("SELECT 1").fetchall()
+        stats = pool.stats()
+        assert 1 == stats["created"]
+        assert 0 == stats["discarded"]
+        conn.close()
+        pool.close()
+
+
+def test_description_detect_types():
+    conn = libsql.connect(":memory:", detect_types=libsql.PARSE_DECLTYPES | libsql.PARSE_COLNAMES)
+    conn.execute("CREATE TABLE users (id INTEGER, created TIMESTAMP)")
+    sql = 'SELECT id, created, 1 AS "one [int]" FROM users'
+    cur = conn.execute(sql)
+    description = cur.description
+    assert (
+        ("id", "INTEGER", None, None, None, None, None),
+        ("created", "TIMESTAMP", None, None, None, None, None),
+        ("one", None, None, None, None, None, None),
+    ) == description
+    # The description is cached with the prepared statement.
+    assert cur.execute(sql).description is description
+    cur = libsql.connect(":memory:").execute('SELECT 1 AS "one [int]"')
+    assert (("one [int]", None, None, None, None, None, None),) == cur.description
+
+
+def test_converters():
+    conn = libsql.connect(":memory:", detect_types=libsql.PARSE_DECLTYPES | libsql.PARSE_COLNAMES)
+    conn.execute("CREATE TABLE events (at TIMESTAMP, day DATE, data JSON, embedding F32_BLOB(2))")
+    conn.execute(
+        "INSERT INTO events VALUES (?, ?, ?, ?)",
+        (
+            "2024-01-02 03:04:05.5+01:00",
+            "2024-01-02",
+            '{"a": [1, 2.5, null, true, "\\u00e9"]}',
+            struct.pack("<2f", 1.0, 0.5),
+        ),
+    )
+    conn.execute("INSERT INTO events VALUES (NULL, NULL, NULL, NULL)")
+    rows = conn.execute("SELECT * FROM events").fetchall()
+    tz = datetime.timezone(datetime.timedelta(hours=1))
+    assert (
+        datetime.datetime(2024, 1, 2, 3, 4, 5, 500000, tzinfo=tz),
+        datetime.date(2024, 1, 2),
+        {"a": [1, 2.5, None, True, "\u00e9"]},
+        [1.0, 0.5],
+    ) == rows[0]
+    assert (None, None, None, None) == rows[1]
+    libsql.register_converter("point", lambda value: tuple(map(float, value.split(b";"))))
+    cur = conn.execute("SELECT '1;2' AS `p [point]`, '[1]' AS `j [json]`")
+    assert ((1.0, 2.0), [1]) == cur.fetchone()
+    assert ("p", "j") == tuple(column[0] for column in cur.description)
+    res = libsql.connect(":memory:").execute("SELECT '[1]' AS `j [json]`")
+    assert ("[1]",) == res.fetchone()
+    nested = "[" * 200000 + "]" * 200000
+    with pytest.raises(RecursionError):
+        conn.execute("SELECT ? AS `j [json]`", (nested,)).fetchone()
+    assert ([[[]]],) == conn.execute("SELECT '[[[]]]' AS `j [json]`").fetchone()
+
+
+def test_vectors():
+    conn = libsql.connect(":memory:")
+    conn.execute("CREATE TABLE movies (title TEXT, embedding F32_BLOB(2))")
+    vector = libsql.vector32(array.array("d", [1.0, 2.0]))
+    assert struct.pack("<2f", 1.0, 2.0) == vector
+    assert struct.pack("<2f", 1.0, 2.0) == libsql.vector32([1, 2.0])
+    assert b"" == libsql.vector32([])
+    with pytest.raises(ValueError):
+        libsql.vector32([[1.0, 2.0]])
+    conn.execute("INSERT INTO movies VALUES (?, ?)", ("a", vector))
+    assert 0 == conn.executemany_vectors("INSERT INTO movies VALUES (?, ?)", [], []).rowcount
+    cur = conn.executemany_vectors(
+        "INSERT INTO movies VALUES (?, ?)", [[3, 4], [5, 6]], [("b",), ("c",)]
+    )
+    assert 2 == cur.rowcount
+    with pytest.raises(ValueError):
+        conn.executemany_vectors("INSERT INTO movies VALUES (?, ?)", [[7, 8]], [])
+    cur = conn.execute("SELECT title, embedding FROM movies ORDER BY title")
+    vectors = cur.fetch_vectors("embedding")
+    assert ((3, 2), "f") == (vectors.shape, vectors.format)
+    assert [[1.0, 2.0], [3.0, 4.0], [5.0, 6.0]] == memoryview(vectors).tolist()
+    cur = conn.execute("SELECT embedding FROM movies WHERE title = 'a'")
+    assert (struct.pack("<2f", 1.0, 2.0),) == cur.fetchone()
+
+
+def test_trace_callback_and_profiler():
+    conn = libsql.connect(":memory:")
+    traced = []
+    conn.set_trace_callback(traced.append)
+    conn.set_profiler(True)
+    conn.execute("CREATE TABLE users (id INTEGER, email TEXT)")
+    conn.executemany("INSERT INTO users VALUES (?, ?)", [(1, "a"), (2, "b")])
+    cur = conn.cursor()
+    for n in (1, 2, 3):
+        cur.execute(f"SELECT email FROM users WHERE id < {n}").fetchall()
+    cur.close()
+    conn.set_trace_callback(None)
+    conn.execute("SELECT 1")
+    assert [
+        "CREATE TABLE users (id INTEGER, email TEXT)",
+        "INSERT INTO users VALUES (?, ?)",
+        "INSERT INTO users VALUES (?, ?)",
+        "SELECT email FROM users WHERE id < 1",
+        "SELECT email FROM users WHERE id < 2",
+        "SELECT email FROM users WHERE id < 3",
+    ] == traced
+    stats = {s["sql"]: s for s in conn.profiler_stats(reset=True)}
+    select = stats["SELECT email FROM users WHERE id < ?"]
+    assert (3, 3) == (select["count"], select["rows"])
+    assert 0 < select["p50_seconds"] <= select["p99_seconds"] <= select["max_seconds"]
+    assert 3 == sum(select["histogram"]["bucket_counts"])
+    assert 2 == stats["INSERT INTO users VALUES (?, ?)"]["count"]
+    assert [] == conn.profiler_stats()
+
+
+RUNAWAY_QUERY = """
+WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n) SELECT max(i) FROM n
+"""
+
+
+@pytest.mark.parametrize("provider", ["libsql", "sqlite"])
+def test_interrupt(provider):
+    import threading
+
+    conn = connect(provider, ":memory:")
+    timer = threading.Timer(0.1, conn.interrupt)
+    timer.start()
+    with pytest.raises(Exception, match="interrupted"):
+        conn.execute(RUNAWAY_QUERY)
+    timer.join()
+    assert (1,) == conn.execute("SELECT 1").fetchone()
+
+
+def test_statement_timeout():
+    conn = libsql.connect(":memory:")
+    assert conn.statement_timeout is None
+    conn.statement_timeout = 0.1
+    with pytest.raises(TimeoutError):
+        conn.execute(RUNAWAY_QUERY)
+    assert (1,) == conn.execute("SELECT 1").fetchone()
+    # A fetch that times out loses the result set, so later fetches fail
+    # instead of reporting it exhausted.
+    cur = conn.execute(
+        "WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n) "
+        "SELECT i FROM n WHERE i = 1 OR i < 0"
+    )
+    assert (1,) == cur.fetchone()
+    with pytest.raises(TimeoutError):
+        cur.fetchone()
+    with pytest.raises(ValueError, match="aborted"):
+        cur.fetchall()
+    assert [(1,)] == cur.execute("SELECT 1").fetchall()
+    with pytest.raises(ValueError):
+        conn.statement_timeout = 0
+    conn.statement_timeout = None
+    assert conn.statement_timeout is None
+
+
+@pytest.mark.parametrize("provider", ["libsql", "sqlite"])
+def test_backup(provider):
+    src = connect(provider, ":memory:")
+    src.execute("CREATE TABLE users (id INTEGER PRIMARY KEY AUTOINCREMENT, email TEXT)")
+    src.execute("CREATE INDEX users_email ON users (email)")
+    src.executemany("INSERT INTO users (email) VALUES (?)", [("a",), ("b",)])
+    src.commit()
+    dst = connect(provider, ":memory:")
+    dst.execute("CREATE TABLE stale (x)")
+    remaining = []
+    src.backup(dst, pages=1, progress=lambda status, left, total: remaining.append(left))
+    assert [(1, "a"), (2, "b")] == dst.execute("SELECT * FROM users").fetchall()
+    assert 0 == remaining[-1]
+    with pytest.raises(Exception):
+        dst.execute("SELECT * FROM stale")
+
+
+@pytest.mark.parametrize("provider", ["libsql", "sqlite"])
+def test_backup_schema(provider):
+    src = connect(provider, ":memory:")
+    src.execute("CREATE TABLE users (id INTEGER PRIMARY KEY, email TEXT)")
+    src.execute(
+        "CREATE TABLE items (id INTEGER PRIMARY KEY, price REAL, "
+        "total REAL GENERATED ALWAYS AS (price * 2) STORED)"
+    )
+    src.execute("CREATE TABLE audit (email TEXT)")
+    src.execute(
+        "CREATE TRIGGER users_audit AFTER INSERT ON users "
+        "BEGIN INSERT INTO audit VALUES (new.email); END"
+    )
+    src.execute("CREATE VIEW emails AS SELECT email FROM users")
+    src.executemany("INSERT INTO users (email) VALUES (?)", [("a",), ("b",)])
+    src.execute("INSERT INTO items (price) VALUES (1.5)")
+    try:
+        src.execute("CREATE VIRTUAL TABLE docs USING fts5(body)")
+        src.execute("INSERT INTO docs VALUES ('hello world')")
+        fts5 = True
+    except Exception:
+        fts5 = False
+    src.commit()
+    dst = connect(provider, ":memory:")
+    src.backup(dst)
+    assert [("a",), ("b",)] == dst.execute("SELECT email FROM audit").fetchall()
+    assert [("a",), ("b",)] == dst.execute("SELECT * FROM emails").fetchall()
+    assert [(1, 1.5, 3.0)] == dst.execute("SELECT * FROM items").fetchall()
+    if fts5:
+        assert [("hello world",)] == dst.execute(
+            "SELECT body FROM docs WHERE docs MATCH 'hello'"
+        ).fetchall()
+    dst.execute("INSERT INTO users (email) VALUES ('c')")
+    assert [("a",), ("b",), ("c",)] == dst.execute("SELECT email FROM audit").fetchall()
+
+
+def test_serialize():
+    conn = libsql.connect(":memory:")
+    conn.execute("CREATE TABLE t (x)")
+    conn.execute("INSERT INTO t VALUES (1)")
+    conn.commit()
+    image = conn.serialize()
+    assert bytes(image).startswith(b"SQLite format 3\0")
+    copy = libsql.connect(":memory:")
+    copy.execute("CREATE TABLE t (y)")
+    copy.deserialize(image)
+    assert [(1,)] == copy.execute("SELECT * FROM t").fetchall()
+
+
+
+def test_snapshot_encrypted(tmp_path):
+    encrypted = libsql.connect(str(tmp_path / "encrypted.db"), encryption_key="secret")
+    encrypted.execute("CREATE TABLE t (x)")
+    encrypted.commit()
+    plain = libsql.connect(":memory:")
+    with pytest.raises(ValueError, match="encrypted"):
+        encrypted.serialize()
+    with pytest.raises(ValueError, match="encrypted"):
+        encrypted.backup(plain)
+    with pytest.raises(ValueError, match="encrypted"):
+        plain.backup(encrypted)
+    with pytest.raises(ValueError, match="encrypted"):
+        encrypted.deserialize(plain.serialize())
+    assert [] == encrypted.execute("SELECT * FROM t").fetchall()
+
+
+class Total:
+    def __init__(self):
+        self.total = 0
+
+    def step(self, value):
+        self.total += value if isinstance(value, int) else sum(value)
+
+    def finalize(self):
+        return self.total
+
+
+@pytest.mark.parametrize("provider", ["libsql", "sqlite"])
+def test_create_function(provider):
+    conn = connect(provider, ":memory:")
+    conn.create_function("twice", 1, lambda value: value * 2, deterministic=True)
+    conn.create_function("fail", 0, lambda: 1 / 0)
+    conn.create_aggregate("total", 1, Total)
+    assert ("aa", 4, None) == conn.execute("SELECT twice('a'), twice(2), twice(NULL)").fetchone()
+    with pytest.raises(Exception):
+        conn.execute("SELECT fail()").fetchone()
+    conn.execute("CREATE TABLE t (x)")
+    conn.executemany("INSERT INTO t VALUES (?)", [(n,) for n in range(10)])
+    assert (45,) == conn.execute("SELECT total(x) FROM t").fetchone()
+    conn.create_function("twice", 1, None)
+    with pytest.raises(Exception):
+        conn.execute("SELECT twice(1)").fetchone()
+
+
+@pytest.mark.parametrize("provider", ["libsql", "sqlite"])
+def test_create_function_buffer_result(provider):
+    conn = connect(provider, ":memory:")
+    conn.create_function("as_bytearray", 1, lambda value: bytearray(value))
+    conn.create_function("as_memoryview", 1, lambda value: memoryview(value))
+    assert (b"abc", b"abc") == conn.execute(
+        "SELECT as_bytearray(x'616263'), as_memoryview(x'616263')"
+    ).fetchone()
+    if provider == "libsql":
+        conn.create_function("every_other", 1, lambda value: memoryview(value)[::2])
+        assert (b"ac",) == conn.execute("SELECT every_other(x'616263')").fetchone()
+
+
+def test_create_aggregate_batched():
+    conn = libsql.connect(":memory:")
+    calls = []
+
+    class Chunks(Total):
+        def step(self, values):
+            calls.append(len(values))
+            super().step(values)
+
+    conn.create_aggregate("chunked_total", 1, Chunks, batched=True)
+    conn.execute("CREATE TABLE t (x)")
+    conn.executemany("INSERT INTO t VALUES (?)", [(n,) for n in range(3000)])
+    assert (4498500,) == conn.execute("SELECT chunked_total(x) FROM t").fetchone()
+    assert [1024, 1024, 952] == calls
+    assert (0,) == conn.execute("SELECT chunked_total(x) FROM t WHERE x < 0").fetchone()
+
+
+def test_batch():
+    conn = libsql.connect(":memory:")
+    conn.execute("CREATE TABLE users (id INTEGER PRIMARY KEY, email TEXT)")
+    results = conn.batch(
+        [
+            ("INSERT INTO users (email) VALUES (?)", ("alice@example.com",)),
+            ("INSERT INTO users (email) VALUES (:email)", {"email": "bob@example.com"}),
+            "SELECT id, email FROM users ORDER BY id;",
+        ],
+        mode="write",
+    )
+    assert [1, 1, -1] == [result.rowcount for result in results]
+    assert 2 == results[1].lastrowid
+    assert ("id", "email") == results[2].columns
+    assert [(1, "alice@example.com"), (2, "bob@example.com")] == results[2].rows
+    assert not conn.in_transaction
+    # A failing statement rolls back the whole batch.
+    with pytest.raises(ValueError):
+        conn.batch(["DELETE FROM users", "INSERT INTO missing VALUES (1)"])
+    with pytest.raises(ValueError):
+        conn.batch(["DELETE FROM users"], mode="read")
+    with pytest.raises(ValueError):
+        conn.batch(["DELETE FROM users; SELECT 1"])
+    assert (2,) == conn.execute("SELECT COUNT(*) FROM users").fetchone()
+    with pytest.raises(ValueError):
+        conn.executescript("DELETE FROM missing;")
+
+
+def test_batch_remote(remote_database):
+    conn = libsql.connect(remote_database)
+    results = conn.batch(
+        [
+            ("SELECT 1-?", (-5,)),
+            ("SELECT 1.5-?", (-0.5,)),
+            ("SELECT -? < 0", (float("-inf"),)),
+        ]
+    )
+    assert [[(6,)], [(2.0,)], [(0,)]] == [result.rows for result in results]
+    # The remote path enforces the batch mode before sending anything.
+    results = conn.batch(["WITH t(x) AS (SELECT 1) SELECT x FROM t", "VALUES (2)"], mode="read")
+    assert [[(1,)], [(2,)]] == [result.rows for result in results]
+    with pytest.raises(ValueError, match="not a query"):
+        conn.batch(["SELECT 1", "CREATE TABLE t (x)"], mode="read")
+    with pytest.raises(ValueError, match="not supported"):
+        conn.batch(["SELECT 1"], mode="write")
+    # A failing statement rolls back the writes before it.
+    conn.execute("CREATE TABLE users (id INTEGER)")
+    with pytest.raises(ValueError):
+        conn.batch(
+            [
+                "INSERT INTO users VALUES (1)",
+                "INSERT INTO missing VALUES (2)",
+                "INSERT INTO users VALUES (3)",
+            ]
+        )
+    assert (0,) == conn.execute("SELECT COUNT(*) FROM users").fetchone()
+    conn.close()
+
+
+def test_sync_stats():
+    conn = libsql.connect(":memory:")
+    assert 0 == conn.sync_stats()["syncs"]
+    # A local database is not a replica, so every sync fails.
+    with pytest.raises(ValueError):
+        conn.sync()
+    handle = conn.sync_async()
+    with pytest.raises(ValueError):
+        handle.result(timeout=5)
+    assert handle.done()
+    stats = conn.sync_stats()
+    assert 0 == stats["syncs"]
+    assert 2 == stats["errors"]
+    assert 0 == stats["in_progress"]
+
+
+def test_fetch_columns():
+    conn = libsql.connect(":memory:")
+    conn.execute("CREATE TABLE users (id INTEGER, score REAL, email TEXT, data BLOB)")
+    data = [
+        (1, 1.5, "alice@example.com", b"foo"),
+        (None, 2, None, b""),
+        (3, None, "bøb@example.com", None),
+    ]
+    conn.executemany("INSERT INTO users VALUES (?, ?, ?, ?)", data)
+    res = conn.execute("SELECT * FROM users")
+    ids, scores, emails, blobs = res.fetch_columns()
+    assert ["id", "score", "email", "data"] == [c.name for c in (ids, scores, emails, blobs)]
+    assert ["int64", "float64", "text", "blob"] == [
+        c.dtype for c in (ids, scores, emails, blobs)
+    ]
+    assert 3 == len(ids)
+    assert [1, 0, 3] == memoryview(ids.values).tolist()
+    assert [True, False, True] == memoryview(ids.validity).tolist()
+    assert 1 == ids.null_count
+    assert [1.5, 2.0, None] == scores.to_pylist()
+    assert [0, 17, 17, 33] == memoryview(emails.offsets).tolist()
+    assert "alice@example.combøb@example.com".encode() == bytes(emails.data)
+    assert [b"foo", b"", None] == blobs.to_pylist()
+    assert [] == res.fetchall()
+
+
+def test_dedicated_runtime():
+    conn = libsql.connect(":memory:", dedicated_runtime=True)
+    cur = conn.cursor()
+    cur.execute("CREATE TABLE users (id INTEGER, email TEXT)")
+    cur.execute("INSERT INTO users VALUES (?, ?)", (1, "alice@example.com"))
+    conn.commit()
+    res = cur.execute("SELECT * FROM users")
+    assert [(1, "alice@example.com")] == res.fetchall()
+    # Background syncs finish without the connection blocking on them.
+    handle = conn.sync_async()
+    deadline = time.monotonic() + 5
+    while not handle.done() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert handle.done()
+    with pytest.raises(ValueError):
+        handle.result()
+    conn.close()
+
+
+def test_runtime_metrics():
+    libsql.connect(":memory:").execute("SELECT 1").fetchone()
+    with pytest.raises(RuntimeError):
+        libsql.configure_runtime(worker_threads=2)
+    metrics = libsql.runtime_metrics()
+    assert metrics["workers"] >= 1
+    assert len(metrics["worker_busy_seconds"]) == metrics["workers"]
+    assert metrics["global_queue_depth"] >= 0
+    assert metrics["busy_seconds"] >= 0
+
+
+def test_aio_execute():
+    import asyncio
+    import libsql.aio
+
+    async def run():
+        conn = await libsql.aio.connect(":memory:")
+        await conn.execute("CREATE TABLE users (id INTEGER, email TEXT)")
+        await conn.executemany(
+            "INSERT INTO users VALUES (?, ?)",
+            [(1, "alice@example.com"), (2, "bob@example.com")],
+        )
+        assert conn.in_transaction
+        await conn.commit()
+        cur = await conn.execute("SELECT * FROM users")
+        assert (("id", None, None, None, None, None, None),
+                ("email", None, None, None, None, None, None)) == cur.description
+        assert (1, "alice@example.com") == await cur.fetchone()
+        assert [(2, "bob@example.com")] == await cur.fetchall()
+        assert [] == await cur.fetchall()
+        await conn.close()
+
+    asyncio.run(run())
+
+
+def test_aio_concurrent_queries():
+    import asyncio
+    import libsql.aio
+
+    async def count(conn):
+        cur = await conn.execute("SELECT COUNT(*) FROM users")
+        return await cur.fetchone()
+
+    async def run():
+        conn = await libsql.aio.connect(":memory:", isolation_level=None)
+        await conn.execute("CREATE TABLE users (id INTEGER, email TEXT)")
+        await conn.execute("INSERT INTO users VALUES (1, 'alice@example.com')")
+        results = await asyncio.gather(*[count(conn) for _ in range(16)])
+        assert [(1,)] * 16 == results
+        # Fetches on one cursor wait for each other instead of finding the
+        # result set missing.
+        await conn.execute("INSERT INTO users VALUES (2, 'bob@example.com')")
+        cur = await conn.execute("SELECT id FROM users ORDER BY id")
+        rows = await asyncio.gather(cur.fetchone(), cur.fetchone(), cur.fetchone())
+        assert [(1,), (2,), None] == sorted(rows, key=lambda row: row or (3,))
+        await conn.close()
+
+    asyncio.run(run())
+
+
+def test_aio_concurrent_writes():
+    import asyncio
+    import libsql.aio
+
+    async def run():
+        conn = await libsql.aio.connect(":memory:")
+        await conn.execute("CREATE TABLE users (id INTEGER)")
+        statements = []
+        conn.set_trace_callback(statements.append)
+        # Every insert would begin the implicit transaction if they were
+        # not serialized.
+        await asyncio.gather(
+            *[conn.execute("INSERT INTO users VALUES (?)", (i,)) for i in range(16)]
+        )
+        await conn.commit()
+        cur = await conn.execute("SELECT COUNT(*) FROM users")
+        assert (16,) == await cur.fetchone()
+        assert ["INSERT INTO users VALUES (?)"] * 16 + ["COMMIT"] == statements[:17]
+        with pytest.raises(ValueError, match="not supported"):
+            conn.row_factory = libsql.Row
+        with pytest.raises(ValueError, match="not supported"):
+            cur.row_factory = libsql.Row
+        with pytest.raises(ValueError, match="not supported"):
+            conn.statement_timeout = 1.0
+        conn.statement_timeout = None
+        await conn.close()
+
+    asyncio.run(run())
+
+
 def connect(provider, database, timeout=5, isolation_level="DEFERRED", autocommit=-1):
     if provider == "libsql-remote":
         from urllib import request